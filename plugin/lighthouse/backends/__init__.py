@@ -0,0 +1,14 @@
+from .backend import MetadataBackend, MetadataColumns
+from .file import FileMetadataBackend, export_metadata
+
+#
+# the IDA backend is only available when running inside of IDA. when used
+# headless, metadata must be loaded through one of the other backends
+#
+
+try:
+    from .ida import IDAMetadataBackend, BADADDR, metadata_progress, coverage_progress
+except ImportError:
+    from .backend import BADADDR
+    IDAMetadataBackend = None
+    metadata_progress = coverage_progress = None
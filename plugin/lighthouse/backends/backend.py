@@ -0,0 +1,138 @@
+import collections
+
+# the address used to denote an invalid (bad) address, as in 64bit IDA
+BADADDR = 0xFFFFFFFFFFFFFFFF
+
+#------------------------------------------------------------------------------
+# Metadata Backend
+#------------------------------------------------------------------------------
+#
+#    A metadata backend is the source that lighthouse lifts its database
+#    metadata (functions, nodes, instructions, edges) from. By hiding the
+#    underlying disassembler behind this interface, the metadata (and the
+#    coverage built on top of it) does not need to be bound to IDA.
+#
+#    The base backend defined here describes an empty database. Real
+#    backends are expected to override each of the providers below.
+#
+
+#
+# the metadata of a whole database, as parallel columns of values. see
+# MetadataBackend.get_columns() for more information
+#
+
+MetadataColumns = collections.namedtuple(
+    "MetadataColumns",
+    [
+        "function_addresses",   # sorted function addresses
+        "function_names",       # function names, parallel to the addresses
+        "node_starts",          # sorted node start addresses
+        "node_ends",            # node end addresses
+        "node_ids",             # node (flowchart) ids
+        "node_owners",          # index of the function owning each node
+        "shared_nodes",         # index of each node shared by another function
+        "shared_owners",        # index of the function sharing each node
+        "shared_ids",           # node (flowchart) id within the sharing function
+        "instructions",         # sorted instruction addresses
+        "edge_sources",         # edge source (instruction) addresses
+        "edge_destinations",    # edge destination (node) addresses
+        "edge_owners",          # index of the function owning each edge
+    ]
+)
+
+class MetadataBackend(object):
+    """
+    The interface used to collect database metadata.
+    """
+
+    def __init__(self):
+        self._rename_callback = None
+
+    #--------------------------------------------------------------------------
+    # Synchronization
+    #--------------------------------------------------------------------------
+
+    def execute_read(self, function, *args):
+        """
+        Execute the given function with read access to the database.
+
+        Backends that can only be read from a specific thread (eg, IDA)
+        should marshal the function to that thread before executing it.
+        """
+        return function(*args)
+
+    #--------------------------------------------------------------------------
+    # Event Hooks
+    #--------------------------------------------------------------------------
+
+    def hook_renames(self, callback):
+        """
+        Install a callback to be notified of renames in the database.
+
+        The callback is called as callback(address, new_name, local_name).
+        """
+        self._rename_callback = callback
+
+    def unhook_renames(self):
+        """
+        Remove the installed rename callback.
+        """
+        self._rename_callback = None
+
+    #--------------------------------------------------------------------------
+    # Providers
+    #--------------------------------------------------------------------------
+
+    def get_columns(self):
+        """
+        Get the metadata of the whole database as MetadataColumns.
+
+        Backends that already hold the whole database in bulk (eg, a metadata
+        file) should return its columns, so that the metadata can be built
+        from them in one pass, rather than collected function by function.
+
+        Returns None if the metadata must be collected function by function.
+        """
+        return None
+
+    def get_function_addresses(self):
+        """
+        Get the addresses of all the functions in the database.
+        """
+        return []
+
+    def get_function_owners(self, addresses):
+        """
+        Get the addresses of the functions that contain the given addresses.
+        """
+        return set()
+
+    def get_function_name(self, function_address):
+        """
+        Get the name of the function at the given address.
+        """
+        return None
+
+    def get_function_nodes(self, function_address):
+        """
+        Get the nodes (basic blocks) of the function at the given address.
+
+        Returns a list of (start_address, end_address, node_id) tuples.
+        """
+        return []
+
+    def get_function_instructions(self, function_address):
+        """
+        Get the instruction addresses of the function at the given address.
+
+        Returns a sorted sequence of addresses.
+        """
+        return []
+
+    def get_edges(self, addresses):
+        """
+        Get the code edges leaving the instructions at the given addresses.
+
+        Returns a list of (src, dst) tuples.
+        """
+        return []
@@ -0,0 +1,397 @@
+import sys
+import array
+import bisect
+import struct
+import logging
+import operator
+import itertools
+import collections
+
+from .backend import MetadataBackend, MetadataColumns
+
+logger = logging.getLogger("Lighthouse.Backends.File")
+
+#------------------------------------------------------------------------------
+# File Metadata Backend
+#------------------------------------------------------------------------------
+#
+#    The file backend serves metadata that was previously exported from a
+#    database (eg, by IDA) with export_metadata(). This allows lighthouse to
+#    map, compose, and report on coverage without IDA, such as in worker
+#    processes, or on machines that do not have IDA available at all.
+#
+#    Metadata files are columnar. Rather than storing a record per function
+#    or node, each attribute is stored as one packed array of values that
+#    runs parallel to the others. Columns are packed and unpacked whole as
+#    machine arrays, which makes loading metadata very fast.
+#
+#    A node (eg, a shared function chunk) can belong to more than one
+#    function. Each node is stored once, under the function that owns it in
+#    the exported metadata, while the other functions containing it are
+#    listed in the shared node columns. Similarly, each edge is stored with
+#    the function it belongs to, so the exported functions are reproduced
+#    exactly when the file is loaded.
+#
+#    The file layout is as follows (all values are little endian):
+#
+#      header                 - see METADATA_HEADER
+#      function addresses     - u64 * function_count (sorted)
+#      function names         - names_size bytes, NULL separated
+#      node addresses         - u64 * node_count (sorted)
+#      node sizes             - u32 * node_count
+#      node ids               - u32 * node_count
+#      node owners            - u32 * node_count (index of owning function)
+#      shared nodes           - u32 * shared_count (index of shared node)
+#      shared node owners     - u32 * shared_count (index of sharing function)
+#      shared node ids        - u32 * shared_count
+#      instruction addresses  - u64 * instruction_count (sorted)
+#      edge sources           - u64 * edge_count
+#      edge destinations      - u64 * edge_count
+#      edge owners            - u32 * edge_count (index of owning function)
+#
+
+METADATA_MAGIC   = "LHMD"
+METADATA_VERSION = 3
+
+# magic, version, function/node/shared/instruction/edge counts, names size
+METADATA_HEADER  = struct.Struct("<4sIIIIIII")
+
+def _array_typecode(size):
+    """
+    Return the array typecode for unsigned values of the given size.
+
+    Returns None if the host has no array type of that size (eg, 64bit
+    values on Windows builds of python 2), and columns of that size are
+    packed with struct instead.
+    """
+    for typecode in "BHIL":
+        if array.array(typecode).itemsize == size:
+            return typecode
+    return None
+
+# struct typecode --> array typecode, for the columns of the metadata file
+COLUMN_TYPECODES = \
+{
+    "I": _array_typecode(4),
+    "Q": _array_typecode(8),
+}
+
+class FileMetadataBackend(MetadataBackend):
+    """
+    A metadata backend that serves metadata from an exported metadata file.
+    """
+
+    def __init__(self, filepath):
+        super(FileMetadataBackend, self).__init__()
+
+        # the exported metadata file
+        self.filepath = filepath
+
+        # function metadata
+        self._function_names = {}
+        self._function_nodes = {}
+
+        # node lookup lists, sorted by node address
+        self._node_starts = []
+        self._node_ends = []
+        self._node_owners = []
+
+        # node index --> addresses of the other functions sharing the node
+        self._node_sharers = collections.defaultdict(list)
+
+        # instruction & edge metadata
+        self._instructions = []
+        self._successors = collections.defaultdict(list)
+
+        # the decoded metadata columns (see get_columns)
+        self._columns = None
+
+        # load the exported metadata
+        self._load_metadata(filepath)
+
+    #--------------------------------------------------------------------------
+    # Providers
+    #--------------------------------------------------------------------------
+
+    def get_columns(self):
+        """
+        Get the metadata of the whole database as MetadataColumns.
+        """
+        return self._columns
+
+    def get_function_addresses(self):
+        """
+        Get the addresses of all the functions in the database.
+        """
+        return self._function_names.keys()
+
+    def get_function_owners(self, addresses):
+        """
+        Get the addresses of the functions that contain the given addresses.
+        """
+        function_addresses = set()
+
+        for address in addresses:
+            index = bisect.bisect_right(self._node_starts, address) - 1
+            if index >= 0 and address < self._node_ends[index]:
+                function_addresses.add(self._node_owners[index])
+                function_addresses.update(self._node_sharers.get(index, []))
+
+        return function_addresses
+
+    def get_function_name(self, function_address):
+        """
+        Get the name of the function at the given address.
+        """
+        return self._function_names.get(function_address, None)
+
+    def get_function_nodes(self, function_address):
+        """
+        Get the nodes (basic blocks) of the function at the given address.
+        """
+        return self._function_nodes.get(function_address, [])
+
+    def get_function_instructions(self, function_address):
+        """
+        Get the instruction addresses of the function at the given address.
+        """
+        instructions = []
+
+        # slice the instructions of each function node from the sorted index
+        for start_address, end_address, _ in sorted(self.get_function_nodes(function_address)):
+            index_start = bisect.bisect_left(self._instructions, start_address)
+            index_end   = bisect.bisect_left(self._instructions, end_address)
+            instructions.extend(self._instructions[index_start:index_end])
+
+        return instructions
+
+    def get_edges(self, addresses):
+        """
+        Get the code edges leaving the instructions at the given addresses.
+        """
+        return [(src, dst) for src in addresses for dst in self._successors.get(src, [])]
+
+    #--------------------------------------------------------------------------
+    # Loading
+    #--------------------------------------------------------------------------
+
+    def _load_metadata(self, filepath):
+        """
+        Load the exported metadata file.
+        """
+        with open(filepath, "rb") as f:
+            data = f.read()
+
+        # parse the metadata header
+        try:
+            magic, version, function_count, node_count, shared_count, \
+                instruction_count, edge_count, names_size = METADATA_HEADER.unpack_from(data)
+        except struct.error:
+            raise ValueError("Invalid metadata file %s" % filepath)
+
+        # sanity check the metadata magic & version
+        if magic != METADATA_MAGIC:
+            raise ValueError("Invalid metadata file %s" % filepath)
+        if version != METADATA_VERSION:
+            raise ValueError("Unsupported metadata version %u" % version)
+
+        reader = _ColumnReader(data, METADATA_HEADER.size)
+
+        # unpack the metadata columns
+        function_addresses = reader.read("Q", function_count)
+        function_names     = reader.read_bytes(names_size).split("\x00") if function_count else []
+        node_starts        = reader.read("Q", node_count)
+        node_sizes         = reader.read("I", node_count)
+        node_ids           = reader.read("I", node_count)
+        node_owners        = reader.read("I", node_count)
+        shared_nodes       = reader.read("I", shared_count)
+        shared_owners      = reader.read("I", shared_count)
+        shared_ids         = reader.read("I", shared_count)
+        instructions       = reader.read("Q", instruction_count)
+        edge_sources       = reader.read("Q", edge_count)
+        edge_destinations  = reader.read("Q", edge_count)
+        edge_owners        = reader.read("I", edge_count)
+
+        # build the function metadata maps
+        self._function_names = dict(itertools.izip(function_addresses, function_names))
+        self._function_nodes = { address: [] for address in function_addresses }
+
+        # build the node lookup lists
+        node_ends = map(operator.add, node_starts, node_sizes)
+        self._node_starts = list(node_starts)
+        self._node_ends   = node_ends
+        self._node_owners = [function_addresses[owner] for owner in node_owners]
+
+        # bucket the nodes by their owning function
+        for node in itertools.izip(node_starts, node_ends, node_ids, self._node_owners):
+            self._function_nodes[node[3]].append(node[:3])
+
+        # add the shared nodes to the other functions containing them
+        for index, owner, node_id in itertools.izip(shared_nodes, shared_owners, shared_ids):
+            function_address = function_addresses[owner]
+            self._function_nodes[function_address].append((node_starts[index], node_ends[index], node_id))
+            self._node_sharers[index].append(function_address)
+
+        #
+        # load the instruction & edge metadata. an edge leaving a shared node
+        # is stored once for each function it belongs to, but is only served
+        # once (as it would be by the database)
+        #
+
+        self._instructions = list(instructions)
+        loaded_edges = set()
+        for edge in itertools.izip(edge_sources, edge_destinations):
+            if edge not in loaded_edges:
+                loaded_edges.add(edge)
+                self._successors[edge[0]].append(edge[1])
+
+        # keep the decoded columns, so the metadata can be built from them in bulk
+        self._columns = MetadataColumns(
+            function_addresses,
+            function_names,
+            node_starts,
+            node_ends,
+            node_ids,
+            node_owners,
+            shared_nodes,
+            shared_owners,
+            shared_ids,
+            self._instructions,
+            edge_sources,
+            edge_destinations,
+            edge_owners
+        )
+
+        logger.debug("Loaded metadata for %u functions from %s" % (function_count, filepath))
+
+class _ColumnReader(object):
+    """
+    A sequential reader of packed metadata columns.
+    """
+
+    def __init__(self, data, offset):
+        self._data = data
+        self._offset = offset
+
+    def read(self, typecode, count):
+        """
+        Read a column of count packed values of the given struct typecode.
+        """
+        size = struct.calcsize("<%s" % typecode) * count
+        data = self._data[self._offset:self._offset+size]
+        if len(data) != size:
+            raise ValueError("Truncated metadata file")
+        self._offset += size
+
+        # fall back to struct if the host has no array type of this size
+        array_typecode = COLUMN_TYPECODES[typecode]
+        if not array_typecode:
+            return struct.unpack("<%u%s" % (count, typecode), data)
+
+        values = array.array(array_typecode)
+        values.fromstring(data)
+        if sys.byteorder == "big":
+            values.byteswap()
+        return values
+
+    def read_bytes(self, size):
+        """
+        Read a column of raw bytes.
+        """
+        data = self._data[self._offset:self._offset+size]
+        self._offset += size
+        return data
+
+#------------------------------------------------------------------------------
+# Export
+#------------------------------------------------------------------------------
+
+def export_metadata(metadata, filepath, edges=None):
+    """
+    Export the given (collected) database metadata to a file.
+
+    If given, edges maps each function address to the list of its (src, dst)
+    edges. Otherwise, the edges of each function metadata object are used.
+
+    The exported file can be loaded with a FileMetadataBackend.
+    """
+    function_addresses = sorted(metadata.functions.viewkeys())
+    function_names = [metadata.functions[address].name or "" for address in function_addresses]
+    function_ordinals = { address: i for i, address in enumerate(function_addresses) }
+
+    # build the node columns, sorted by node address
+    nodes = sorted(metadata.nodes.itervalues(), key=operator.attrgetter("address"))
+    node_starts = [node.address for node in nodes]
+    node_sizes  = [node.size for node in nodes]
+    node_ids    = [node.id for node in nodes]
+    node_owners = [function_ordinals[node.function.address] for node in nodes]
+    node_indexes = { address: i for i, address in enumerate(node_starts) }
+
+    #
+    # build the shared node columns, listing the nodes that also belong to
+    # functions other than the one they are stored under
+    #
+
+    shared_nodes, shared_owners, shared_ids = [], [], []
+    for ordinal, address in enumerate(function_addresses):
+        for node_address, node in sorted(metadata.functions[address].nodes.iteritems()):
+            index = node_indexes[node_address]
+            if node_owners[index] != ordinal:
+                shared_nodes.append(index)
+                shared_owners.append(ordinal)
+                shared_ids.append(node.id)
+
+    # build the edge columns
+    if edges is None:
+        edges = { address: metadata.functions[address].edges for address in function_addresses }
+    edge_sources, edge_destinations, edge_owners = [], [], []
+    for ordinal, address in enumerate(function_addresses):
+        for src, dst in edges.get(address, None) or []:
+            edge_sources.append(src)
+            edge_destinations.append(dst)
+            edge_owners.append(ordinal)
+
+    # function names are stored as a single NULL separated blob
+    names = "\x00".join(function_names)
+
+    header = METADATA_HEADER.pack(
+        METADATA_MAGIC,
+        METADATA_VERSION,
+        len(function_addresses),
+        len(nodes),
+        len(shared_nodes),
+        len(metadata.instructions),
+        len(edge_sources),
+        len(names)
+    )
+
+    with open(filepath, "wb") as f:
+        f.write(header)
+        f.write(_pack_column("Q", function_addresses))
+        f.write(names)
+        f.write(_pack_column("Q", node_starts))
+        f.write(_pack_column("I", node_sizes))
+        f.write(_pack_column("I", node_ids))
+        f.write(_pack_column("I", node_owners))
+        f.write(_pack_column("I", shared_nodes))
+        f.write(_pack_column("I", shared_owners))
+        f.write(_pack_column("I", shared_ids))
+        f.write(_pack_column("Q", metadata.instructions))
+        f.write(_pack_column("Q", edge_sources))
+        f.write(_pack_column("Q", edge_destinations))
+        f.write(_pack_column("I", edge_owners))
+
+def _pack_column(typecode, values):
+    """
+    Pack a column of values with the given struct typecode.
+    """
+    array_typecode = COLUMN_TYPECODES[typecode]
+
+    # fall back to struct if the host has no array type of this size
+    if not array_typecode:
+        return "".join(itertools.imap(struct.Struct("<%s" % typecode).pack, values))
+
+    column = array.array(array_typecode, values)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column.tostring()
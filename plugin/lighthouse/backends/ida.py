@@ -0,0 +1,210 @@
+import logging
+
+import idaapi
+import idautils
+
+from lighthouse.util import *
+from .backend import MetadataBackend
+
+# the address used by IDA to denote an invalid (bad) address
+BADADDR = idaapi.BADADDR
+
+logger = logging.getLogger("Lighthouse.Backends.IDA")
+
+#------------------------------------------------------------------------------
+# IDA Metadata Backend
+#------------------------------------------------------------------------------
+
+class IDAMetadataBackend(MetadataBackend):
+    """
+    A metadata backend that collects metadata from the open IDA database.
+    """
+
+    def __init__(self):
+        super(IDAMetadataBackend, self).__init__()
+
+        # hook to listen for rename events from IDA
+        self._rename_hooks = RenameHooks()
+        self._rename_hooks.renamed = self._name_changed
+
+    #--------------------------------------------------------------------------
+    # Synchronization
+    #--------------------------------------------------------------------------
+
+    def execute_read(self, function, *args):
+        """
+        Execute the given function with read access to the database.
+        """
+        return execute_sync(idaapi.MFF_READ)(function)(*args)
+
+    #--------------------------------------------------------------------------
+    # Event Hooks
+    #--------------------------------------------------------------------------
+
+    def hook_renames(self, callback):
+        """
+        Install a callback to be notified of renames in the database.
+        """
+        super(IDAMetadataBackend, self).hook_renames(callback)
+        self._rename_hooks.hook()
+
+    def unhook_renames(self):
+        """
+        Remove the installed rename callback.
+        """
+        self._rename_hooks.unhook()
+        super(IDAMetadataBackend, self).unhook_renames()
+
+    @mainthread
+    def _name_changed(self, address, new_name, local_name):
+        """
+        Handler for rename event in IDA.
+        """
+        if self._rename_callback:
+            self._rename_callback(address, new_name, local_name)
+
+        # necessary for IDP/IDB_Hooks
+        return 0
+
+    #--------------------------------------------------------------------------
+    # Providers
+    #--------------------------------------------------------------------------
+
+    def get_function_addresses(self):
+        """
+        Get the addresses of all the functions in the database.
+        """
+        return list(idautils.Functions())
+
+    @execute_sync(idaapi.MFF_READ)
+    def get_function_owners(self, addresses):
+        """
+        Get the addresses of the functions that contain the given addresses.
+        """
+        function_addresses = set()
+
+        # NOTE/COMPAT: we do a single api check *outside* the loop for perf
+        if using_ida7api:
+            for address in addresses:
+                function = idaapi.get_func(address)
+                if function:
+                    function_addresses.add(function.start_ea)
+        else:
+            for address in addresses:
+                function = idaapi.get_func(address)
+                if function:
+                    function_addresses.add(function.startEA)
+
+        return function_addresses
+
+    def get_function_name(self, function_address):
+        """
+        Get the name of the function at the given address.
+        """
+        return idaapi.get_short_name(function_address)
+
+    def get_function_nodes(self, function_address):
+        """
+        Get the nodes (basic blocks) of the function at the given address.
+        """
+        nodes = []
+
+        # get function & flowchart object from database
+        function  = idaapi.get_func(function_address)
+        flowchart = idaapi.qflow_chart_t("", function, idaapi.BADADDR, idaapi.BADADDR, 0)
+
+        #
+        # now we will walk the flowchart for this function, collecting
+        # the bounds of each of its nodes (basic blocks)
+        #
+
+        for node_id in xrange(flowchart.size()):
+            node = flowchart[node_id]
+
+            # NOTE/COMPAT:
+            if using_ida7api:
+                node_start = node.start_ea
+                node_end   = node.end_ea
+            else:
+                node_start = node.startEA
+                node_end   = node.endEA
+
+            #
+            # the node size as this flowchart sees it is 'zero'. This means
+            # that another flowchart / function owns this node so we can just
+            # ignore it.
+            #
+
+            if node_start == node_end:
+                continue
+
+            #
+            # if the current node_start address does not fall within the
+            # original / entry 'function chunk', we want to ignore it.
+            #
+            # this check is used as an attempt to ignore the try/catch/SEH
+            # exception handling blocks that IDA 7 parses and displays in
+            # the graph view (and therefore, the flowcahrt).
+            #
+            # practically speaking, 99% of the time people aren't going to be
+            # interested in the coverage information on their exception
+            # handlers. I am skeptical that dynamic instrumentation tools
+            # would be able to collect coverage in these handlers anway...
+            #
+
+            if idaapi.get_func_chunknum(function, node_start):
+                continue
+
+            nodes.append((node_start, node_end, node_id))
+
+        # return the function nodes
+        return nodes
+
+    def get_function_instructions(self, function_address):
+        """
+        Get the instruction addresses of the function at the given address.
+        """
+
+        #
+        # enumerate the instructions of the entire function (all its chunks)
+        # in one pass, rather than walking the items of each node one by one.
+        # the function chunks are not guaranteed to be in address order.
+        #
+
+        return sorted(idautils.FuncItems(function_address))
+
+    @execute_sync(idaapi.MFF_READ)
+    def get_edges(self, addresses):
+        """
+        Get the code edges leaving the instructions at the given addresses.
+        """
+        return [(src, dst) for src in addresses for dst in idautils.CodeRefsFrom(src, True)]
+
+#------------------------------------------------------------------------------
+# Helpers
+#------------------------------------------------------------------------------
+
+@idafast
+def metadata_progress(completed, total):
+    """
+    Handler for metadata collection callback, updates progress dialog.
+    """
+    idaapi.replace_wait_box("Collected metadata for %u/%u Functions" % (completed, total))
+
+@idafast
+def coverage_progress(completed, total):
+    """
+    Handler for coverage mapping callback, updates progress dialog.
+    """
+    idaapi.replace_wait_box("Refreshing coverage mapping %u/%u" % (completed, total))
+
+#------------------------------------------------------------------------------
+# Event Hooks
+#------------------------------------------------------------------------------
+
+if using_ida7api:
+    class RenameHooks(idaapi.IDB_Hooks):
+        pass
+else:
+    class RenameHooks(idaapi.IDP_Hooks):
+        pass
@@ -1,2 +1,9 @@
-from .shell import ComposingShell
 from .parser import CompositionParser
+
+# the composing shell is a Qt widget, unavailable when used headless
+try:
+    import idaapi
+except ImportError:
+    pass
+else:
+    from .shell import ComposingShell
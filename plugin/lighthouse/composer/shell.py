@@ -323,17 +323,20 @@ class ComposingShell(QtWidgets.QWidget):
         self._command_timer.stop()
 
         #
-        # if the functions list is HUGE, we want to defer the filtering until
-        # we think the user has stopped typing as each pass may take awhile
-        # to compute (while blocking the main thread...)
+        # function names are searched through the metadata's name index, so
+        # even HUGE databases can usually be filtered inline, as the user types.
+        #
+        # but queries too short to be served by the (trigram) name index must
+        # test every function name. if the functions list is HUGE, we defer
+        # these until we think the user has stopped typing
         #
 
-        if self._director.metadata.is_big():
+        if len(self._search_text) < 3 and self._director.metadata.is_big():
             self._command_timer = singleshot(1000, self._execute_search_internal)
             self._command_timer.start()
 
         #
-        # the database is not *massive*, let's execute the search immediately
+        # the query can be served by the index, let's execute it immediately
         #
 
         else:
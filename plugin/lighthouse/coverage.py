@@ -1,15 +1,35 @@
+import os
+import mmap
+import array
+import bisect
 import logging
 import weakref
+import operator
+import tempfile
 import itertools
 import collections
 
 from lighthouse.util import *
-from lighthouse.palette import compute_color_on_gradiant
-from lighthouse.painting import *
-from lighthouse.metadata import DatabaseMetadata
+from lighthouse.backends import MetadataBackend, BADADDR
+from lighthouse.metadata import DatabaseMetadata, BADINSTRUCTION
 
 logger = logging.getLogger("Lighthouse.Coverage")
 
+# the largest hit count that can be stored for an instruction (uint32)
+MAX_HITS = 0xFFFFFFFF
+
+# the estimated memory (in bytes) held by each mapped instruction, node, function
+MAPPED_INSTRUCTION_SIZE = 100
+MAPPED_NODE_SIZE = 400
+MAPPED_FUNCTION_SIZE = 500
+
+#
+# coverage is mapped against this shared, empty metadata stub until the
+# director binds it to the live database metadata (see update_metadata)
+#
+
+NULL_METADATA = DatabaseMetadata(MetadataBackend())
+
 #------------------------------------------------------------------------------
 # Coverage / Data Mapping
 #------------------------------------------------------------------------------
@@ -28,6 +48,608 @@ logger = logging.getLogger("Lighthouse.Coverage")
 #    refreshed by the user.
 #
 
+#------------------------------------------------------------------------------
+# Coverage Masks
+#------------------------------------------------------------------------------
+
+class CoverageMask(object):
+    """
+    An instruction-level coverage mask (a set of addresses).
+
+    The mask is stored as a compressed bitmap over the instruction ordinals
+    of a metadata snapshot, plus a (typically small) set of 'sparse'
+    addresses that are not known instructions in that snapshot.
+
+    Set operations between masks (|, &, ^, -) are computed over the
+    compressed bitmaps, rather than element by element. Masks may also be
+    combined with plain python sets of addresses.
+    """
+
+    def __init__(self, snapshot, bitmap=None, sparse=frozenset()):
+        self.snapshot = snapshot
+        self.bitmap = bitmap or CompressedBitmap()
+        self.sparse = frozenset(sparse)
+
+    @classmethod
+    def from_addresses(cls, snapshot, addresses):
+        """
+        Build a coverage mask of the given addresses.
+        """
+        addresses = sorted(set(addresses))
+        ordinals = snapshot.get_instruction_nums(addresses)
+
+        # split the addresses into known instructions, and sparse addresses
+        sparse = [address for address, ordinal in itertools.izip(addresses, ordinals) if ordinal == BADINSTRUCTION]
+        bitmap = CompressedBitmap.from_ordinals(x for x in ordinals if x != BADINSTRUCTION)
+
+        return cls(snapshot, bitmap, sparse)
+
+    def rebase(self, snapshot):
+        """
+        Return this mask, expressed against the given metadata snapshot.
+        """
+        if snapshot is self.snapshot:
+            return self
+
+        # snapshots that share an instruction list share instruction ordinals
+        if snapshot.instructions is self.snapshot.instructions:
+            return CoverageMask(snapshot, self.bitmap, self.sparse)
+
+        return CoverageMask.from_addresses(snapshot, self)
+
+    def _coerce(self, other):
+        """
+        Convert the given operand to a mask against our metadata snapshot.
+        """
+        if isinstance(other, CoverageMask):
+            return other.rebase(self.snapshot)
+        return CoverageMask.from_addresses(self.snapshot, other)
+
+    #--------------------------------------------------------------------------
+    # Operator Overloads
+    #--------------------------------------------------------------------------
+
+    def __or__(self, other):
+        other = self._coerce(other)
+        return CoverageMask(self.snapshot, self.bitmap | other.bitmap, self.sparse | other.sparse)
+
+    def __and__(self, other):
+        other = self._coerce(other)
+        return CoverageMask(self.snapshot, self.bitmap & other.bitmap, self.sparse & other.sparse)
+
+    def __xor__(self, other):
+        other = self._coerce(other)
+        return CoverageMask(self.snapshot, self.bitmap ^ other.bitmap, self.sparse ^ other.sparse)
+
+    def __sub__(self, other):
+        other = self._coerce(other)
+        return CoverageMask(self.snapshot, self.bitmap - other.bitmap, self.sparse - other.sparse)
+
+    #
+    # when a plain python set of addresses is the left operand of a set
+    # operation against a mask, the result is also a plain set
+    #
+
+    def __ror__(self, other):
+        return set(self | other)
+
+    def __rand__(self, other):
+        return set(self & other)
+
+    def __rxor__(self, other):
+        return set(self ^ other)
+
+    def __rsub__(self, other):
+        return set(self._coerce(other) - self)
+
+    def __iter__(self):
+        instructions = self.snapshot.instructions
+        for ordinal in self.bitmap:
+            yield instructions[ordinal]
+        for address in self.sparse:
+            yield address
+
+    def __len__(self):
+        return len(self.bitmap) + len(self.sparse)
+
+    def __nonzero__(self):
+        return bool(self.bitmap or self.sparse)
+
+    def __contains__(self, address):
+        ordinal = self.snapshot.get_instruction_num(address)
+        if ordinal == BADINSTRUCTION:
+            return address in self.sparse
+        return ordinal in self.bitmap
+
+#------------------------------------------------------------------------------
+# Execution Traces
+#------------------------------------------------------------------------------
+#
+#    Folding an execution trace into a hitmap discards the order in which
+#    instructions were executed. A trace store keeps the ordered stream of
+#    trace events, so that questions about *when* code was executed can be
+#    answered (eg, 'what code was new since step k').
+#
+#    Events are stored as the (u32) instruction ordinal of each executed
+#    address, appended to a file on disk that is memory mapped for reading.
+#    To keep queries fast on very long traces, the store also maintains:
+#
+#      - first-seen indexes: the event at which each instruction was first
+#        executed, in the order they were first executed
+#
+#      - chunk summaries: the coverage (a compressed bitmap) of each chunk
+#        of TRACE_CHUNK_SIZE events, so that the coverage of a range of
+#        events only needs to scan the partial chunks at its edges
+#
+
+# the number of trace events summarized by each chunk
+TRACE_CHUNK_SIZE = 1 << 20
+
+# the event stored for addresses that are not known instructions
+UNKNOWN_EVENT = 0xFFFFFFFF
+
+#
+# event numbers can exceed 32 bits, so first-seen events are stored as
+# 64bit integers. hosts without a 64bit array type (eg, Windows builds of
+# python 2) store them as doubles, which represent integers exactly up to
+# 2^53
+#
+
+EVENT_TYPECODE = "L" if array.array("L").itemsize == 8 else "d"
+
+# a bytearray translation table that flips flags (0 <--> 1)
+FLIP_FLAGS = "\x01\x00" + "\x00" * 254
+
+class TraceStore(object):
+    """
+    An ordered store of execution trace events.
+    """
+
+    def __init__(self, snapshot, filepath=None):
+        self.snapshot = snapshot
+
+        # the file holding the events, memory mapped for reading
+        if filepath:
+            self._file = open(filepath, "w+b")
+        else:
+            self._file = tempfile.TemporaryFile()
+        self._mmap = None
+        self._mapped_size = 0
+
+        # events that have not been flushed to the file (one partial chunk)
+        self._buffer = array.array("I")
+        self._length = 0
+
+        # the coverage of each (complete) chunk of events
+        self._chunks = []
+
+        #
+        # the first-seen indexes. _first_rank maps an instruction ordinal
+        # to its position (+1) in the first-seen order, which is held by
+        # the two parallel arrays _first_ordinals and _first_events
+        #
+
+        self._first_rank = array.array("I", [0]) * len(snapshot.instructions)
+        self._first_ordinals = array.array("I")
+        self._first_events = array.array(EVENT_TYPECODE)
+
+        # the first execution of each node, computed on request
+        self._node_events = None
+
+        # the unique transitions between consecutive events, computed on request
+        self._transitions = set()
+        self._transitions_length = 0
+
+    def __len__(self):
+        return self._length
+
+    #--------------------------------------------------------------------------
+    # Recording
+    #--------------------------------------------------------------------------
+
+    def append(self, addresses):
+        """
+        Append the given (ordered) instruction addresses to the trace.
+        """
+        for start in xrange(0, len(addresses), TRACE_CHUNK_SIZE):
+            events = self._resolve(addresses[start:start+TRACE_CHUNK_SIZE])
+            self._record_first_seen(events)
+
+            self._buffer.extend(events)
+            self._length += len(events)
+
+            # flush any complete chunks of events to disk
+            while len(self._buffer) >= TRACE_CHUNK_SIZE:
+                self._flush_chunk()
+
+        self._node_events = None
+
+    def _resolve(self, addresses):
+        """
+        Resolve the given instruction addresses to trace events, in bulk.
+        """
+
+        #
+        # the ordinals of the unique addresses are resolved with a single
+        # (forward) bisection pass over the instruction list. the events are
+        # then mapped from those without stepping through them in python
+        #
+
+        unique = sorted(set(addresses))
+        ordinals = [
+            ordinal if ordinal != BADINSTRUCTION else UNKNOWN_EVENT
+            for ordinal in self.snapshot.get_instruction_nums(unique)
+        ]
+        lookup = dict(itertools.izip(unique, ordinals))
+
+        return array.array("I", map(lookup.__getitem__, addresses))
+
+    def _record_first_seen(self, events):
+        """
+        Update the first-seen indexes with the given (appended) events.
+        """
+        first_rank = self._first_rank
+
+        # the instructions executed for the first time by these events
+        executed = set(events)
+        executed.discard(UNKNOWN_EVENT)
+        new_ordinals = [ordinal for ordinal in executed if not first_rank[ordinal]]
+        if not new_ordinals:
+            return
+
+        #
+        # the first event of each new instruction. walking the events in
+        # reverse, the earliest event of an instruction is the last written
+        #
+
+        count = len(events)
+        first_index = dict(itertools.izip(reversed(events), xrange(count - 1, -1, -1)))
+        new_ordinals.sort(key=first_index.__getitem__)
+
+        first_ordinals = self._first_ordinals
+        self._first_events.extend(self._length + first_index[ordinal] for ordinal in new_ordinals)
+        for ordinal in new_ordinals:
+            first_ordinals.append(ordinal)
+            first_rank[ordinal] = len(first_ordinals)
+
+    def close(self):
+        """
+        Release the trace file.
+        """
+        if self._mmap:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    def _flush_chunk(self):
+        """
+        Flush the oldest chunk of buffered events to disk.
+        """
+        chunk = self._buffer[:TRACE_CHUNK_SIZE]
+        del self._buffer[:TRACE_CHUNK_SIZE]
+
+        self._file.seek(0, os.SEEK_END)
+        chunk.tofile(self._file)
+        self._file.flush()
+
+        self._chunks.append(self._summarize(chunk))
+
+    #--------------------------------------------------------------------------
+    # Queries
+    #--------------------------------------------------------------------------
+
+    def coverage(self, start=0, stop=None):
+        """
+        Return the coverage (a mask) of the trace events in [start, stop).
+        """
+        start, stop, _ = slice(start, stop).indices(self._length)
+        bitmap = CompressedBitmap()
+
+        chunk_start = -(-start // TRACE_CHUNK_SIZE)
+        chunk_stop = stop // TRACE_CHUNK_SIZE
+
+        # the range falls within a single chunk, scan it
+        if chunk_start >= chunk_stop:
+            return self._mask(self._summarize(self.events(start, stop)))
+
+        # the whole chunks within the range are already summarized
+        for summary in self._chunks[chunk_start:chunk_stop]:
+            bitmap |= summary
+
+        # scan the partial chunks at either edge of the range
+        bitmap |= self._summarize(self.events(start, chunk_start * TRACE_CHUNK_SIZE))
+        bitmap |= self._summarize(self.events(chunk_stop * TRACE_CHUNK_SIZE, stop))
+
+        return self._mask(bitmap)
+
+    def transitions(self):
+        """
+        Return the set of (from, to) instruction ordinals of consecutive events.
+        """
+
+        # only the events appended since the last request need to be scanned
+        start = max(self._transitions_length - 1, 0)
+        for chunk_start in xrange(start, self._length - 1, TRACE_CHUNK_SIZE):
+            events = self.events(chunk_start, chunk_start + TRACE_CHUNK_SIZE + 1)
+            self._transitions.update(itertools.izip(events, itertools.islice(events, 1, None)))
+
+        self._transitions_length = self._length
+        return self._transitions
+
+    def events(self, start=0, stop=None):
+        """
+        Return the trace events (instruction ordinals) in [start, stop).
+        """
+        start, stop, _ = slice(start, stop).indices(self._length)
+        events = array.array("I")
+        if start >= stop:
+            return events
+
+        # the events that have been flushed to the trace file
+        flushed = self._length - len(self._buffer)
+        if start < flushed:
+            data = self._map_file()
+            events.fromstring(data[start*4:min(stop, flushed)*4])
+
+        # the events still buffered in memory
+        if stop > flushed:
+            events.extend(self._buffer[max(start - flushed, 0):stop - flushed])
+
+        return events
+
+    def first_seen(self, address):
+        """
+        Return the event at which the given address was first executed.
+        """
+        ordinal = self.snapshot.get_instruction_num(address)
+        if ordinal == BADINSTRUCTION or not self._first_rank[ordinal]:
+            return None
+        return int(self._first_events[self._first_rank[ordinal] - 1])
+
+    def new_since(self, step):
+        """
+        Return the coverage (a mask) first executed at or after the given event.
+        """
+        index = bisect.bisect_left(self._first_events, step)
+        return self._mask(CompressedBitmap.from_ordinals(self._first_ordinals[index:]))
+
+    def node_first_seen(self):
+        """
+        Return a list of (event, node address) of each executed node.
+
+        The list is ordered by the event at which each node (basic block)
+        was first executed.
+        """
+        if self._node_events is None:
+            self._node_events = self._build_node_events()
+        return self._node_events
+
+    def nodes_new_since(self, step):
+        """
+        Return the addresses of the nodes first executed at or after the given event.
+        """
+        node_events = self.node_first_seen()
+        index = bisect.bisect_left(node_events, (step,))
+        return [node_address for _, node_address in node_events[index:]]
+
+    def _build_node_events(self):
+        """
+        Compute the event at which each executed node was first executed.
+        """
+        node_addresses, node_starts, node_ends = self.snapshot.get_node_instruction_bounds()
+        node_events = []
+        seen = set()
+
+        #
+        # walking the instructions in the order they were first executed,
+        # the first instruction seen of each node marks its first execution
+        #
+
+        for ordinal, event in itertools.izip(self._first_ordinals, self._first_events):
+            index = bisect.bisect_right(node_starts, ordinal) - 1
+            if index < 0 or ordinal >= node_ends[index] or index in seen:
+                continue
+            seen.add(index)
+            node_events.append((int(event), node_addresses[index]))
+
+        return node_events
+
+    def _summarize(self, events):
+        """
+        Return the coverage (a compressed bitmap) of the given events.
+        """
+        executed = set(events)
+        executed.discard(UNKNOWN_EVENT)
+        return CompressedBitmap.from_ordinals(executed).compress()
+
+    def _mask(self, bitmap):
+        """
+        Return a coverage mask of the given compressed bitmap.
+        """
+        return CoverageMask(self.snapshot, bitmap)
+
+    def _map_file(self):
+        """
+        Return a memory map of the (flushed) trace file.
+        """
+        size = (self._length - len(self._buffer)) * 4
+        if size != self._mapped_size:
+            if self._mmap:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._file.fileno(), size, access=mmap.ACCESS_READ)
+            self._mapped_size = size
+        return self._mmap
+
+#------------------------------------------------------------------------------
+# Coverage Rarity
+#------------------------------------------------------------------------------
+#
+#    The rarity of an instruction is the number of loaded coverage sets that
+#    executed it. Rarity answers questions such as 'what code was hit by
+#    only one input' directly, rather than through an N-way composition of
+#    every loaded set.
+#
+#    Counts are held in an array indexed by the instruction ordinals of a
+#    metadata snapshot, and are updated incrementally, one run of ordinals
+#    at a time, as coverage sets are added to or removed from the director.
+#    Addresses that are not known instructions are counted separately.
+#
+
+# masks a (signed) count difference to 32 bits
+COUNT_MASK = 0xFFFFFFFF
+
+class CoverageRarity(object):
+    """
+    The number of loaded coverage sets that hit each instruction.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self._counts = array.array("I", [0]) * len(snapshot.instructions)
+        self._sparse_counts = collections.Counter()
+
+    #--------------------------------------------------------------------------
+    # Updates
+    #--------------------------------------------------------------------------
+
+    def add(self, coverage_mask):
+        """
+        Count the instructions of the given coverage mask as hit by one more set.
+        """
+        self._adjust(coverage_mask, operator.add)
+
+    def subtract(self, coverage_mask):
+        """
+        Count the instructions of the given coverage mask as hit by one less set.
+        """
+        self._adjust(coverage_mask, operator.sub)
+
+    def _adjust(self, coverage_mask, operation):
+        """
+        Adjust the counts of the instructions in the given coverage mask.
+        """
+
+        #
+        # counts are kept against the newest metadata snapshot seen, as the
+        # instructions of older snapshots may have been redefined since
+        #
+
+        if coverage_mask.snapshot.version > self.snapshot.version:
+            self._rebase(coverage_mask.snapshot)
+        coverage_mask = coverage_mask.rebase(self.snapshot)
+
+        # adjust the counts of each run of consecutive instruction ordinals
+        counts = self._counts
+        for start, stop in coverage_mask.bitmap.runs():
+            counts[start:stop] = array.array("I", itertools.imap(operation, counts[start:stop], itertools.repeat(1)))
+
+        # adjust the counts of the sparse addresses
+        for address in coverage_mask.sparse:
+            count = operation(self._sparse_counts[address], 1)
+            if count:
+                self._sparse_counts[address] = count
+            else:
+                del self._sparse_counts[address]
+
+    def _rebase(self, snapshot):
+        """
+        Move the counts onto the given metadata snapshot.
+        """
+
+        # snapshots that share an instruction list share instruction ordinals
+        if snapshot.instructions is self.snapshot.instructions:
+            self.snapshot = snapshot
+            return
+
+        instructions = self.snapshot.instructions
+        counted = list(itertools.compress(itertools.count(), self._counts))
+
+        # merge the counted instructions with the counted sparse addresses
+        counts = dict(self._sparse_counts)
+        counts.update((instructions[ordinal], self._counts[ordinal]) for ordinal in counted)
+
+        addresses = sorted(counts)
+        ordinals = snapshot.get_instruction_nums(addresses)
+
+        self.snapshot = snapshot
+        self._counts = array.array("I", [0]) * len(snapshot.instructions)
+        self._sparse_counts = collections.Counter()
+
+        # re-count each address against the new snapshot
+        for address, ordinal in itertools.izip(addresses, ordinals):
+            if ordinal == BADINSTRUCTION:
+                self._sparse_counts[address] = counts[address]
+            else:
+                self._counts[ordinal] = counts[address]
+
+    #--------------------------------------------------------------------------
+    # Queries
+    #--------------------------------------------------------------------------
+
+    def count(self, address):
+        """
+        Return the number of loaded sets that hit the given address.
+        """
+        ordinal = self.snapshot.get_instruction_num(address)
+        if ordinal == BADINSTRUCTION:
+            return self._sparse_counts[address]
+        return self._counts[ordinal]
+
+    def rare_coverage(self, max_sets=1):
+        """
+        Return a mask of the instructions hit by at least one, but no more
+        than max_sets of the loaded sets.
+        """
+
+        #
+        # the count range [1, max_sets] is checked with a single unsigned
+        # comparison: subtracting one wraps unhit (zero) counts around to
+        # the largest 32bit value, which is never in range
+        #
+
+        in_range = itertools.imap(
+            operator.lt,
+            itertools.imap(
+                operator.and_,
+                itertools.imap(operator.sub, self._counts, itertools.repeat(1)),
+                itertools.repeat(COUNT_MASK)
+            ),
+            itertools.repeat(max_sets)
+        )
+
+        ordinals = itertools.compress(itertools.count(), in_range)
+        sparse = [address for address, count in self._sparse_counts.iteritems() if count <= max_sets]
+
+        return CoverageMask(self.snapshot, CompressedBitmap.from_ordinals(ordinals), sparse)
+
+    def rare_nodes(self, max_sets=1):
+        """
+        Return the addresses of the nodes hit by at least one, but no more
+        than max_sets of the loaded sets.
+
+        The rarity of a node is that of its most commonly hit instruction.
+        """
+        rare = self.rare_coverage(max_sets).bitmap
+        if not rare:
+            return set()
+
+        counts = self._counts
+        node_addresses, node_starts, node_ends = self.snapshot.get_node_instruction_bounds()
+
+        # only the nodes holding a rare instruction can be rare
+        candidates = set()
+        for start, stop in rare.runs():
+            index = max(bisect.bisect_right(node_starts, start) - 1, 0)
+            while index < len(node_starts) and node_starts[index] < stop:
+                if node_ends[index] > start:
+                    candidates.add(index)
+                index += 1
+
+        return set(
+            node_addresses[index] for index in candidates
+            if max(counts[node_starts[index]:node_ends[index]]) <= max_sets
+        )
+
 #------------------------------------------------------------------------------
 # Database Coverage / Data Mapping
 #------------------------------------------------------------------------------
@@ -51,12 +673,21 @@ class DatabaseCoverage(object):
         # metadata counterparts. A coverage object by itself is mostly useless
         # without its corresponding metadata object.
         #
-        # here we simply populate self._metadata with a stub metadata object,
-        # but at runtime we will inject a fully collected DatabaseMetadata
-        # object as maintained by the director.
+        # here we simply populate self._metadata with a (shared) stub metadata
+        # object, but at runtime we will inject a fully collected
+        # DatabaseMetadata object as maintained by the director.
         #
 
-        self._metadata = DatabaseMetadata()
+        self._metadata = NULL_METADATA
+
+        #
+        # coverage is mapped against a single, immutable version (snapshot)
+        # of the metadata at a time. we hold onto the snapshot our coverage
+        # was last mapped against, so that the mapping stays consistent even
+        # if the metadata publishes a new version while we are working.
+        #
+
+        self._snapshot = self._metadata.snapshot
 
         #
         # the hitmap effectively holds the raw coverage data. the name
@@ -79,18 +710,41 @@ class DatabaseCoverage(object):
         # regard to what data sources we can consue (inst trace, coverage, etc)
         # and ways we can leverage said data (visualize coverage, heatmaps)
         #
+        # rather than storing the hitmap as a dict of (boxed) python integers,
+        # it is stored densely against the instruction ordinals of the pinned
+        # metadata snapshot:
+        #
+        #   - _hits: the hit count of each instruction, indexed by ordinal
+        #   - _bitmap: a compressed bitmap of the executed instruction ordinals
+        #
+        # any addresses that are not known instructions (eg, they fall outside
+        # of defined functions) are kept in the small '_sparse_hits' table.
+        #
+        # see the 'data' property for the hitmap (dict) form of this data
+        #
 
-        self._hitmap = build_hitmap(data)
+        self._hits = array.array("I")
+        self._bitmap = CompressedBitmap()
+        self._sparse_hits = {}
+
+        if isinstance(data, CoverageMask):
+            self._load_mask(data)
+        else:
+            self._load_hitmap(build_hitmap(data))
 
         #
         # the coverage hash is a simple hash of the coverage bitmap/mask.
         # it is primarily used by the director as a means of quickly comparing
         # coverage, and predicting outputs of logical / arithmetic operations.
         #
+        # the hash is the sum of a strong hash of each covered address, which
+        # does not depend on the order addresses were added. this allows the
+        # hash to be maintained incrementally (see _address_hash_sum) as
+        # addresses enter or leave the coverage, rather than re-hashing the
+        # entire coverage set each time it changes.
+        #
         # the hash will need to be updated via _update_coverage_hash() anytime
-        # the hitmap is modified or changed internally. we cache a concrete
-        # result of the coverage hash because computing the hash on demand can
-        # be expensive in terms of time.
+        # the hitmap is modified or changed internally.
         #
         # see the usage of 'coverage_hash' in director.py for more info
         #
@@ -104,11 +758,22 @@ class DatabaseCoverage(object):
         # into its appropriate NodeCoverage object (eg, a basic block) or it
         # will be considered 'unmapped'
         #
+        # the instructions awaiting mapping are tracked as a bitmap of their
+        # ordinals. addresses that are not known instructions (sparse) can
+        # never be mapped, and are always considered unmapped.
+        #
         # starting out, all coverage data is marked as unmapped
         #
 
-        self._unmapped_data = set(self._hitmap.keys())
-        self._unmapped_data.add(idaapi.BADADDR)
+        self._unmapped_bitmap = self._bitmap
+
+        #
+        # nodes and functions modified outside of the mapping process (eg,
+        # when data is subtracted) are held here until the next refresh
+        #
+
+        self._dirty_nodes = {}
+        self._dirty_functions = {}
 
         #
         # self._map_coverage is responsible for mapping coverage data to the
@@ -126,31 +791,116 @@ class DatabaseCoverage(object):
         self.functions = {}
         self.instruction_percent = 0.0
 
+        # a running total of the instructions executed in all functions
+        self._instructions_executed = 0
+
         #
-        # we instantiate a single weakref of ourself (the DatbaseMapping
-        # object) such that we can distribute it to the children we create
-        # without having to repeatedly instantiate new ones.
+        # the metrics (percentages, colors, ...) of node & function coverage
+        # are computed lazily, when they are first accessed. many coverage
+        # sets are never looked at (eg, compositions evaluated as the user
+        # types in the shell) so there is no point computing them up front.
+        #
+        # functions pending finalization are tracked for finalize_all()
         #
 
-        self._weak_self = weakref.proxy(self)
+        self._unfinalized_functions = {}
 
-    #--------------------------------------------------------------------------
-    # Propertiens
-    #--------------------------------------------------------------------------
+        #
+        # the edges taken by this coverage, as a bytearray of flags parallel
+        # to the packed edges of the metadata snapshot (see get_edges). this
+        # is computed for the whole database in a single pass, the first time
+        # the edge coverage of any function is requested
+        #
 
-    @property
-    def data(self):
-        """
-        The data (a hitmap) used by this mapping.
-        """
-        return self._hitmap
+        self._edges_taken = None
+
+        # the uncovered frontier of this coverage, computed on request
+        self._frontier = None
+        self._function_frontier = None
+
+        #
+        # to bound memory usage, the director may 'spill' the hit counts of
+        # coverage that is not in use to disk (see spill). the coverage hash,
+        # instruction percent and coverage bitmap/mask are retained in memory
+        #
+
+        self._spill_path = None
+
+        #
+        # the ordered execution trace of the addresses added to this mapping
+        # (see add_addresses) can optionally be recorded (see record_trace)
+        #
+
+        self.trace = None
+
+        #
+        # we instantiate a single weakref of ourself (the DatbaseMapping
+        # object) such that we can distribute it to the children we create
+        # without having to repeatedly instantiate new ones.
+        #
+
+        self._weak_self = weakref.proxy(self)
+
+    #--------------------------------------------------------------------------
+    # Propertiens
+    #--------------------------------------------------------------------------
+
+    @property
+    def data(self):
+        """
+        The data (a hitmap) used by this mapping.
+
+        NOTE: the hitmap is built from the dense coverage data on request.
+        """
+        hitmap = dict(self._sparse_hits)
+
+        # add the hit counts of the executed instructions to the hitmap
+        instructions = self._snapshot.instructions
+        for start, stop, run_hits in self._hit_runs():
+            hitmap.update(itertools.izip(instructions[start:stop], run_hits))
+
+        return hitmap
 
     @property
     def coverage(self):
         """
         The instruction-level coverage bitmap/mask of this mapping.
         """
-        return self._hitmap.viewkeys()
+        return CoverageMask(self._snapshot, self._bitmap, self._sparse_hits.viewkeys())
+
+    @property
+    def metadata_version(self):
+        """
+        The version of the metadata this coverage was last mapped against.
+        """
+        return self._snapshot.version
+
+    @property
+    def snapshot(self):
+        """
+        The metadata snapshot this coverage was last mapped against.
+        """
+        return self._snapshot
+
+    @property
+    def spilled(self):
+        """
+        Return True if the hit counts of this mapping are spilled to disk.
+        """
+        return self._spill_path is not None
+
+    @property
+    def resident_size(self):
+        """
+        The estimated memory (in bytes) held by the data of this mapping.
+        """
+        if self.spilled:
+            return self._bitmap.size
+
+        return self._hits.itemsize * len(self._hits) + self._bitmap.size + \
+            MAPPED_INSTRUCTION_SIZE * self._instructions_executed + \
+            MAPPED_NODE_SIZE * len(self.nodes) + \
+            MAPPED_FUNCTION_SIZE * len(self.functions)
 
     #--------------------------------------------------------------------------
     # Metadata Population
@@ -165,165 +915,957 @@ class DatabaseCoverage(object):
         self._metadata = weakref.proxy(metadata)
         self.unmap_all()
 
-    def refresh(self):
+    def refresh(self):
+        """
+        Refresh the mapping of our coverage data to the database metadata.
+        """
+        self.rehydrate()
+
+        # rebuild our coverage mapping
+        dirty_nodes, dirty_functions = self._map_coverage()
+
+        # bake our coverage map
+        self._finalize(dirty_nodes, dirty_functions)
+
+        # update the coverage hash incase the hitmap changed
+        self._update_coverage_hash()
+
+        # dump the unmappable coverage data
+        #self.dump_unmapped()
+
+    def refresh_nodes(self):
+        """
+        Special fast-refresh of nodes as used in the un-painting process.
+        """
+        self._rebase(self._metadata.snapshot)
+        dirty_nodes = self._map_nodes()
+        self._finalize_nodes(dirty_nodes)
+
+    def finalize_all(self):
+        """
+        Finalize all pending (lazy) coverage metrics now.
+
+        This is the bulk alternative to finalizing each function coverage
+        on first access, for when the metrics of every function are needed
+        (eg, to populate and sort the coverage overview).
+        """
+
+        #
+        # swap out the pending functions before walking them, as coverage
+        # may be (re)mapped by a worker thread while we are finalizing
+        #
+
+        pending, self._unfinalized_functions = self._unfinalized_functions, {}
+
+        for function_address, function_coverage in pending.iteritems():
+            if self.functions.get(function_address, None) is function_coverage:
+                function_coverage.finalize()
+
+    def _finalize(self, dirty_nodes, dirty_functions):
+        """
+        Finalize coverage objects for use.
+        """
+        self._finalize_nodes(dirty_nodes)
+        self._finalize_functions(dirty_functions)
+        self._finalize_instruction_percent()
+
+    def _finalize_nodes(self, dirty_nodes):
+        """
+        Finalize coverage nodes for use.
+        """
+        for node_coverage in dirty_nodes.itervalues():
+            node_coverage.invalidate()
+
+        # the edges taken & frontier depend on the nodes executed
+        self._edges_taken = None
+        self._frontier = None
+        self._function_frontier = None
+
+    def _finalize_functions(self, dirty_functions):
+        """
+        Finalize coverage nodes for use.
+        """
+        for function_address, function_coverage in dirty_functions.iteritems():
+
+            # keep the running total of instructions executed up to date
+            self._instructions_executed -= function_coverage.instructions_executed
+            function_coverage.invalidate()
+            self._instructions_executed += function_coverage.instructions_executed
+
+            # the remaining function metrics will be computed on demand
+            self._unfinalized_functions[function_address] = function_coverage
+
+    def _get_edges_taken(self):
+        """
+        Return the flags of the edges taken (as from get_edges) by this coverage.
+
+        Returns None if the edges of the metadata have not been collected.
+        """
+        if self._edges_taken is not None:
+            return self._edges_taken
+
+        # the edges are collected at the end of a metadata refresh
+        edges = self._snapshot.get_edges()
+        if edges is None:
+            return None
+
+        # more code-friendly, readable aliases
+        sources, destinations, _ = edges
+        node_addresses, node_starts, node_ends = self._snapshot.get_node_instruction_bounds()
+
+        #
+        # an ordered trace tells us exactly which edges were taken. an edge
+        # was taken if the last instruction of its source node was directly
+        # followed by the first instruction of its destination node
+        #
+
+        if self.trace is not None and self.trace.snapshot is self._snapshot:
+            transitions = self.trace.transitions()
+            edges = itertools.izip(
+                itertools.imap(operator.sub, itertools.imap(node_ends.__getitem__, sources), itertools.repeat(1)),
+                itertools.imap(node_starts.__getitem__, destinations)
+            )
+            taken = itertools.imap(transitions.__contains__, edges)
+
+        #
+        # otherwise, we only know which nodes were executed. an edge is
+        # considered taken if both its source and destination were executed
+        #
+
+        else:
+            executed = self._get_nodes_executed()
+            taken = itertools.imap(
+                operator.and_,
+                itertools.imap(executed.__getitem__, sources),
+                itertools.imap(executed.__getitem__, destinations)
+            )
+
+        self._edges_taken = bytearray(taken)
+        return self._edges_taken
+
+    def _get_nodes_executed(self):
+        """
+        Return the flags of the nodes (by node index) executed by this coverage.
+        """
+        node_indexes = self._snapshot.get_node_indexes()
+
+        executed = bytearray(len(node_indexes))
+        for index in itertools.imap(node_indexes.__getitem__, self.nodes):
+            executed[index] = 1
+
+        return executed
+
+    def _finalize_instruction_percent(self):
+        """
+        Finalize the database coverage % by instructions executed in all defined functions.
+        """
+
+        # the number of instructions in the database metadata
+        total = self._snapshot.instruction_count
+        if not total:
+            self.instruction_percent = 0.0
+            return
+
+        # return the average function coverage % aka 'the database coverage %'
+        self.instruction_percent = float(self._instructions_executed) / total
+
+    #--------------------------------------------------------------------------
+    # Frontier
+    #--------------------------------------------------------------------------
+
+    def frontier(self):
+        """
+        Return the uncovered frontier of this coverage, ranked.
+
+        The frontier is the set of uncovered nodes that are directly reached
+        by an edge from an executed node. Returns a list of (node_address,
+        uncovered) tuples, where uncovered is the number of instructions in
+        the uncovered code reachable from the node (through uncovered nodes).
+        The list is sorted by the most uncovered code first.
+        """
+        if self._frontier is not None:
+            return self._frontier
+
+        # the edges are collected at the end of a metadata refresh
+        edges = self._snapshot.get_edges()
+        if edges is None:
+            return []
+
+        # more code-friendly, readable aliases
+        sources, destinations, _ = edges
+        offsets, successors = self._snapshot.get_successors()
+        node_addresses, node_starts, node_ends = self._snapshot.get_node_instruction_bounds()
+
+        executed = self._get_nodes_executed()
+        unexecuted = executed.translate(FLIP_FLAGS)
+
+        #
+        # the frontier nodes are the destinations of the edges that leave an
+        # executed node, and enter one that was not
+        #
+
+        crossing = itertools.imap(
+            operator.and_,
+            itertools.imap(executed.__getitem__, sources),
+            itertools.imap(unexecuted.__getitem__, destinations)
+        )
+        frontier_nodes = set(itertools.compress(destinations, crossing))
+
+        #
+        # the uncovered code behind a frontier node is everything it can reach
+        # without passing through an executed node. as the walks from nearby
+        # frontier nodes overlap heavily, we collapse the uncovered subgraph
+        # into its strongly connected components (tarjan, iteratively) and
+        # compute the reach of each component once, as a bitmap of the
+        # components below it, shared by every frontier node that hits it
+        #
+
+        node_count = len(node_addresses)
+        index = array.array("l", [-1]) * node_count
+        lowlink = array.array("l", [0]) * node_count
+        component = array.array("l", [-1]) * node_count
+        onstack = bytearray(node_count)
+
+        scc_stack = []
+        weights = []
+        reach = []
+        counter = 0
+
+        for root in sorted(frontier_nodes):
+            if index[root] != -1:
+                continue
+
+            index[root] = lowlink[root] = counter
+            counter += 1
+            scc_stack.append(root)
+            onstack[root] = 1
+            work = [(root, offsets[root])]
+
+            while work:
+                node, position = work[-1]
+                end = offsets[node+1]
+
+                # descend into the next unvisited, uncovered successor
+                while position < end:
+                    successor = successors[position]
+                    position += 1
+                    if not unexecuted[successor]:
+                        continue
+                    if index[successor] == -1:
+                        break
+                    if onstack[successor] and index[successor] < lowlink[node]:
+                        lowlink[node] = index[successor]
+                else:
+                    successor = -1
+
+                if successor != -1:
+                    work[-1] = (node, position)
+                    index[successor] = lowlink[successor] = counter
+                    counter += 1
+                    scc_stack.append(successor)
+                    onstack[successor] = 1
+                    work.append((successor, offsets[successor]))
+                    continue
+
+                # all successors are done, so this node is done too
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    if lowlink[node] < lowlink[parent]:
+                        lowlink[parent] = lowlink[node]
+
+                if lowlink[node] != index[node]:
+                    continue
+
+                # pop the component rooted at this node off the stack
+                scc = len(weights)
+                members = []
+                while True:
+                    member = scc_stack.pop()
+                    onstack[member] = 0
+                    component[member] = scc
+                    members.append(member)
+                    if member == node:
+                        break
+
+                #
+                # the reach of a component is itself, plus the reach of every
+                # component it has an uncovered edge into. those are already
+                # complete, and were numbered before this one. a reach is kept
+                # as (base, bitmap), with bit i marking component base + i
+                #
+
+                weight = 0
+                base, bits = scc, 1
+                for member in members:
+                    weight += node_ends[member] - node_starts[member]
+                    for successor in successors[offsets[member]:offsets[member+1]]:
+                        if not unexecuted[successor] or component[successor] == scc:
+                            continue
+                        other_base, other_bits = reach[component[successor]]
+                        if other_base < base:
+                            bits = (bits << (base - other_base)) | other_bits
+                            base = other_base
+                        else:
+                            bits |= other_bits << (other_base - base)
+
+                weights.append(weight)
+                reach.append((base, bits))
+
+        #
+        # rank each frontier node by the total size of the components it can
+        # reach, computing the total once per component
+        #
+
+        uncovered = {}
+        ranked = []
+
+        for root in frontier_nodes:
+            scc = component[root]
+            if scc not in uncovered:
+                base, bits = reach[scc]
+                uncovered[scc] = sum(weights[base + i] for i in bitmap_ordinals(bits))
+            ranked.append((node_addresses[root], uncovered[scc]))
+
+        ranked.sort(key=operator.itemgetter(1), reverse=True)
+        self._frontier = ranked
+        return ranked
+
+    def function_frontier(self):
+        """
+        Return the uncovered code behind the frontier of each function.
+
+        Returns a dict of function_address -> the uncovered instructions
+        behind the function's highest ranked frontier node, or None if the
+        edges of the database have not been collected yet.
+        """
+        if self._function_frontier is not None:
+            return self._function_frontier
+
+        # the edges are collected at the end of a metadata refresh
+        if self._snapshot.get_edges() is None:
+            return None
+
+        #
+        # the frontier is ranked, so the first node seen for each function
+        # is its highest ranked one
+        #
+
+        function_frontier = {}
+        for node_address, uncovered in self.frontier():
+            function_address = self._snapshot.nodes[node_address].function.address
+            function_frontier.setdefault(function_address, uncovered)
+
+        self._function_frontier = function_frontier
+        return function_frontier
+
+    def frontier_coverage(self):
+        """
+        Return the instructions of the uncovered frontier, as a coverage mask.
+        """
+        _, node_starts, node_ends = self._snapshot.get_node_instruction_bounds()
+        node_indexes = self._snapshot.get_node_indexes()
+
+        ordinals = []
+        for node_address, _ in self.frontier():
+            index = node_indexes[node_address]
+            ordinals.extend(xrange(node_starts[index], node_ends[index]))
+
+        return CoverageMask(self._snapshot, CompressedBitmap.from_ordinals(ordinals))
+
+    #--------------------------------------------------------------------------
+    # Data Operations
+    #--------------------------------------------------------------------------
+
+    def add_data(self, data, update=True):
+        """
+        Add runtime data to this mapping.
+        """
+        self.rehydrate()
+
+        # add the given runtime data to our data source
+        touched = self._add_hits(data)
+
+        # do not update other internal structures if requested
+        if not update:
+            return
+
+        # update the coverage hash incase the hitmap changed
+        self._update_coverage_hash()
+
+        # mark these touched addresses as dirty
+        self._unmapped_bitmap = self._unmapped_bitmap | touched
+
+    def add_addresses(self, addresses, update=True):
+        """
+        Add a list of instruction addresses to this mapping (eg, a trace).
+        """
+        self.rehydrate()
+
+        # record the order of the executed addresses, if requested
+        if self.trace is not None:
+            addresses = list(addresses)
+            self.trace.append(addresses)
+
+        # increment the hit count for an address
+        touched = self._add_hits(build_hitmap(addresses))
+
+        # do not update other internal structures if requested
+        if not update:
+            return
+
+        # update the coverage hash incase the hitmap changed
+        self._update_coverage_hash()
+
+        # mark these touched addresses as dirty
+        self._unmapped_bitmap = self._unmapped_bitmap | touched
+
+    def subtract_data(self, data):
+        """
+        Subtract runtime data from this mapping.
+        """
+        self.rehydrate()
+
+        # subtract the given runtime data from our data source
+        touched, cleared = self._subtract_hits(data)
+
+        # update the coverage hash incase the hitmap changed
+        self._update_coverage_hash()
+
+        #
+        # rather than unmapping everything, we surgically unmap the
+        # instructions that are no longer executed, and mark the instructions
+        # that lost hits as dirty so that their node mappings are refreshed
+        #
+
+        self._unmap_instructions(cleared)
+        self._unmapped_bitmap = self._unmapped_bitmap | touched
+
+    def add_coverage(self, coverage):
+        """
+        Add the runtime data of another coverage mapping to this mapping.
+
+        This is the dense form of add_data(coverage.data). If both mappings
+        share their instruction ordinals, the hit counts are merged a run of
+        instructions at a time, without building a hitmap.
+        """
+        self.rehydrate()
+
+        # the given coverage cannot be merged densely, add it through its hitmap
+        if not self._align_snapshot(coverage):
+            return self.add_data(coverage.data)
+
+        # add the given runtime data to our data source
+        touched = self._add_coverage_hits(coverage)
+
+        # update the coverage hash incase the hitmap changed
+        self._update_coverage_hash()
+
+        # mark these touched addresses as dirty
+        self._unmapped_bitmap = self._unmapped_bitmap | touched
+
+    def subtract_coverage(self, coverage):
+        """
+        Subtract the runtime data of another coverage mapping from this mapping.
+
+        This is the dense form of subtract_data(coverage.data). See
+        add_coverage() for more information.
+        """
+        self.rehydrate()
+
+        # the given coverage cannot be merged densely, subtract its hitmap
+        if not self._align_snapshot(coverage):
+            return self.subtract_data(coverage.data)
+
+        # subtract the given runtime data from our data source
+        touched, cleared = self._subtract_coverage_hits(coverage)
+
+        # update the coverage hash incase the hitmap changed
+        self._update_coverage_hash()
+
+        # surgically unmap the cleared instructions (see subtract_data)
+        self._unmap_instructions(cleared)
+        self._unmapped_bitmap = self._unmapped_bitmap | touched
+
+    def mask_data(self, coverage_mask):
+        """
+        Mask the hitmap data against a given coverage mask.
+
+        Returns a new DatabaseCoverage containing the masked hitmap. The hit
+        counts of the masked instructions are carried over, and this mapping
+        is left unmodified.
+        """
+        self.rehydrate()
+
+        # express the mask against the instruction ordinals of our data
+        if isinstance(coverage_mask, CoverageMask):
+            coverage_mask = coverage_mask.rebase(self._snapshot)
+        else:
+            coverage_mask = CoverageMask.from_addresses(self._snapshot, coverage_mask)
+
+        # the executed instructions that match the coverage mask
+        bitmap = (self._bitmap & coverage_mask.bitmap).compress()
+
+        masked_coverage = DatabaseCoverage(None, self.palette)
+        masked_coverage._metadata = self._metadata
+        masked_coverage._snapshot = self._snapshot
+
+        #
+        # carry over the hit counts of the masked instructions. coverage is
+        # clustered, so they are copied a run of instructions at a time
+        #
+
+        hits = array.array("I", [0]) * len(self._hits)
+        for start, stop in bitmap.runs():
+            hits[start:stop] = self._hits[start:stop]
+
+        sparse_hits = {}
+        for address in coverage_mask.sparse:
+            if address in self._sparse_hits:
+                sparse_hits[address] = self._sparse_hits[address]
+
+        # install the masked coverage data
+        masked_coverage._hits = hits
+        masked_coverage._bitmap = bitmap
+        masked_coverage._sparse_hits = sparse_hits
+
+        #
+        # the coverage hash is a sum over the covered addresses. when the mask
+        # removes less than it keeps, it is cheaper to derive the hash from
+        # ours by subtracting the hashes of the addresses that were removed
+        #
+
+        instructions = self._snapshot.instructions
+        masked_out = self._bitmap - bitmap
+
+        if len(masked_out) < len(bitmap):
+            removed = itertools.chain(
+                (instructions[ordinal] for ordinal in masked_out),
+                self._sparse_hits.viewkeys() - sparse_hits.viewkeys()
+            )
+            hash_sum = self._address_hash_sum - sum(itertools.imap(address_hash, removed))
+        else:
+            hash_sum = sum(itertools.imap(address_hash, masked_coverage.coverage))
+
+        masked_coverage._address_hash_sum = hash_sum & MASK64
+
+        masked_coverage._update_coverage_hash()
+        masked_coverage._unmapped_bitmap = bitmap
+
+        # done, return a new DatabaseCoverage masked with the given coverage
+        return masked_coverage
+
+    def record_trace(self, filepath=None):
+        """
+        Record the execution order of addresses added to this mapping.
+
+        The trace is recorded against the current metadata snapshot, and is
+        stored in the given file (or a temporary file).
+        """
+        if self.trace is None:
+            self.trace = TraceStore(self._metadata.snapshot, filepath)
+        return self.trace
+
+    def _update_coverage_hash(self):
+        """
+        Update the hash of the coverage mask.
+        """
+        self.coverage_hash = self._address_hash_sum
+
+    #--------------------------------------------------------------------------
+    # Spilling
+    #--------------------------------------------------------------------------
+
+    def spill(self, filepath):
+        """
+        Spill the hit counts of this mapping to the given file.
+
+        The node & function mappings are released, and will be rebuilt when
+        the mapping is rehydrated. Spilled coverage can still be composed,
+        and its coverage hash & instruction percent remain available.
+        """
+        if self.spilled:
+            return
+
+        # the hit counts of the executed instructions, in ordinal order
+        executed = array.array("I")
+        for start, stop, run_hits in self._hit_runs():
+            executed.extend(run_hits)
+
+        with open(filepath, "wb") as f:
+            executed.tofile(f)
+        self._spill_path = filepath
+
+        # release the dense coverage data & mappings
+        self._hits = array.array("I")
+        self._unmapped_bitmap = CompressedBitmap()
+        self._dirty_nodes = {}
+        self._dirty_functions = {}
+        self._unfinalized_functions = {}
+        self._edges_taken = None
+        self._frontier = None
+        self._function_frontier = None
+        self.nodes     = {}
+        self.functions = {}
+
+    def rehydrate(self):
+        """
+        Restore the hit counts of a spilled mapping, and re-map its coverage.
+        """
+        if not self.spilled:
+            return
+
+        hits = self._read_spilled_hits()
+        self.discard_spill()
+        self._hits = hits
+
+        # re-map all of the coverage
+        self.unmap_all()
+        self.refresh()
+
+    def rebase_spill(self, snapshot):
+        """
+        Re-express the spilled hit counts of this mapping against the given snapshot.
+
+        Spilled coverage is not refreshed with the rest of the coverage, so
+        this keeps it from holding on to an outdated metadata snapshot.
+        """
+        if not self.spilled or snapshot is self._snapshot:
+            return
+
+        # snapshots that share an instruction list share instruction ordinals
+        if snapshot.instructions is self._snapshot.instructions:
+            self._snapshot = snapshot
+            return
+
+        # rebuild the coverage data against the new snapshot, and spill it again
+        hitmap = self.data
+        filepath = self._spill_path
+        self._spill_path = None
+        self._snapshot = snapshot
+        self._load_hitmap(hitmap)
+        self.spill(filepath)
+
+    def discard_spill(self):
         """
-        Refresh the mapping of our coverage data to the database metadata.
+        Delete the spilled hit counts of this mapping from disk.
         """
+        if not self.spilled:
+            return
 
-        # rebuild our coverage mapping
-        dirty_nodes, dirty_functions = self._map_coverage()
-
-        # bake our coverage map
-        self._finalize(dirty_nodes, dirty_functions)
-
-        # update the coverage hash incase the hitmap changed
-        self._update_coverage_hash()
+        try:
+            os.remove(self._spill_path)
+        except OSError:
+            logger.exception("Failed to delete spilled coverage %s" % self._spill_path)
 
-        # dump the unmappable coverage data
-        #self.dump_unmapped()
+        self._spill_path = None
 
-    def refresh_nodes(self):
+    def _read_spilled_hits(self):
         """
-        Special fast-refresh of nodes as used in the un-painting process.
+        Read the (dense) hit counts of a spilled mapping back from disk.
         """
-        dirty_nodes = self._map_nodes()
-        self._finalize_nodes(dirty_nodes)
+        hits = array.array("I", [0]) * len(self._snapshot.instructions)
+        for start, stop, run_hits in self._spilled_hit_runs():
+            hits[start:stop] = run_hits
+        return hits
 
-    def _finalize(self, dirty_nodes, dirty_functions):
+    def _spilled_hit_runs(self):
         """
-        Finalize coverage objects for use.
+        Yield the spilled hit counts of each run of executed instructions.
+
+        The hit counts are read in place through a memory map of the spill
+        file, one run at a time. See _hit_runs() for more information.
         """
-        self._finalize_nodes(dirty_nodes)
-        self._finalize_functions(dirty_functions)
-        self._finalize_instruction_percent()
+        itemsize = self._hits.itemsize
+
+        with open(self._spill_path, "rb") as f:
+            if not os.fstat(f.fileno()).st_size:
+                return
+
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                offset = 0
+                for start, stop in self._bitmap.runs():
+                    end = offset + (stop - start) * itemsize
+                    run_hits = array.array("I")
+                    run_hits.fromstring(data[offset:end])
+                    offset = end
+                    yield (start, stop, run_hits)
+            finally:
+                data.close()
 
-    def _finalize_nodes(self, dirty_nodes):
+    #--------------------------------------------------------------------------
+    # Dense Coverage Data
+    #--------------------------------------------------------------------------
+
+    def _load_hitmap(self, hitmap):
         """
-        Finalize coverage nodes for use.
+        Load the given hitmap as our coverage data.
         """
-        for node_coverage in dirty_nodes.itervalues():
-            node_coverage.finalize()
+        self._hits = array.array("I", [0]) * len(self._snapshot.instructions)
+        self._bitmap = CompressedBitmap()
+        self._sparse_hits = {}
+        self._address_hash_sum = 0
+        self._add_hits(hitmap)
 
-    def _finalize_functions(self, dirty_functions):
+    def _load_mask(self, coverage_mask):
         """
-        Finalize coverage nodes for use.
+        Load the given coverage mask as our coverage data (one hit each).
         """
-        for function_coverage in dirty_functions.itervalues():
-            function_coverage.finalize()
-
-    def _finalize_instruction_percent(self):
+        self._snapshot = coverage_mask.snapshot
+        self._hits = array.array("I", [0]) * len(self._snapshot.instructions)
+        for ordinal in coverage_mask.bitmap:
+            self._hits[ordinal] = 1
+        self._bitmap = coverage_mask.bitmap.compress()
+        self._sparse_hits = dict.fromkeys(coverage_mask.sparse, 1)
+        self._address_hash_sum = sum(itertools.imap(address_hash, coverage_mask)) & MASK64
+
+    def _rebase(self, snapshot):
         """
-        Finalize the database coverage % by instructions executed in all defined functions.
+        Re-express our coverage data against the given metadata snapshot.
+
+        Instruction ordinals are specific to a snapshot, so the dense coverage
+        data must be rebuilt whenever we pin a new snapshot.
         """
+        if snapshot is self._snapshot:
+            return
 
-        # sum all the instructions in the database metadata
-        total = sum(f.instruction_count for f in self._metadata.functions.itervalues())
-        if not total:
-            self.instruction_percent = 0.0
+        # snapshots that share an instruction list share instruction ordinals
+        if snapshot.instructions is self._snapshot.instructions:
+            self._snapshot = snapshot
             return
 
-        # sum all the instructions executed by the coverage
-        executed = sum(f.instructions_executed for f in self.functions.itervalues())
+        # the addresses of the coverage awaiting mapping
+        unmapped = list(self._unmapped_addresses())
 
-        # return the average function coverage % aka 'the database coverage %'
-        self.instruction_percent = float(executed) / total
+        # rebuild the coverage data against the new snapshot
+        hitmap = self.data
+        self._snapshot = snapshot
+        self._load_hitmap(hitmap)
 
-    #--------------------------------------------------------------------------
-    # Data Operations
-    #--------------------------------------------------------------------------
+        # carry over the coverage awaiting mapping
+        ordinals = snapshot.get_instruction_nums(sorted(unmapped))
+        self._unmapped_bitmap = CompressedBitmap.from_ordinals(x for x in ordinals if x != BADINSTRUCTION)
 
-    def add_data(self, data, update=True):
+    def _add_hits(self, hitmap):
         """
-        Add runtime data to this mapping.
+        Add the given hitmap to our coverage data.
+
+        Returns a compressed bitmap of the instruction ordinals touched by
+        the hitmap.
         """
+        hits = self._hits
+        sparse_hits = self._sparse_hits
+        hash_sum = self._address_hash_sum
+        executed = []
+        touched = []
+
+        addresses = sorted(hitmap)
+        ordinals = self._snapshot.get_instruction_nums(addresses)
+
+        for address, ordinal in itertools.izip(addresses, ordinals):
+            hit_count = hitmap[address]
+            if hit_count <= 0:
+                continue
 
-        # add the given runtime data to our data source
-        for address, hit_count in data.iteritems():
-            self._hitmap[address] += hit_count
+            # the address is not a known instruction, track it separately
+            if ordinal == BADINSTRUCTION:
+                if not address in sparse_hits:
+                    hash_sum += address_hash(address)
+                sparse_hits[address] = sparse_hits.get(address, 0) + hit_count
+                continue
 
-        # do not update other internal structures if requested
-        if not update:
-            return
+            # the instruction was not executed before, mark it executed
+            if not hits[ordinal]:
+                hash_sum += address_hash(address)
+                executed.append(ordinal)
 
-        # update the coverage hash incase the hitmap changed
-        self._update_coverage_hash()
+            hits[ordinal] = min(hits[ordinal] + hit_count, MAX_HITS)
+            touched.append(ordinal)
 
-        # mark these touched addresses as dirty
-        self._unmapped_data |= data.viewkeys()
+        # set the bits of the newly executed instructions in one operation
+        if executed:
+            self._bitmap = self._bitmap.union(CompressedBitmap.from_ordinals(executed))
 
-    def add_addresses(self, addresses, update=True):
-        """
-        Add a list of instruction addresses to this mapping (eg, a trace).
+        self._address_hash_sum = hash_sum & MASK64
+        return CompressedBitmap.from_ordinals(touched)
+
+    def _align_snapshot(self, coverage):
         """
+        Align our instruction ordinals with those of the given coverage.
 
-        # increment the hit count for an address
-        for address in addresses:
-            self._hitmap[address] += 1
+        Coverage mapped against the current snapshot of our metadata moves us
+        onto that snapshot (as our next refresh would). Coverage mapped against
+        any other snapshot (eg, of another metadata object) leaves us as is.
+        Returns True if the two mappings share their instruction ordinals.
+        """
+        if coverage._snapshot is self._metadata.snapshot:
+            self._rebase(coverage._snapshot)
+        return coverage._snapshot.instructions is self._snapshot.instructions
 
-        # do not update other internal structures if requested
-        if not update:
-            return
+    def _hit_runs(self):
+        """
+        Yield the hit counts of each run of consecutive executed instructions.
 
-        # update the coverage hash incase the hitmap changed
-        self._update_coverage_hash()
+        Yields (start, stop, hits) tuples, where hits is an array of the hit
+        counts of the instructions with ordinals start to stop.
+        """
+        if self.spilled:
+            return self._spilled_hit_runs()
 
-        # mark these touched addresses as dirty
-        self._unmapped_data |= set(addresses)
+        hits = self._hits
+        return ((start, stop, hits[start:stop]) for start, stop in self._bitmap.runs())
 
-    def subtract_data(self, data):
+    def _add_coverage_hits(self, coverage):
         """
-        Subtract runtime data from this mapping.
+        Add the hit counts of the given (aligned) coverage to our coverage data.
+
+        Returns a compressed bitmap of the instruction ordinals touched by
+        the coverage.
         """
+        hits = self._hits
+        instructions = self._snapshot.instructions
 
-        # subtract the given runtime data from our data source
-        for address, hit_count in data.iteritems():
-            self._hitmap[address] -= hit_count
+        # the instructions executed by the given coverage, but not by us
+        executed = coverage._bitmap - self._bitmap
+        hash_sum = self._address_hash_sum + sum(
+            itertools.imap(address_hash, itertools.imap(instructions.__getitem__, executed))
+        )
+
+        # merge the hit counts of each run of instructions in a single pass
+        for start, stop, run_hits in coverage._hit_runs():
+            hits[start:stop] = array.array("I", itertools.imap(
+                min,
+                itertools.imap(operator.add, hits[start:stop], run_hits),
+                itertools.repeat(MAX_HITS)
+            ))
+
+        # merge the hit counts of the addresses that are not known instructions
+        sparse_hits = self._sparse_hits
+        for address, hit_count in coverage._sparse_hits.iteritems():
+            if not address in sparse_hits:
+                hash_sum += address_hash(address)
+            sparse_hits[address] = sparse_hits.get(address, 0) + hit_count
+
+        # set the bits of the newly executed instructions in one operation
+        if executed:
+            self._bitmap = self._bitmap.union(executed)
+
+        self._address_hash_sum = hash_sum & MASK64
+        return coverage._bitmap
+
+    def _subtract_coverage_hits(self, coverage):
+        """
+        Subtract the hit counts of the given (aligned) coverage from our coverage data.
 
-            #assert self._hitmap[address] >= 0
+        Returns a tuple of (touched, cleared), as from _subtract_hits().
+        """
+        hits = self._hits
+        instructions = self._snapshot.instructions
+        touched = []
+        cleared = []
+
+        # subtract the hit counts of each run of instructions in a single pass
+        for start, stop, run_hits in coverage._hit_runs():
+            old_hits = hits[start:stop]
+            new_hits = array.array("I", itertools.imap(
+                max,
+                itertools.imap(operator.sub, old_hits, run_hits),
+                itertools.repeat(0)
+            ))
+            hits[start:stop] = new_hits
 
             #
-            # if there is no longer any hits for this address, delete its
-            # entry from the source_data dictonary. we don't want its entry to
-            # hang around because we use self._hitmap.viewkeys() as a
-            # coverage bitmap/mask
+            # instructions that are left with hits were touched, while those
+            # that had hits (but no longer do) were cleared
             #
 
-            if not self._hitmap[address]:
-                del self._hitmap[address]
+            ordinals = xrange(start, stop)
+            touched.extend(itertools.compress(ordinals, new_hits))
+            cleared.extend(itertools.compress(ordinals, itertools.imap(
+                operator.and_,
+                itertools.imap(operator.truth, old_hits),
+                itertools.imap(operator.not_, new_hits)
+            )))
 
-        # update the coverage hash incase the hitmap changed
-        self._update_coverage_hash()
+        hash_sum = self._address_hash_sum - sum(
+            itertools.imap(address_hash, itertools.imap(instructions.__getitem__, cleared))
+        )
 
-        #
-        # unmap everything because a complete re-mapping is easier with the
-        # current implementation of things
-        #
+        # subtract the hit counts of the addresses that are not known instructions
+        sparse_hits = self._sparse_hits
+        for address, hit_count in coverage._sparse_hits.iteritems():
+            if not address in sparse_hits:
+                continue
+            remaining = sparse_hits[address] - hit_count
+            if remaining > 0:
+                sparse_hits[address] = remaining
+            else:
+                hash_sum -= address_hash(address)
+                del sparse_hits[address]
 
-        self.unmap_all()
+        # clear the bits of the instructions no longer executed
+        if cleared:
+            self._bitmap = self._bitmap.difference(CompressedBitmap.from_ordinals(cleared))
 
-    def mask_data(self, coverage_mask):
+        self._address_hash_sum = hash_sum & MASK64
+        return (CompressedBitmap.from_ordinals(touched), cleared)
+
+    def _subtract_hits(self, hitmap):
         """
-        Mask the hitmap data against a given coverage mask.
+        Subtract the given hitmap from our coverage data.
 
-        Returns a new DatabaseCoverage containing the masked hitmap.
+        Returns a tuple of (touched, cleared), where touched is a compressed
+        bitmap of the instruction ordinals that remain executed (with fewer hits), and
+        cleared is a list of the ordinals that are no longer executed.
         """
-        composite_data = collections.defaultdict(int)
+        hits = self._hits
+        sparse_hits = self._sparse_hits
+        hash_sum = self._address_hash_sum
+        touched = []
+        cleared = []
+
+        addresses = sorted(hitmap)
+        ordinals = self._snapshot.get_instruction_nums(addresses)
+
+        for address, ordinal in itertools.izip(addresses, ordinals):
+            hit_count = hitmap[address]
+
+            # the address is not a known instruction, update it separately
+            if ordinal == BADINSTRUCTION:
+                if not address in sparse_hits:
+                    continue
+                remaining = sparse_hits[address] - hit_count
+                if remaining > 0:
+                    sparse_hits[address] = remaining
+                else:
+                    hash_sum -= address_hash(address)
+                    del sparse_hits[address]
+                continue
 
-        # preserve only hitmap data that matches the coverage mask
-        for address in coverage_mask:
-            composite_data[address] = self._hitmap[address]
+            if not hits[ordinal]:
+                continue
 
-        # done, return a new DatabaseCoverage masked with the given coverage
-        return DatabaseCoverage(composite_data, self.palette)
+            #
+            # if there is no longer any hits for this instruction, it must be
+            # cleared from the coverage bitmap/mask
+            #
 
-    def _update_coverage_hash(self):
-        """
-        Update the hash of the coverage mask.
-        """
-        if self._hitmap:
-            self.coverage_hash = hash(frozenset(self._hitmap.viewkeys()))
-        else:
-            self.coverage_hash = 0
+            remaining = hits[ordinal] - hit_count
+            if remaining > 0:
+                hits[ordinal] = remaining
+                touched.append(ordinal)
+            else:
+                hash_sum -= address_hash(address)
+                hits[ordinal] = 0
+                cleared.append(ordinal)
+
+        # clear the bits of the instructions no longer executed
+        if cleared:
+            self._bitmap = self._bitmap.difference(CompressedBitmap.from_ordinals(cleared))
+
+        self._address_hash_sum = hash_sum & MASK64
+        return (CompressedBitmap.from_ordinals(touched), cleared)
 
     #--------------------------------------------------------------------------
     # Coverage Mapping
@@ -334,11 +1876,20 @@ class DatabaseCoverage(object):
         Map loaded coverage data to the given database metadata.
         """
 
+        # pin the current metadata snapshot to map against
+        self._rebase(self._metadata.snapshot)
+
         # re-map any unmapped coverage to nodes
         dirty_nodes = self._map_nodes()
+        dirty_nodes.update(self._dirty_nodes)
 
         # re-map nodes to functions
         dirty_functions = self._map_functions(dirty_nodes)
+        dirty_functions.update(self._dirty_functions)
+
+        # the modified nodes and functions will be finalized by the caller
+        self._dirty_nodes = {}
+        self._dirty_functions = {}
 
         # return the modified objects
         return (dirty_nodes, dirty_functions)
@@ -348,104 +1899,84 @@ class DatabaseCoverage(object):
         Map loaded runtime data to database defined nodes (basic blocks).
         """
         dirty_nodes = {}
-        addresses_to_map = collections.deque(sorted(self._unmapped_data))
+
+        # only instructions that are (still) executed need to be mapped
+        pending = self._unmapped_bitmap & self._bitmap
+        if not pending:
+            self._unmapped_bitmap = CompressedBitmap()
+            return dirty_nodes
+
+        # more code-friendly, readable aliases
+        instructions = self._snapshot.instructions
+        node_addresses, node_starts, node_ends = self._snapshot.get_node_instruction_bounds()
+        node_count = len(node_starts)
+        hits = self._hits
+        nodes = self.nodes
 
         #
-        # This while loop is the core of our coverage mapping process.
+        # This loop is the core of our coverage mapping process.
         #
-        # The '_unmapped_data' list is consumed by this loop, mapping
-        # any unmapped runtime data maintained by this DatabaseCoverage
-        # to the given database metadata.
+        # The instructions of each node (basic block) occupy a contiguous
+        # range of instruction ordinals, and the pending instructions come
+        # in runs of consecutive ordinals. rather than mapping the unmapped
+        # instructions one at a time, we walk each run from node to node,
+        # mapping the pending instructions within each node as one slice.
         #
         # It should be noted that the rest of the database coverage
         # mapping (eg functions) gets built ontop of the mappings we build
         # for nodes here using the more or less raw/recycled runtime data.
         #
 
-        while addresses_to_map:
-
-            # get the next address to map
-            address = addresses_to_map.popleft()
-
-            # get the node (basic block) that contains this address
-            node_metadata = self._metadata.get_node(address)
-
-            #
-            # failed to locate the node (basic block) for this address.
-            # this address must not fall inside of a defined function...
-            #
-
-            if not node_metadata:
-                continue
-
-            #
-            # we found applicable node metadata for this address, now try
-            # to find the mapping object for this node address
-            #
-
-            if node_metadata.address in self.nodes:
-                node_coverage = self.nodes[node_metadata.address]
-
-            #
-            # failed to locate a node coverage object, looks like this is
-            # the first time we have identiied coverage for this node.
-            # create a coverage node object and use it now.
-            #
-
-            else:
-                node_coverage = NodeCoverage(node_metadata.address, self._weak_self)
-                self.nodes[node_metadata.address] = node_coverage
-
-            # compute the basic block end now to reduce overhead in the loop below
-            node_end = node_metadata.address + node_metadata.size
-
-            #
-            # the loop below can be thought of almost as an inlined fast-path
-            # where we expect the next several addresses to belong to the same
-            # node (basic block).
-            #
-            # with the assumption of linear program execution, we can reduce
-            # the heavier overhead of all the lookup code above by simply
-            # checking if the next address in the queue (addresses_to_map)
-            # falls into the same / current node (basic block).
-            #
-            # we can simply re-use the current node and its coverage object
-            # until the next address to be processed falls outside our scope
-            #
+        unmappable = []
 
-            while 1:
+        node_index = 0
+        for ordinal, stop in pending.runs():
+            while ordinal < stop:
 
                 #
-                # map the hitmap data for the current address (an instruction)
-                # to this node mapping and mark the instruction as mapped by
-                # discarding its address from the unmapped data list
+                # locate the node (basic block) containing this instruction.
+                # if there is none, the instructions up to the next node
+                # cannot be mapped
                 #
 
-                if address in node_metadata.instructions:
-                    node_coverage.executed_instructions[address] = self._hitmap[address]
-                    self._unmapped_data.discard(address)
+                node_index = bisect.bisect_right(node_starts, ordinal, node_index) - 1
+                if node_index < 0 or ordinal >= node_ends[node_index]:
+                    next_index = node_index + 1
+                    end = min(stop, node_starts[next_index]) if next_index < node_count else stop
+                    unmappable.append(xrange(ordinal, end))
+                    node_index = max(node_index, 0)
+                    ordinal = end
+                    continue
 
-                # get the next address to attempt mapping on
-                address = addresses_to_map.popleft()
+                node_address = node_addresses[node_index]
+                end = min(stop, node_ends[node_index])
 
                 #
-                # if the next address is not in this node, it's time break out
-                # of this loop and send it through the full node lookup path
+                # try to find the mapping object for this node address. if
+                # this is the first time we have identified coverage for this
+                # node, create a coverage node object and use it now.
                 #
 
-                if not (node_metadata.address <= address < node_end):
-                    addresses_to_map.appendleft(address)
-                    break
+                node_coverage = nodes.get(node_address, None)
+                if not node_coverage:
+                    node_coverage = NodeCoverage(node_address, self._weak_self)
+                    nodes[node_address] = node_coverage
 
-                #
-                # the next address to be mapped DOES fall within our current
-                # node, loop back around in the fast-path and map it
-                #
+                # map the hitmap data for the pending instructions of this node
+                node_coverage.executed_instructions.update(
+                    itertools.izip(instructions[ordinal:end], hits[ordinal:end])
+                )
+
+                # since we updated this node, ensure we're tracking it as dirty
+                dirty_nodes[node_address] = node_coverage
 
-                # ...
+                # continue with the next pending instruction after this node
+                ordinal = end
 
-            # since we updated this node, ensure we're tracking it as dirty
-            dirty_nodes[node_metadata.address] = node_coverage
+        # any instructions that could not be mapped remain unmapped
+        self._unmapped_bitmap = CompressedBitmap.from_ordinals(
+            itertools.chain.from_iterable(unmappable)
+        )
 
         # done
         return dirty_nodes
@@ -469,7 +2000,7 @@ class DatabaseCoverage(object):
             # metadata so that we can perform a reverse lookup of the fun
             #
 
-            function_metadata = self._metadata.nodes[node_coverage.address].function
+            function_metadata = self._snapshot.nodes[node_coverage.address].function
 
             #
             # now we can add this node to its respective function level
@@ -501,8 +2032,14 @@ class DatabaseCoverage(object):
         """
         Unmap all mapped data.
         """
-        self._unmapped_data = set(self._hitmap.keys())
-        self._unmapped_data.add(idaapi.BADADDR)
+        self._unmapped_bitmap = self._bitmap
+        self._dirty_nodes = {}
+        self._dirty_functions = {}
+        self._instructions_executed = 0
+        self._unfinalized_functions = {}
+        self._edges_taken = None
+        self._frontier = None
+        self._function_frontier = None
         self.nodes     = {}
         self.functions = {}
 
@@ -519,6 +2056,65 @@ class DatabaseCoverage(object):
         self._unmap_nodes(itertools.chain(delta.nodes_removed, delta.nodes_modified))
         self._unmap_functions(delta.functions_removed)
 
+    def _unmap_instructions(self, ordinals):
+        """
+        Unmap the instructions with the given ordinals from their nodes.
+        """
+        instructions = self._snapshot.instructions
+        node_addresses, node_starts, node_ends = self._snapshot.get_node_instruction_bounds()
+
+        #
+        # remove each instruction from the coverage of the node containing it,
+        # taking note of the nodes that we modify along the way
+        #
+
+        modified_nodes = {}
+        for ordinal in ordinals:
+            node_index = bisect.bisect_right(node_starts, ordinal) - 1
+            if node_index < 0 or ordinal >= node_ends[node_index]:
+                continue
+
+            node_coverage = self.nodes.get(node_addresses[node_index], None)
+            if not node_coverage:
+                continue
+
+            node_coverage.executed_instructions.pop(instructions[ordinal], None)
+            modified_nodes[node_coverage.address] = node_coverage
+
+        #
+        # nodes that still have executed instructions simply need to be
+        # finalized again. nodes without any must be removed from our
+        # mapping, and from the function coverage they were part of
+        #
+
+        for node_address, node_coverage in modified_nodes.iteritems():
+            if node_coverage.executed_instructions:
+                self._dirty_nodes[node_address] = node_coverage
+                continue
+
+            self.nodes.pop(node_address, None)
+            self._dirty_nodes.pop(node_address, None)
+
+            node_metadata = self._snapshot.nodes.get(node_address, None)
+            if not node_metadata:
+                continue
+
+            function_address = node_metadata.function.address
+            function_coverage = self.functions.get(function_address, None)
+            if not function_coverage:
+                continue
+
+            # the function is still executed, it will need to be finalized
+            function_coverage.nodes.pop(node_address, None)
+            if function_coverage.nodes:
+                self._dirty_functions[function_address] = function_coverage
+                continue
+
+            # the function is no longer executed at all
+            del self.functions[function_address]
+            self._dirty_functions.pop(function_address, None)
+            self._instructions_executed -= function_coverage.instructions_executed
+
     def _unmap_nodes(self, node_addresses):
         """
         Unmap any data associated with a given list of node addresses.
@@ -531,6 +2127,8 @@ class DatabaseCoverage(object):
         # mapping so we can selectively regenerate their coverage later.
         #
 
+        unmapped = []
+
         for node_address in node_addresses:
 
             #
@@ -543,16 +2141,20 @@ class DatabaseCoverage(object):
                 continue
 
             # the node was found, unmap any of its tracked coverage blocks
-            self._unmapped_data.update(
-                node_coverage.executed_instructions.viewkeys()
-            )
+            unmapped.extend(node_coverage.executed_instructions.viewkeys())
+
+        ordinals = self._snapshot.get_instruction_nums(sorted(unmapped))
+        self._unmapped_bitmap = self._unmapped_bitmap | \
+            CompressedBitmap.from_ordinals(x for x in ordinals if x != BADINSTRUCTION)
 
     def _unmap_functions(self, function_addresses):
         """
         Unmap any data associated with a given list of function addresses.
         """
         for function_address in function_addresses:
-            self.functions.pop(function_address, None)
+            function_coverage = self.functions.pop(function_address, None)
+            if function_coverage:
+                self._instructions_executed -= function_coverage.instructions_executed
 
     #--------------------------------------------------------------------------
     # Debug
@@ -563,9 +2165,19 @@ class DatabaseCoverage(object):
         Dump the unmapped coverage data.
         """
         lmsg("Unmapped Coverage:")
-        for address in self._unmapped_data:
+        for address in self._unmapped_addresses():
             lmsg(" * 0x%X" % address)
 
+    def _unmapped_addresses(self):
+        """
+        Yield the addresses of the coverage data that is not mapped.
+        """
+        instructions = self._snapshot.instructions
+        for ordinal in self._unmapped_bitmap:
+            yield instructions[ordinal]
+        for address in self._sparse_hits:
+            yield address
+
 #------------------------------------------------------------------------------
 # Function Level Coverage
 #------------------------------------------------------------------------------
@@ -573,8 +2185,31 @@ class DatabaseCoverage(object):
 class FunctionCoverage(object):
     """
     Function level coverage mapping.
+
+    The coverage metrics of a function are computed once, when they are
+    first accessed after the coverage changes, rather than each time they
+    are accessed (eg, by sorting).
     """
 
+    __slots__ = (
+        "_database",
+        "_finalized",
+        "address",
+        "nodes",
+        "instructions_executed",
+        "_hits",
+        "_instructions",
+        "_instruction_percent",
+        "_node_percent",
+        "_executions",
+        "_coverage_color",
+        "_edges_finalized",
+        "_edges_executed",
+        "_edge_percent",
+        "_node_count",
+        "_instruction_count"
+    )
+
     def __init__(self, function_address, database=None):
         self._database = database
         self.address = function_address
@@ -582,15 +2217,40 @@ class FunctionCoverage(object):
         # addresses of nodes executed
         self.nodes = {}
 
+        # the number of unique instructions executed in this function
+        self.instructions_executed = 0
+
+        #
+        # the remaining metrics are computed lazily (see finalize). they are
+        # considered final until coverage is mapped to this function
+        #
+
+        self._finalized = True
+
+        # the cumulative instruction executions in this function
+        self._hits = 0
+
+        # the instruction addresses executed in this function
+        self._instructions = frozenset()
+
         # compute the # of instructions executed by this function's coverage
-        self.instruction_percent = 0.0
-        self.node_percent = 0.0
+        self._instruction_percent = 0.0
+        self._node_percent = 0.0
 
-        # baked colors
-        if function_address == idaapi.BADADDR:
-            self.coverage_color = QtGui.QColor(30, 30, 30)
-        else:
-            self.coverage_color = 0
+        # the estimated number of executions this function has experienced
+        self._executions = 0.0
+
+        # the edge coverage of this function, computed lazily (see edge_percent)
+        self._edges_finalized = True
+        self._edges_executed = 0
+        self._edge_percent = 0.0
+
+        # the size of the function, as of the last invalidation
+        self._node_count = 0
+        self._instruction_count = 0
+
+        # baked colors, computed lazily (see coverage_color)
+        self._coverage_color = None
 
     #--------------------------------------------------------------------------
     # Properties
@@ -601,7 +2261,9 @@ class FunctionCoverage(object):
         """
         The cumulative instruction executions in this function.
         """
-        return sum(x.hits for x in self.nodes.itervalues())
+        if not self._finalized:
+            self.finalize()
+        return self._hits
 
     @property
     def nodes_executed(self):
@@ -611,18 +2273,81 @@ class FunctionCoverage(object):
         return len(self.nodes)
 
     @property
-    def instructions_executed(self):
+    def instructions(self):
         """
-        The number of unique instructions executed in this function.
+        The instruction addresses executed in this function.
         """
-        return sum(x.instructions_executed for x in self.nodes.itervalues())
+        if not self._finalized:
+            self.finalize()
+        return self._instructions
 
     @property
-    def instructions(self):
+    def instruction_percent(self):
+        """
+        The % of instructions executed in this function.
+        """
+        if not self._finalized:
+            self.finalize()
+        return self._instruction_percent
+
+    @property
+    def node_percent(self):
+        """
+        The % of nodes executed in this function.
+        """
+        if not self._finalized:
+            self.finalize()
+        return self._node_percent
+
+    @property
+    def executions(self):
+        """
+        The estimated number of executions this function has experienced.
+        """
+        if not self._finalized:
+            self.finalize()
+        return self._executions
+
+    @property
+    def edges_executed(self):
+        """
+        The number of intra-function edges taken in this function (or None).
+        """
+        if not self._edges_finalized:
+            self._finalize_edges()
+        return self._edges_executed
+
+    @property
+    def edge_percent(self):
+        """
+        The % of intra-function edges taken in this function (or None).
+        """
+        if not self._edges_finalized:
+            self._finalize_edges()
+        return self._edge_percent
+
+    @property
+    def frontier(self):
+        """
+        The uncovered instructions behind this function's frontier (or None).
+        """
+        if self._database is None:
+            return 0
+        function_frontier = self._database.function_frontier()
+        if function_frontier is None:
+            return None
+        return function_frontier.get(self.address, 0)
+
+    @property
+    def coverage_color(self):
         """
-        The instruction addresses in this function.
+        The coverage color of this function.
         """
-        return set([ea for node in self.nodes.itervalues() for ea in node.executed_instructions.keys()])
+        if not self._finalized:
+            self.finalize()
+        if self._coverage_color is None:
+            self._coverage_color = compute_function_color(self)
+        return self._coverage_color
 
     #--------------------------------------------------------------------------
     # Controls
@@ -634,31 +2359,80 @@ class FunctionCoverage(object):
         """
         self.nodes[node_coverage.address] = node_coverage
 
+    def invalidate(self):
+        """
+        Invalidate the coverage metrics, after coverage is mapped to this function.
+
+        Only the number of executed instructions is updated immediately, the
+        rest of the metrics will be recomputed when they are next accessed.
+        The size of the function is captured now, as the metadata it was
+        mapped against may have moved on (or dropped it) by then.
+        """
+        self.instructions_executed = sum(
+            len(node.executed_instructions) for node in self.nodes.itervalues()
+        )
+
+        function_metadata = self._database._snapshot.functions.get(self.address, None)
+        if function_metadata:
+            self._node_count = function_metadata.node_count
+            self._instruction_count = function_metadata.instruction_count
+
+        self._finalized = False
+        self._edges_finalized = False
+
     def finalize(self):
         """
         Finalize coverage data for use.
         """
-        function_metadata = self._database._metadata.functions[self.address]
+        nodes = self.nodes.values()
+
+        # compute the function metrics from its nodes
+        self._hits = sum(node.hits for node in nodes)
+        self._instructions = frozenset(itertools.chain.from_iterable(
+            node.executed_instructions for node in nodes
+        ))
 
         # compute the % of nodes executed
-        self.node_percent = float(self.nodes_executed) / function_metadata.node_count
+        node_count = self._node_count or 1
+        self._node_percent = float(len(nodes)) / node_count
 
         # compute the % of instructions executed
-        self.instruction_percent = \
-            float(self.instructions_executed) / function_metadata.instruction_count
+        self._instruction_percent = \
+            float(self.instructions_executed) / (self._instruction_count or 1)
 
         # the sum of node executions in this function
-        node_sum = sum(x.executions for x in self.nodes.itervalues())
+        node_sum = sum(node.executions for node in nodes)
 
         # the estimated number of executions this function has experienced
-        self.executions = float(node_sum) / function_metadata.node_count
+        self._executions = float(node_sum) / node_count
 
-        # bake colors
-        self.coverage_color = compute_color_on_gradiant(
-            self.instruction_percent,
-            self._database.palette.coverage_bad,
-            self._database.palette.coverage_good
-        )
+        # the color is baked when next requested
+        self._coverage_color = None
+
+        self._finalized = True
+
+    def _finalize_edges(self):
+        """
+        Finalize the edge coverage of this function.
+
+        Edges are kept separate from the rest of the metrics, as they are
+        collected after the rest of the metadata. Until they are, the edge
+        metrics are None.
+        """
+        edges_taken = self._database._get_edges_taken()
+        if edges_taken is None:
+            self._edges_executed = None
+            self._edge_percent = None
+            return
+
+        _, _, bounds = self._database._snapshot.get_edges()
+        start, end = bounds.get(self.address, (0, 0))
+
+        # count the edges taken, as flagged for the whole database
+        self._edges_executed = edges_taken.count("\x01", start, end)
+        self._edge_percent = float(self._edges_executed) / (end - start) if end > start else 0.0
+
+        self._edges_finalized = True
 
 #------------------------------------------------------------------------------
 # Node Coverage / Data Mapping
@@ -669,11 +2443,37 @@ class NodeCoverage(object):
     Node (basic block) level coverage mapping.
     """
 
+    __slots__ = (
+        "_database",
+        "_finalized",
+        "address",
+        "executed_instructions",
+        "_hits",
+        "_executions",
+        "_coverage_color",
+        "_instruction_count"
+    )
+
     def __init__(self, node_address, database=None):
         self._database = database
         self.address = node_address
         self.executed_instructions = {}
 
+        # the metrics below are computed lazily (see finalize)
+        self._finalized = False
+
+        # the size of the node, as of the last invalidation
+        self._instruction_count = 0
+
+        # the cumulative instruction executions in this node
+        self._hits = 0
+
+        # the estimated number of executions this node has experienced
+        self._executions = 0.0
+
+        # baked colors, computed lazily (see coverage_color)
+        self._coverage_color = None
+
     #--------------------------------------------------------------------------
     # Properties
     #--------------------------------------------------------------------------
@@ -683,7 +2483,9 @@ class NodeCoverage(object):
         """
         The cumulative instruction executions in this node.
         """
-        return sum(self.executed_instructions.itervalues())
+        if not self._finalized:
+            self.finalize()
+        return self._hits
 
     @property
     def instructions_executed(self):
@@ -692,20 +2494,92 @@ class NodeCoverage(object):
         """
         return len(self.executed_instructions)
 
+    @property
+    def executions(self):
+        """
+        The estimated number of executions this node has experienced.
+        """
+        if not self._finalized:
+            self.finalize()
+        return self._executions
+
+    @property
+    def coverage_color(self):
+        """
+        The coverage color of this node.
+        """
+        if not self._finalized:
+            self.finalize()
+        if self._coverage_color is None:
+            self._coverage_color = self._database.palette.ida_coverage
+        return self._coverage_color
+
     #--------------------------------------------------------------------------
     # Controls
     #--------------------------------------------------------------------------
 
+    def invalidate(self):
+        """
+        Invalidate the coverage metrics, they will be recomputed on access.
+        """
+        node_metadata = self._database._snapshot.nodes.get(self.address, None)
+        if node_metadata:
+            self._instruction_count = node_metadata.instruction_count
+        self._finalized = False
+
     def finalize(self):
         """
         Finalize the coverage metrics for faster access.
         """
-        palette = self._database.palette
-        node_metadata = self._database._metadata.nodes[self.address]
+
+        # the cumulative instruction executions in this node
+        self._hits = sum(self.executed_instructions.itervalues())
 
         # the estimated number of executions this node has experienced.
-        self.executions = float(self.hits) / node_metadata.instruction_count
+        self._executions = float(self._hits) / (self._instruction_count or 1)
+
+        # the color is baked when next requested
+        self._coverage_color = None
+
+        self._finalized = True
+
+#------------------------------------------------------------------------------
+# Helpers
+#------------------------------------------------------------------------------
+
+def compute_function_color(function_coverage):
+    """
+    Compute the coverage color of the given function coverage.
+
+    Colors are Qt objects computed from the palette, which is imported
+    lazily. This keeps the coverage itself free of Qt, so that coverage
+    can still be mapped, composed, and reported when used headless.
+    """
+    from lighthouse.util.shims import QtGui
+    from lighthouse.palette import compute_color_on_gradiant
+
+    # a blank function coverage, used for functions without coverage
+    if function_coverage.address == BADADDR:
+        return QtGui.QColor(30, 30, 30)
 
-        # bake colors
-        self.coverage_color = palette.ida_coverage
+    palette = function_coverage._database.palette
+    return compute_color_on_gradiant(
+        function_coverage.instruction_percent,
+        palette.coverage_bad,
+        palette.coverage_good
+    )
 
+MASK64 = 0xFFFFFFFFFFFFFFFF
+
+def address_hash(address):
+    """
+    Compute a strong 64bit hash of the given address.
+
+    The builtin hash() of an integer is simply the integer itself, making
+    it a poor choice for the (additive) coverage hash. This is the mixing
+    function of splitmix64.
+    """
+    x = (address + 0x9E3779B97F4A7C15) & MASK64
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
@@ -1,14 +1,20 @@
+import os
 import time
+import array
+import heapq
 import string
+import shutil
+import Queue
 import logging
+import tempfile
+import itertools
 import threading
 import collections
 
-import idaapi # TODO: remove in v0.8
-
 from lighthouse.util import *
-from lighthouse.metadata import DatabaseMetadata, metadata_progress
-from lighthouse.coverage import DatabaseCoverage
+from lighthouse.metadata import DatabaseMetadata
+from lighthouse.backends import metadata_progress, coverage_progress
+from lighthouse.coverage import DatabaseCoverage, CoverageRarity
 from lighthouse.composer.parser import *
 
 logger = logging.getLogger("Lighthouse.Director")
@@ -20,7 +26,8 @@ logger = logging.getLogger("Lighthouse.Director")
 HOT_SHELL       = "Hot Shell"
 NEW_COMPOSITION = "New Composition"
 AGGREGATE       = "Aggregate"
-SPECIAL_NAMES   = set([HOT_SHELL, AGGREGATE, NEW_COMPOSITION])
+FRONTIER        = "Frontier"
+SPECIAL_NAMES   = set([HOT_SHELL, AGGREGATE, NEW_COMPOSITION, FRONTIER])
 
 AGGREGATE_ALIAS = '*'
 ASCII_SHORTHAND = list(string.ascii_uppercase)
@@ -41,17 +48,20 @@ class CoverageDirector(object):
     between multiple coverage sets.
     """
 
-    def __init__(self, palette):
+    def __init__(self, palette, backend=None):
 
         # color palette
         self._palette = palette
 
-        # database metadata cache
-        self.metadata = DatabaseMetadata()
+        # database metadata cache, collected through the given backend
+        self.metadata = DatabaseMetadata(backend)
 
         # flag to suspend/resume the automatic coverage aggregation
         self._aggregation_suspended = False
 
+        # flag to indicate coverage was mapped against incomplete metadata
+        self._partial_mapping = False
+
         #----------------------------------------------------------------------
         # Coverage
         #----------------------------------------------------------------------
@@ -62,6 +72,12 @@ class CoverageDirector(object):
         # loaded or composed database coverage mappings
         self._database_coverage = collections.OrderedDict()
 
+        # spills inactive coverage mappings to disk, to bound memory usage
+        self._spiller = CoverageSpiller()
+
+        # the number of loaded coverage sets that hit each instruction
+        self._rarity = CoverageRarity(self.metadata.snapshot)
+
         # a NULL / empty coverage set
         self._NULL_COVERAGE = DatabaseCoverage(None, palette)
 
@@ -79,8 +95,16 @@ class CoverageDirector(object):
             (HOT_SHELL,       DatabaseCoverage(None, palette)), # hot shell composition
             (NEW_COMPOSITION, DatabaseCoverage(None, palette)), # slow shell composition
             (AGGREGATE,       DatabaseCoverage(None, palette)), # aggregate composition
+            (FRONTIER,        DatabaseCoverage(None, palette)), # aggregate frontier
         ])
 
+        # the special coverage sets are mapped against the director's metadata
+        for special_coverage in self._special_coverage.itervalues():
+            special_coverage.update_metadata(self.metadata)
+
+        # the frontier is rebuilt when next selected after the aggregate changes
+        self._frontier_stale = True
+
         #----------------------------------------------------------------------
         # Aliases
         #----------------------------------------------------------------------
@@ -186,6 +210,9 @@ class CoverageDirector(object):
         # metadata callbacks
         self._metadata_modified_callbacks = []
 
+        # register for cues from the metadata
+        self.metadata.metadata_refreshed(self._metadata_refreshed)
+
     def terminate(self):
         """
         Cleanup & terminate the director.
@@ -195,6 +222,9 @@ class CoverageDirector(object):
         self._ast_queue.put(None)
         self._composition_worker.join()
 
+        # delete any coverage spilled to disk
+        self._spiller.terminate()
+
 	# spin down the live metadata object
 	self.metadata.terminate()
 
@@ -216,6 +246,13 @@ class CoverageDirector(object):
         """
         return self._special_coverage[AGGREGATE]
 
+    @property
+    def rarity(self):
+        """
+        The number of loaded coverage sets that hit each instruction.
+        """
+        return self._rarity
+
     @property
     def coverage_names(self):
         """
@@ -352,6 +389,18 @@ class CoverageDirector(object):
 
         self.coverage_name = coverage_name
 
+        #
+        # bring the selected coverage back into memory if it was spilled to
+        # disk, and make room for it by spilling other inactive coverage
+        #
+
+        self.get_coverage(coverage_name)
+        self._enforce_memory_budget()
+
+        # the frontier is only built when it is put to use
+        if coverage_name == FRONTIER:
+            self._refresh_frontier()
+
         # notify any listeners that we have switched our active coverage
         self._notify_coverage_switched()
 
@@ -413,7 +462,9 @@ class CoverageDirector(object):
 
         if coverage_name in self.coverage_names:
             old_coverage = self._database_coverage[coverage_name]
-            self.aggregate.subtract_data(old_coverage.data)
+            self.aggregate.subtract_coverage(old_coverage)
+            self._rarity.subtract(old_coverage.coverage)
+            self._discard_spill(coverage_name)
             if not self._aggregation_suspended:
                 self._refresh_aggregate()
 
@@ -423,16 +474,31 @@ class CoverageDirector(object):
         #
 
         self._database_coverage[coverage_name] = new_coverage
+        self._spiller.touch(coverage_name, new_coverage)
 
         # (re)-add the newly loaded/updated coverage to the aggregate set
-        self.aggregate.add_data(new_coverage.data)
+        self.aggregate.add_coverage(new_coverage)
+        self._rarity.add(new_coverage.coverage)
         if not self._aggregation_suspended:
             self._refresh_aggregate()
 
+        # spill inactive coverage to disk if we are over the memory budget
+        self._enforce_memory_budget()
+
     def _new_coverage(self, coverage_data):
         """
         Build a new database coverage object from the given data.
         """
+
+        #
+        # coverage may be mapped while the metadata for the rest of the
+        # database is still being collected in the background. take note
+        # of this, so that we can complete the mapping once it finishes.
+        #
+
+        if not self.metadata.cached:
+            self._partial_mapping = True
+
         new_coverage = DatabaseCoverage(coverage_data, self._palette)
         new_coverage.update_metadata(self.metadata)
         new_coverage.refresh()
@@ -485,7 +551,9 @@ class CoverageDirector(object):
         coverage = self._database_coverage.pop(coverage_name)
         # TODO: check if there's any references to the coverage object here...
 
-        self.aggregate.subtract_data(coverage.data)
+        self.aggregate.subtract_coverage(coverage)
+        self._rarity.subtract(coverage.coverage)
+        self._discard_spill(coverage_name)
         if not self._aggregation_suspended:
             self._refresh_aggregate()
 
@@ -498,16 +566,62 @@ class CoverageDirector(object):
         for coverage_name in self.coverage_names:
             self._release_shorthand_alias(coverage_name)
             self._database_coverage.pop(coverage_name)
+            self._discard_spill(coverage_name)
 
         # TODO: check if there's any references to the coverage aggregate...
 
         # assign a new, blank aggregate set
         self._special_coverage[AGGREGATE] = DatabaseCoverage(None, self._palette)
+        self.aggregate.update_metadata(self.metadata)
+        self._rarity = CoverageRarity(self.metadata.snapshot)
         self._refresh_aggregate() # probably not needed
 
     def get_coverage(self, name):
         """
         Retrieve coverage data for the requested coverage_name.
+
+        Coverage that was spilled to disk is brought back into memory.
+        """
+        coverage = self._get_coverage(name)
+
+        #
+        # rehydrating spilled coverage rebuilds data that the composition
+        # worker may be reading, so it must be done under the composition
+        # lock. only the main thread spills coverage (see enforce)
+        #
+
+        if coverage.spilled:
+            await_lock(self._composition_lock)
+            self._touch_coverage(name, coverage)
+            self._composition_lock.release()
+        else:
+            self._touch_coverage(name, coverage)
+
+        return coverage
+
+    def _touch_coverage(self, name, coverage):
+        """
+        Mark loaded coverage as recently used, rehydrating it if needed.
+
+        The caller must hold the composition lock if the coverage is spilled.
+        """
+        coverage_name = self._alias2name.get(name, name)
+        if coverage_name in self.coverage_names:
+            self._spiller.touch(coverage_name, coverage)
+
+    def _discard_spill(self, coverage_name):
+        """
+        Stop tracking the given coverage for spilling, deleting its spill.
+        """
+
+        # coverage is shared with the composition worker, lock it down
+        await_lock(self._composition_lock)
+        self._spiller.discard(coverage_name)
+        self._composition_lock.release()
+
+    def _get_coverage(self, name):
+        """
+        Retrieve coverage data for the requested coverage_name, as is.
         """
 
         # no matching coverage, return a blank coverage set
@@ -533,11 +647,16 @@ class CoverageDirector(object):
         """
 
         # special case
-        if coverage_name == HOT_SHELL or coverage_name == NEW_COMPOSITION:
+        if coverage_name in [HOT_SHELL, NEW_COMPOSITION, FRONTIER]:
             return coverage_name
 
+        #
+        # NOTE: the instruction percent of spilled coverage remains available,
+        # so there is no need to bring it back into memory here
+        #
+
         symbol   = self.get_shorthand(coverage_name)
-        coverage = self.get_coverage(coverage_name)
+        coverage = self._get_coverage(coverage_name)
 
         #
         # build a detailed coverage string
@@ -549,6 +668,87 @@ class CoverageDirector(object):
 
         return coverage_string
 
+    def minimize(self, coverage_names=None):
+        """
+        Select a small subset of loaded coverage with the same aggregate.
+
+        This is a greedy set cover, eg to distill a fuzzing corpus. Returns
+        a list of (coverage_name, contribution) in the order the sets were
+        selected, where contribution is the number of instructions that a
+        set added to the coverage of the sets selected before it.
+        """
+        if coverage_names is None:
+            coverage_names = self.coverage_names
+        coverage_names = list(coverage_names)
+        snapshot = self.metadata.snapshot
+
+        #
+        # NOTE: the coverage mask of spilled coverage remains in memory, so
+        # there is no need to bring the sets back into memory here
+        #
+
+        masks = [self._get_coverage(name).coverage.rebase(snapshot) for name in coverage_names]
+
+        #
+        # the instructions covered by the selected sets are tracked as a flag
+        # per instruction ordinal. the contribution of a set is then counted
+        # over its runs of ordinals with bytearray.count, rather than by
+        # building a new bitmap for every evaluation
+        #
+
+        covered = bytearray(len(snapshot.instructions))
+        covered_sparse = set()
+        runs = {}
+
+        #
+        # the contribution of a set can only shrink as other sets are selected,
+        # so contributions are re-evaluated lazily. the set with the largest
+        # (possibly stale) contribution is popped from the queue & evaluated.
+        # if it still beats every other stale contribution, it is selected.
+        # otherwise, it is queued again with its updated contribution
+        #
+
+        queue = [(-len(mask), index) for index, mask in enumerate(masks) if mask]
+        heapq.heapify(queue)
+
+        selected = []
+        while queue:
+            _, index = heapq.heappop(queue)
+            mask = masks[index]
+
+            # the (start, stop) runs of a set are unpacked on first evaluation
+            if not index in runs:
+                set_runs = list(mask.bitmap.runs())
+                runs[index] = (
+                    array.array("I", [start for start, _ in set_runs]),
+                    array.array("I", [stop for _, stop in set_runs])
+                )
+            starts, stops = runs[index]
+
+            # count the instructions of the set that are not yet covered
+            contribution = len(mask.bitmap) + len(mask.sparse - covered_sparse)
+            contribution -= sum(itertools.imap(covered.count, itertools.repeat("\x01"), starts, stops))
+
+            # the set no longer adds anything to the selected coverage
+            if not contribution:
+                del runs[index]
+                continue
+
+            # another set may now contribute more, re-queue this one
+            if queue and contribution < -queue[0][0]:
+                heapq.heappush(queue, (-contribution, index))
+                continue
+
+            # select the set, marking its instructions as covered
+            for start, stop in itertools.izip(starts, stops):
+                covered[start:stop] = "\x01" * (stop - start)
+            covered_sparse |= mask.sparse
+            del runs[index]
+
+            selected.append((coverage_names[index], contribution))
+
+        return selected
+
     #----------------------------------------------------------------------
     # Aliases
     #----------------------------------------------------------------------
@@ -909,7 +1109,12 @@ class CoverageDirector(object):
         Returns an existing coverage set.
         """
         assert isinstance(coverage_token, TokenCoverageSingle)
-        return self.get_coverage(self._alias2name[coverage_token.symbol])
+        coverage_name = self._alias2name[coverage_token.symbol]
+        coverage = self._get_coverage(coverage_name)
+
+        # NOTE: the composition lock is already held by our caller
+        self._touch_coverage(coverage_name, coverage)
+        return coverage
 
     def _evaluate_coverage_range(self, range_token):
         """
@@ -925,9 +1130,14 @@ class CoverageDirector(object):
         # exapand 'A,Z' to ['A', 'B', 'C', ... , 'Z']
         symbols = [chr(x) for x in range(ord(range_token.symbol_start), ord(range_token.symbol_end) + 1)]
 
-        # build a coverage aggregate described by the range of shorthand symbols
+        #
+        # build a coverage aggregate described by the range of shorthand
+        # symbols. the hit counts of spilled coverage are merged directly
+        # from disk, so there is no need to bring it back into memory
+        #
+
         for symbol in symbols:
-            output.add_data(self.get_coverage(self._alias2name[symbol]).data)
+            output.add_coverage(self._get_coverage(self._alias2name[symbol]))
 
         # return the computed coverage
         return output
@@ -949,6 +1159,9 @@ class CoverageDirector(object):
         # (re)map each set of loaded coverage data to the database
         self._refresh_database_coverage()
 
+        # the frontier follows the (possibly changed) control flow graph
+        self._invalidate_frontier()
+
     def refresh_metadata(self, progress_callback=None, force=False):
         """
         Refresh the database metadata cache utilized by the director.
@@ -978,12 +1191,63 @@ class CoverageDirector(object):
             fake_queue.put(False)
             return fake_queue
 
+        #
+        # a refresh may already be running, eg, finishing up in the background
+        # after coverage was mapped against its prioritized functions. simply
+        # return a channel that will complete with the running refresh.
+        #
+
+        if self.metadata.refreshing:
+            return self.metadata.prioritize()
+
         # start the asynchronous metadata refresh
         result_queue = self.metadata.refresh(progress_callback=progress_callback)
 
         # return the channel that will carry asynchronous result
         return result_queue
 
+    @idafast
+    def _metadata_refreshed(self):
+        """
+        Handle the completion of an asynchronous metadata refresh.
+
+        This callback fires from the metadata worker thread. It is marshalled
+        to the main thread, which owns the coverage mappings read by the UI.
+        """
+
+        #
+        # if no coverage was mapped while the metadata was incomplete, there
+        # is nothing to do. otherwise, the coverage data that could not be
+        # mapped earlier can now be mapped to the newly collected functions.
+        #
+
+        if not self._partial_mapping:
+            return
+        self._partial_mapping = False
+
+        logger.debug("Completing partial coverage mappings")
+
+        # coverage is shared with the composition worker, lock it down
+        await_lock(self._composition_lock)
+
+        # map any remaining coverage data to the completed metadata
+        for name in self.all_names:
+            coverage = self._get_coverage(name)
+
+            # spilled coverage is re-mapped when it is brought back into memory
+            if coverage.spilled:
+                coverage.rebase_spill(self.metadata.snapshot)
+                continue
+
+            if coverage.metadata_version != self.metadata.version:
+                coverage.refresh()
+
+        # done operating on shared data (coverage), release the lock
+        self._composition_lock.release()
+
+        # notify any listeners that the loaded coverage has been updated
+        self._notify_coverage_modified()
+
     def _refresh_database_coverage(self):
         """
         Refresh all the database coverage mappings managed by the director.
@@ -992,10 +1256,22 @@ class CoverageDirector(object):
 
         for i, name in enumerate(self.all_names, 1):
             logger.debug(" - %s" % name)
-            idaapi.replace_wait_box(
-                "Refreshing coverage mapping %u/%u" % (i, len(self.all_names))
-            )
-            coverage = self.get_coverage(name)
+            if coverage_progress:
+                coverage_progress(i, len(self.all_names))
+            coverage = self._get_coverage(name)
+
+            #
+            # spilled coverage is re-mapped when it is brought back into
+            # memory, but must let go of the outdated metadata snapshot. its
+            # spill is shared with the composition worker, lock it down
+            #
+
+            if coverage.spilled:
+                await_lock(self._composition_lock)
+                coverage.rebase_spill(self.metadata.snapshot)
+                self._composition_lock.release()
+                continue
+
             coverage.update_metadata(self.metadata)
             coverage.refresh()
 
@@ -1003,9 +1279,65 @@ class CoverageDirector(object):
         """
         Refresh the aggregate coverage set.
         """
-        self.aggregate.update_metadata(self.metadata)
+
+        #
+        # the aggregate is updated incrementally as coverage is added to or
+        # subtracted from it. it only needs to be completely re-mapped if it
+        # was last mapped against a different snapshot of the metadata
+        #
+
+        if self.aggregate.snapshot is not self.metadata.snapshot:
+            self.aggregate.update_metadata(self.metadata)
+
         self.aggregate.refresh()
 
+        # the frontier is derived from the aggregate
+        self._invalidate_frontier()
+
+    def _invalidate_frontier(self):
+        """
+        Mark the frontier coverage set as stale, rebuilding it if in use.
+        """
+        self._frontier_stale = True
+        if self.coverage_name == FRONTIER:
+            self._refresh_frontier()
+
+    def _refresh_frontier(self):
+        """
+        Refresh the frontier coverage set, if the aggregate has changed.
+
+        The frontier set holds the uncovered nodes that are directly reached
+        from the loaded coverage (see DatabaseCoverage.frontier).
+        """
+        if not self._frontier_stale:
+            return
+
+        frontier = DatabaseCoverage(self.aggregate.frontier_coverage(), self._palette)
+        frontier.update_metadata(self.metadata)
+        frontier.refresh()
+        self._special_coverage[FRONTIER] = frontier
+
+        #
+        # the edges are collected at the end of a metadata refresh. until
+        # they are, the frontier is empty, and must be built again later
+        #
+
+        self._frontier_stale = self.metadata.snapshot.get_edges() is None
+
+    def _enforce_memory_budget(self):
+        """
+        Spill inactive coverage to disk until we are within the memory budget.
+        """
+
+        # coverage is shared with the composition worker, lock it down
+        await_lock(self._composition_lock)
+
+        # never spill the active coverage
+        self._spiller.enforce(set([self.coverage_name]), self.metadata.snapshot)
+
+        # done operating on shared data (coverage), release the lock
+        self._composition_lock.release()
+
 #------------------------------------------------------------------------------
 # Composition Cache
 #------------------------------------------------------------------------------
@@ -1051,3 +1383,122 @@ class CompositionCache(object):
 
         # insert the new cache entry
         self._cache[key] = value
+
+#------------------------------------------------------------------------------
+# Coverage Spilling
+#------------------------------------------------------------------------------
+#
+#    Every loaded coverage set is fully mapped (nodes, functions, ...) which
+#    can cost a significant amount of memory when hundreds of sets are loaded,
+#    even though only one set is active at a time.
+#
+#    The spiller tracks the loaded coverage in order of use. When the loaded
+#    coverage exceeds the memory budget, the least recently used (inactive)
+#    sets are spilled to disk. A spilled set keeps only its coverage hash,
+#    instruction percent, and coverage bitmap/mask in memory. It is brought
+#    back into memory (rehydrated) when it is next retrieved by the director,
+#    eg, when it is selected, or referenced on its own by a composition.
+#
+#    Spilled sets are not re-mapped when the metadata changes, but their hit
+#    counts are re-expressed against the latest metadata snapshot so that they
+#    do not keep outdated snapshots alive.
+#
+
+DEFAULT_MEMORY_BUDGET = 1024 * 1024 * 1024
+
+class CoverageSpiller(object):
+    """
+    A memory budgeted LRU of loaded coverage, spilling to disk.
+    """
+
+    def __init__(self, budget=DEFAULT_MEMORY_BUDGET):
+        self._budget = budget
+        self._coverage = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        # the directory that spilled coverage is written to, created on use
+        self._directory = None
+        self._spill_count = 0
+
+    def touch(self, coverage_name, coverage):
+        """
+        Mark the given coverage as recently used, rehydrating it if spilled.
+        """
+        with self._lock:
+            self._coverage.pop(coverage_name, None)
+            self._coverage[coverage_name] = coverage
+            coverage.rehydrate()
+
+    def discard(self, coverage_name):
+        """
+        Stop tracking the given coverage, deleting anything it spilled.
+        """
+        with self._lock:
+            coverage = self._coverage.pop(coverage_name, None)
+            if coverage:
+                coverage.discard_spill()
+
+    def enforce(self, pinned, snapshot):
+        """
+        Spill the least recently used coverage until within the memory budget.
+
+        Coverage that is spilled is moved onto the given (current) metadata
+        snapshot, so that it does not hold on to an outdated snapshot.
+        """
+        with self._lock:
+            resident_size = 0
+
+            #
+            # coverage mapped against an outdated metadata snapshot keeps that
+            # snapshot alive, so the snapshots held besides the current one
+            # count towards the budget as well
+            #
+
+            held = collections.Counter()
+            for coverage in self._coverage.itervalues():
+                resident_size += coverage.resident_size
+                if coverage.snapshot is not snapshot:
+                    held[coverage.snapshot] += 1
+
+            resident_size += sum(x.size for x in held)
+
+            for coverage_name, coverage in self._coverage.iteritems():
+                if resident_size <= self._budget:
+                    break
+
+                # the pinned (eg, active) coverage is never spilled
+                if coverage_name in pinned or coverage.spilled:
+                    continue
+
+                logger.debug("Spilling coverage %s" % coverage_name)
+                resident_size -= coverage.resident_size
+                old_snapshot = coverage.snapshot
+                coverage.spill(self._new_spill_path())
+                coverage.rebase_spill(snapshot)
+                resident_size += coverage.resident_size
+
+                # the outdated snapshot may no longer be held by any coverage
+                if old_snapshot in held:
+                    held[old_snapshot] -= 1
+                    if not held[old_snapshot]:
+                        del held[old_snapshot]
+                        resident_size -= old_snapshot.size
+
+    def terminate(self):
+        """
+        Delete all spilled coverage.
+        """
+        with self._lock:
+            self._coverage = collections.OrderedDict()
+            if self._directory:
+                shutil.rmtree(self._directory, ignore_errors=True)
+                self._directory = None
+
+    def _new_spill_path(self):
+        """
+        Return a new file path to spill coverage to.
+        """
+        if not self._directory:
+            self._directory = tempfile.mkdtemp(prefix="lighthouse_")
+        self._spill_count += 1
+        return os.path.join(self._directory, "coverage_%u.bin" % self._spill_count)
@@ -1,14 +1,16 @@
+import copy
 import time
+import array
 import Queue
 import bisect
 import ctypes
 import logging
+import operator
+import itertools
 import threading
 
-import idaapi
-import idautils
-
 from lighthouse.util import *
+from lighthouse.backends import MetadataBackend, IDAMetadataBackend, export_metadata
 
 logger = logging.getLogger("Lighthouse.Metadata")
 
@@ -50,54 +52,474 @@ logger = logging.getLogger("Lighthouse.Metadata")
 #    expense of the ocassional inaccuracies that can be corrected by a
 #    reasonably low cost refresh.
 #
+#    The metadata is collected through a backend (see backends/), which is
+#    IDA by default. As nothing here talks to IDA directly, metadata can
+#    also be loaded from a file exported by IDA and used headless.
+#
 
 #------------------------------------------------------------------------------
-# Database Level Metadata
+# Constants Definitions
 #------------------------------------------------------------------------------
 
-class DatabaseMetadata(object):
+# the node index returned for addresses that do not fall within a known node
+BADNODE = -1
+
+# the instruction ordinal returned for addresses that are not known instructions
+BADINSTRUCTION = -1
+
+#
+# the estimated memory (in bytes) held by each instruction, node, function of
+# a snapshot. this covers the lists & lookups of the snapshot, as the metadata
+# objects themselves are largely shared between snapshots
+#
+
+SNAPSHOT_INSTRUCTION_SIZE = 40
+SNAPSHOT_NODE_SIZE = 150
+SNAPSHOT_FUNCTION_SIZE = 150
+
+#------------------------------------------------------------------------------
+# Metadata Snapshots
+#------------------------------------------------------------------------------
+
+class MetadataSnapshot(object):
     """
-    Fast access database level metadata cache.
+    An immutable, versioned snapshot of the database metadata.
+
+    DatabaseMetadata publishes a new snapshot each time a refresh makes
+    changes to the metadata. A snapshot is never modified once published,
+    so any thread can read from one without locks, or fear of seeing the
+    metadata in a partially updated (torn) state.
     """
 
-    def __init__(self):
+    def __init__(self, version=0, functions=None, nodes=None, instructions=None, lookups=None, edges=None):
 
-        # database defined instructions
-        self.instructions = []
+        # the version of the metadata captured by this snapshot
+        self.version = version
 
-        # database defined nodes (basic blocks)
-        self.nodes = {}
+        # database defined functions, nodes (basic blocks), and instructions
+        self.functions = functions if functions is not None else {}
+        self.nodes = nodes if nodes is not None else {}
+        self.instructions = instructions if instructions is not None else []
 
-        # database defined functions
-        self.functions = {}
+        #
+        # fast lookup lists are simply sorted address lists of functions, nodes
+        # or possibly other (future) metadata.
+        #
+        # we create sorted lists of just these metadata addresses so that we
+        # can use them for fast, fuzzy address lookup (eg, bisect) later on.
+        #
+        #  c.f:
+        #   - get_node(ea)
+        #   - get_function(ea)
+        #
+        # the lookup lists can be handed to us when the caller already has
+        # them on hand (eg, loaded from a metadata file). otherwise, they
+        # are built from the metadata (see _build_lookups)
+        #
 
-        # database metadata cache status
-        self.cached = False
+        if lookups is None:
+            lookups = self._build_lookups()
 
-        # lookup list members
-        self._stale_lookup = False
-        self._name2func = {}
+        self._node_addresses, \
+        self._node_ends, \
+        self._node_instruction_starts, \
+        self._node_instruction_ends, \
+        self._function_addresses, \
+        self._function_ordinals, \
+        self.instruction_count = lookups
+
+        #
+        # the intra-function edges of all functions, packed as parallel arrays
+        # of node indexes (see get_edges). edges are collected in bulk at the
+        # end of a refresh, so the packed edges can only be built once the
+        # edges of every function have been collected (see edges_collected)
+        #
+
+        self._edges = edges
+        self._edges_cursor = 0
+        self._successors = None
+        self._node_indexes = None
+
+        # NOTE: the last node cache is the only member that changes post-publish
         self._last_node = []           # TODO/HACK: blank iterable for now
-        self._node_addresses = []
-        self._function_addresses = []
 
-        # hook to listen for rename events from IDA
-        self._rename_hooks = RenameHooks()
-        self._rename_hooks.renamed = self._name_changed
+    def _build_lookups(self):
+        """
+        Build the lookup lists of this snapshot from its metadata.
 
-        # metadata callbacks (see director for more info)
-        self._function_renamed_callbacks = []
+        Returns a tuple of (node_addresses, node_ends, node_instruction_starts,
+        node_instruction_ends, function_addresses, function_ordinals,
+        instruction_count), as expected by the constructor.
+        """
+        node_addresses = sorted(self.nodes.iterkeys())
+        node_ends = [self.nodes[ea].address + self.nodes[ea].size for ea in node_addresses]
+        function_addresses = sorted(self.functions.iterkeys())
+        function_ordinals = dict(itertools.izip(function_addresses, itertools.count()))
 
-        # asynchrnous metadata collection thread
-        self._refresh_worker = None
-        self._stop_threads = False
+        # the number of instructions in all defined functions
+        instruction_count = sum(f.instruction_count for f in self.functions.itervalues())
 
-    def terminate(self):
+        #
+        # the instructions of each node occupy a contiguous range of ordinals
+        # in the (sorted) instruction list. we record the bounds of each node
+        # range, parallel to the node lookup list
+        #
+
+        node_instruction_starts = []
+        node_instruction_ends = []
+
+        index = 0
+        for node_start, node_end in itertools.izip(node_addresses, node_ends):
+            index = bisect.bisect_left(self.instructions, node_start, index)
+            node_instruction_starts.append(index)
+            node_instruction_ends.append(bisect.bisect_left(self.instructions, node_end, index))
+
+        return (
+            node_addresses,
+            node_ends,
+            node_instruction_starts,
+            node_instruction_ends,
+            function_addresses,
+            function_ordinals,
+            instruction_count
+        )
+
+    #--------------------------------------------------------------------------
+    # Properties
+    #--------------------------------------------------------------------------
+
+    @property
+    def size(self):
         """
-        Cleanup & terminate the metadata object.
+        The estimated memory (in bytes) held by this snapshot.
         """
-        self.abort_refresh(join=True)
-        self._rename_hooks.unhook()
+        return SNAPSHOT_INSTRUCTION_SIZE * len(self.instructions) + \
+            SNAPSHOT_NODE_SIZE * len(self.nodes) + \
+            SNAPSHOT_FUNCTION_SIZE * len(self.functions)
+
+    @property
+    def edges_collected(self):
+        """
+        Return True if the edges of every function in this snapshot are collected.
+        """
+        if self._edges is not None:
+            return True
+
+        #
+        # edges are only ever added to a function, so rather than checking
+        # every function each time we are asked, we resume from the first
+        # function that was not collected the last time we checked
+        #
+
+        functions = self.functions
+        function_addresses = self._function_addresses
+        cursor = self._edges_cursor
+
+        while cursor < len(function_addresses) and functions[function_addresses[cursor]].edges is not None:
+            cursor += 1
+
+        self._edges_cursor = cursor
+        return cursor == len(function_addresses)
+
+    #--------------------------------------------------------------------------
+    # Derivation
+    #--------------------------------------------------------------------------
+
+    def derive(self, version, changes):
+        """
+        Derive a new snapshot from this one, and the given function changes.
+
+        The changes map the address of each changed function to a tuple of
+        its (old, new) function metadata, where old is None if the function
+        was added, and new is None if it was removed.
+
+        Rather than rebuilding the new snapshot from scratch, its instruction
+        and lookup lists are spliced together from the lists of this snapshot.
+        Beyond copying, the cost of a derivation is proportional to the size
+        of the change, not the database.
+        """
+
+        #
+        # renames are by far the most frequent change, and leave the nodes of
+        # the renamed functions as they were (see FunctionMetadata.rename).
+        # the nodes, instructions, and lookups of this snapshot are shared
+        # with the new snapshot, rather than copied
+        #
+
+        if all(old and new and old.nodes is new.nodes for old, new in changes.itervalues()):
+            return self._derive_renames(version, changes)
+
+        functions = dict(self.functions)
+        nodes = dict(self.nodes)
+        instruction_count = self.instruction_count
+
+        # the nodes of the replaced (or removed), and added functions
+        stale_nodes = []
+        fresh_nodes = []
+
+        # the functions that were added or removed from the database
+        added_functions = []
+        removed_functions = []
+
+        #
+        # drop the old versions of the changed functions first, so that a node
+        # moving between two changed functions is not dropped once it has
+        # been added back to the snapshot by its new owner
+        #
+
+        for function_address, (old_metadata, new_metadata) in changes.iteritems():
+            if not old_metadata or old_metadata is new_metadata:
+                continue
+
+            del functions[function_address]
+            instruction_count -= old_metadata.instruction_count
+
+            for node_metadata in old_metadata.nodes.itervalues():
+                if nodes.get(node_metadata.address, None) is node_metadata:
+                    del nodes[node_metadata.address]
+                stale_nodes.append(node_metadata)
+
+            if not new_metadata:
+                removed_functions.append(function_address)
+
+        # now add the new versions of the changed functions
+        for function_address, (old_metadata, new_metadata) in changes.iteritems():
+            if not new_metadata or old_metadata is new_metadata:
+                continue
+
+            functions[function_address] = new_metadata
+            instruction_count += new_metadata.instruction_count
+
+            nodes.update(new_metadata.nodes)
+            fresh_nodes.extend(new_metadata.nodes.itervalues())
+
+            if not old_metadata:
+                added_functions.append(function_address)
+
+        # splice the instruction list, and the node lookup lists
+        instructions = self._derive_instructions(stale_nodes, fresh_nodes)
+        node_lookups = self._derive_node_lookups(nodes, instructions, stale_nodes, fresh_nodes)
+
+        #
+        # function ordinals only shift when functions are added or removed, so
+        # the function lookup lists are shared with this snapshot otherwise
+        #
+
+        if added_functions or removed_functions:
+            function_addresses = _splice_sorted(self._function_addresses, removed_functions, added_functions)
+            function_ordinals = dict(itertools.izip(function_addresses, itertools.count()))
+        else:
+            function_addresses = self._function_addresses
+            function_ordinals = self._function_ordinals
+
+        lookups = node_lookups + (function_addresses, function_ordinals, instruction_count)
+
+        #
+        # if the changes leave the nodes & edges of every function as they
+        # were (eg, a function was renamed), so are the packed edges
+        #
+
+        edges = None
+        if instructions is self.instructions and self._edges is not None and \
+            all(_same_edges(old, new) for old, new in changes.itervalues()):
+            edges = self._edges
+
+        return MetadataSnapshot(version, functions, nodes, instructions, lookups, edges)
+
+    def _derive_renames(self, version, changes):
+        """
+        Derive a new snapshot from this one, and the given function renames.
+
+        Only the function table differs between the two snapshots, all of
+        the node & instruction metadata (and lookups) are shared.
+        """
+        functions = dict(self.functions)
+        for function_address, (_, new_metadata) in changes.iteritems():
+            functions[function_address] = new_metadata
+
+        lookups = (
+            self._node_addresses,
+            self._node_ends,
+            self._node_instruction_starts,
+            self._node_instruction_ends,
+            self._function_addresses,
+            self._function_ordinals,
+            self.instruction_count
+        )
+
+        snapshot = MetadataSnapshot(version, functions, self.nodes, self.instructions, lookups, self._edges)
+
+        # the caches built from the nodes & edges can be shared as well
+        snapshot._node_indexes = self._node_indexes
+        snapshot._successors = self._successors
+
+        return snapshot
+
+    def _derive_instructions(self, stale_nodes, fresh_nodes):
+        """
+        Derive the instruction list of a new snapshot from the given node changes.
+
+        Rather than rebuilding (and re-sorting) the entire instruction list,
+        the new list is built in a single pass, from the runs of instructions
+        kept from this snapshot, and the newly collected instructions.
+        """
+        stale = sorted(set(ea for node in stale_nodes for ea in node.instructions))
+        fresh = sorted(set(ea for node in fresh_nodes for ea in node.instructions))
+
+        #
+        # if the changed nodes hold the same instructions as before (eg, a
+        # function was renamed), the instruction list of this snapshot can
+        # be shared as is. so can the instruction ordinals derived from it
+        #
+
+        if stale == fresh:
+            return self.instructions
+
+        # more code-friendly, readable aliases
+        old_instructions = self.instructions
+        instruction_count = len(old_instructions)
+
+        #
+        # locate the (index) ranges of the instructions to cut out of the list,
+        # those of the modified or deleted nodes. overlapping ranges are merged
+        #
+
+        cuts = []
+        for node_metadata in sorted(stale_nodes, key=operator.attrgetter("address")):
+            index_start = bisect.bisect_left(old_instructions, node_metadata.address)
+            index_end   = bisect.bisect_left(old_instructions, node_metadata.address + node_metadata.size, index_start)
+            if index_start == index_end:
+                continue
+            if cuts and index_start <= cuts[-1][1]:
+                cuts[-1][1] = max(cuts[-1][1], index_end)
+            else:
+                cuts.append([index_start, index_end])
+
+        #
+        # locate where each collected instruction is to be inserted, ie before
+        # the instruction at the given index. an instruction that is already
+        # in the list (and not cut) is shared with an unchanged node
+        #
+
+        inserts = []
+        cut = 0
+        index = 0
+        for address in fresh:
+            index = bisect.bisect_left(old_instructions, address, index)
+            while cut < len(cuts) and cuts[cut][1] <= index:
+                cut += 1
+            if index < instruction_count and old_instructions[index] == address:
+                if not (cut < len(cuts) and cuts[cut][0] <= index):
+                    continue
+            inserts.append((index, address))
+
+        #
+        # now build the new instruction list in one pass, copying over the runs
+        # of kept instructions (by slice) between the cuts and insertions
+        #
+
+        instructions = []
+        position = 0
+        cut = 0
+
+        inserts.append((instruction_count, None))
+        for index, address in inserts:
+
+            # copy the kept instructions up to the insertion point
+            while position < index:
+                if cut < len(cuts) and cuts[cut][0] <= position:
+                    position = max(position, cuts[cut][1])
+                    cut += 1
+                    continue
+                stop = min(index, cuts[cut][0]) if cut < len(cuts) else index
+                instructions.extend(old_instructions[position:stop])
+                position = stop
+
+            if address is not None:
+                instructions.append(address)
+
+        return instructions
+
+    def _derive_node_lookups(self, nodes, instructions, stale_nodes, fresh_nodes):
+        """
+        Derive the node lookup lists of a new snapshot from the given node changes.
+
+        Returns a tuple of the (node_addresses, node_ends,
+        node_instruction_starts, node_instruction_ends) lookup lists.
+        """
+        node_addresses = []
+        node_ends = []
+        node_instruction_starts = []
+        node_instruction_ends = []
+
+        # more code-friendly, readable aliases
+        old_addresses = self._node_addresses
+        old_ends = self._node_ends
+        old_starts = self._node_instruction_starts
+        old_finishes = self._node_instruction_ends
+
+        def copy_unchanged(index_start, index_end):
+            """
+            Copy a range of unchanged nodes from the old lookup lists.
+            """
+            if index_start == index_end:
+                return
+
+            node_addresses.extend(old_addresses[index_start:index_end])
+            node_ends.extend(old_ends[index_start:index_end])
+
+            #
+            # no instructions are added or removed between two changed nodes,
+            # so the instruction ordinals of a range of unchanged nodes all
+            # shift by the same amount (if at all)
+            #
+
+            offset = bisect.bisect_left(instructions, old_addresses[index_start]) - old_starts[index_start]
+            starts = old_starts[index_start:index_end]
+            finishes = old_finishes[index_start:index_end]
+
+            if offset:
+                starts = itertools.imap(operator.add, starts, itertools.repeat(offset))
+                finishes = itertools.imap(operator.add, finishes, itertools.repeat(offset))
+
+            node_instruction_starts.extend(starts)
+            node_instruction_ends.extend(finishes)
+
+        #
+        # walk the addresses of the changed nodes in order, copying over the
+        # unchanged nodes that fall between them from the old lookup lists
+        #
+
+        changed = set(node.address for node in stale_nodes)
+        changed.update(node.address for node in fresh_nodes)
+
+        position = 0
+        for node_address in sorted(changed):
+            index = bisect.bisect_left(old_addresses, node_address, position)
+            copy_unchanged(position, index)
+
+            # skip the old entry for this node, if it had one
+            if index < len(old_addresses) and old_addresses[index] == node_address:
+                index += 1
+            position = index
+
+            # the node was removed, there's nothing to add in its place
+            node_metadata = nodes.get(node_address, None)
+            if not node_metadata:
+                continue
+
+            node_end = node_address + node_metadata.size
+            index_start = bisect.bisect_left(instructions, node_address)
+
+            node_addresses.append(node_address)
+            node_ends.append(node_end)
+            node_instruction_starts.append(index_start)
+            node_instruction_ends.append(bisect.bisect_left(instructions, node_end, index_start))
+
+        # copy over the unchanged nodes beyond the last change
+        copy_unchanged(position, len(old_addresses))
+
+        return (node_addresses, node_ends, node_instruction_starts, node_instruction_ends)
 
     #--------------------------------------------------------------------------
     # Providers
@@ -111,6 +533,46 @@ class DatabaseMetadata(object):
         index_end   = bisect.bisect_left(self.instructions, end_address)
         return self.instructions[index_start:index_end]
 
+    def get_instruction_num(self, address):
+        """
+        Get the ordinal of the instruction at the given address.
+
+        Returns BADINSTRUCTION if the address is not a known instruction.
+        """
+        index = bisect.bisect_left(self.instructions, address)
+        if index < len(self.instructions) and self.instructions[index] == address:
+            return index
+        return BADINSTRUCTION
+
+    def get_instruction_nums(self, addresses):
+        """
+        Get the instruction ordinals for a sorted list of addresses.
+
+        This is the batched form of get_instruction_num(). As the addresses
+        are sorted, each bisection only needs to search the instructions
+        ahead of the previous match.
+
+        Returns a list parallel to the given addresses, holding the ordinal
+        of each instruction, or BADINSTRUCTION if the address is not a known
+        instruction.
+        """
+        output = []
+
+        # more code-friendly, readable aliases
+        instructions = self.instructions
+        instruction_count = len(instructions)
+
+        index = 0
+        for address in addresses:
+            index = bisect.bisect_left(instructions, address, index)
+            if index < instruction_count and instructions[index] == address:
+                output.append(index)
+            else:
+                output.append(BADINSTRUCTION)
+
+        # return the instruction ordinals
+        return output
+
     def get_node(self, address):
         """
         Get the node (basic block) metadata for a given address.
@@ -144,20 +606,6 @@ class DatabaseMetadata(object):
         if address in self._last_node:
             return self._last_node
 
-        #
-        # perform an on-demand / inline refresh of the lookup lists to ensure
-        # that our bisections will be correct.
-        #
-        # NOTE:
-        #
-        #  Internally, the refresh is only performed if the lists are stale.
-        #
-        #  This means that 99.9% of the time, this call will add virtually
-        #  no overhead to the 'get_node' call.
-        #
-
-        self._refresh_lookup()
-
         #
         # use the lookup lists to do a 'fuzzy' lookup, locating the index of
         # the closest known (cached) node address (rounding down)
@@ -169,14 +617,169 @@ class DatabaseMetadata(object):
         # if the identified node contains our target address, it is a match
         #
 
-        node = self.nodes.get(self._node_addresses[node_index], None)
-        if node and address in node:
-            self._last_node = node
-            return node
+        if node_index >= 0 and address < self._node_ends[node_index]:
+            node = self.nodes.get(self._node_addresses[node_index], None)
+            if node:
+                self._last_node = node
+                return node
 
         # node not found...
         return None
 
+    def get_nodes(self, addresses):
+        """
+        Get the node (basic block) indexes for a sorted list of addresses.
+
+        This is the batched form of get_node(). Rather than performing a full
+        bisection for every address, the sorted addresses are walked in a
+        single pass alongside the sorted node lookup list. Consecutive
+        addresses falling within the same node cost a single comparison.
+
+        Returns a list parallel to the given addresses, holding the index of
+        the node containing each address, or BADNODE if the address does not
+        fall within a known node. See get_node_by_index() for more info.
+        """
+        output = []
+
+        # more code-friendly, readable aliases
+        node_starts = self._node_addresses
+        node_ends   = self._node_ends
+
+        # the current node, starting with an empty range that matches nothing
+        node_index = 0
+        node_start = node_end = 0
+
+        for address in addresses:
+
+            # fast path, the address falls within the current node
+            if node_start <= address < node_end:
+                output.append(node_index)
+                continue
+
+            #
+            # locate the closest node at or below this address. as the input
+            # is sorted, we only need to bisect the nodes ahead of us
+            #
+
+            index = bisect.bisect_right(node_starts, address, node_index) - 1
+
+            # the address falls before the first known node
+            if index < 0:
+                output.append(BADNODE)
+                continue
+
+            # make this the current node, and check that it bounds the address
+            node_index = index
+            node_start = node_starts[index]
+            node_end   = node_ends[index]
+
+            if address < node_end:
+                output.append(node_index)
+            else:
+                output.append(BADNODE)
+
+        # return the node indexes
+        return output
+
+    def get_node_by_index(self, node_index):
+        """
+        Get the node metadata for a given node index (as from get_nodes).
+        """
+        return self.nodes[self._node_addresses[node_index]]
+
+    def get_node_instruction_bounds(self):
+        """
+        Get the address and instruction ordinal bounds of every node.
+
+        Returns three lists (addresses, starts, ends), indexed by node index,
+        such that the instructions of a node are instructions[start:end].
+        """
+        return (self._node_addresses, self._node_instruction_starts, self._node_instruction_ends)
+
+    def get_edges(self):
+        """
+        Get the intra-function edges of every function, as packed arrays.
+
+        Returns three items (sources, destinations, bounds). sources and
+        destinations are parallel arrays of the node indexes (as from
+        get_node_instruction_bounds) of each edge. The edges of a function
+        are contiguous, and bounds maps a function address to the (start,
+        end) range of its edges in the arrays.
+
+        Returns None if the edges have not been collected (see edges_collected).
+        """
+        if self._edges is None and self.edges_collected:
+            self._edges = self._build_edges()
+        return self._edges
+
+    def get_node_indexes(self):
+        """
+        Get a mapping of node address --> node index.
+        """
+        if self._node_indexes is None:
+            self._node_indexes = dict(itertools.izip(self._node_addresses, itertools.count()))
+        return self._node_indexes
+
+    def _build_edges(self):
+        """
+        Pack the intra-function edges of every function into arrays.
+        """
+        node_indexes = self.get_node_indexes()
+        sources = array.array("I")
+        destinations = array.array("I")
+        bounds = {}
+
+        for function_address in self._function_addresses:
+            start = len(sources)
+
+            #
+            # an edge leaves the last instruction of its source node, and
+            # enters its destination node at the node's start address
+            #
+
+            for edge_src, edge_dst in self.functions[function_address].edges:
+                sources.append(bisect.bisect_right(self._node_addresses, edge_src) - 1)
+                destinations.append(node_indexes[edge_dst])
+
+            bounds[function_address] = (start, len(sources))
+
+        return (sources, destinations, bounds)
+
+    def get_successors(self):
+        """
+        Get the intra-function successors of every node, in CSR form.
+
+        Returns two arrays (offsets, successors), such that the successors
+        of the node with index i are successors[offsets[i]:offsets[i+1]].
+
+        Returns None if the edges have not been collected (see edges_collected).
+        """
+        if self._successors is None and self.get_edges() is not None:
+            self._successors = self._build_successors()
+        return self._successors
+
+    def _build_successors(self):
+        """
+        Build the compressed sparse row (CSR) adjacency of the packed edges.
+        """
+        sources, destinations, _ = self.get_edges()
+        node_count = len(self._node_addresses)
+
+        # count the edges leaving each node, offset by one
+        offsets = array.array("I", [0]) * (node_count + 1)
+        for source in sources:
+            offsets[source + 1] += 1
+
+        # the running sum of the counts gives where each node's successors begin
+        for i in xrange(node_count):
+            offsets[i + 1] += offsets[i]
+
+        # order the edge destinations by their source node
+        order = sorted(xrange(len(sources)), key=sources.__getitem__)
+        successors = array.array("I", itertools.imap(destinations.__getitem__, order))
+
+        return (offsets, successors)
+
     def get_function(self, address):
         """
         Get the function metadata for a given address.
@@ -192,8 +795,13 @@ class DatabaseMetadata(object):
         if not node_metadata:
             return None
 
-        # return the function metadata corresponding to this node.
-        return node_metadata.function
+        #
+        # return the function metadata corresponding to this node. a renamed
+        # function shares its nodes with the version of the function they
+        # were collected for, so the function is looked up by its address
+        #
+
+        return self.functions[node_metadata.function.address]
 
     def get_closest_function(self, address):
         """
@@ -229,17 +837,7 @@ class DatabaseMetadata(object):
         """
         Get the function number for a given address.
         """
-        return self._function_addresses.index(address)
-
-    def get_function_by_name(self, function_name):
-        """
-        Get the function metadata for a given function name.
-        """
-        try:
-            return self.functions[self._name2func[function_name]]
-        except (IndexError, KeyError):
-            pass
-        return None
+        return self._function_ordinals[address]
 
     def get_function_by_num(self, function_num):
         """
@@ -282,6 +880,247 @@ class DatabaseMetadata(object):
         """
         return len(self.functions) > 50000
 
+#------------------------------------------------------------------------------
+# Database Level Metadata
+#------------------------------------------------------------------------------
+
+class DatabaseMetadata(object):
+    """
+    Fast access database level metadata cache.
+    """
+
+    def __init__(self, backend=None):
+
+        # the backend to collect metadata from, IDA by default
+        if backend is None:
+            backend = IDAMetadataBackend() if IDAMetadataBackend else MetadataBackend()
+        self._backend = backend
+
+        #
+        # the metadata as last published for readers. see MetadataSnapshot
+        # and _publish() for more information.
+        #
+
+        self._snapshot = MetadataSnapshot()
+
+        #
+        # the working function metadata. this is only touched while refreshing
+        # (or renaming), and is published as a new snapshot when changed
+        #
+
+        self._functions = {}
+
+        #
+        # the functions changed since the last publish, mapped to the version
+        # of each function held by the published snapshot (None if added). the
+        # next snapshot is derived from the last, and these changes
+        #
+
+        self._pending_functions = {}
+
+        # database metadata cache status
+        self.cached = False
+
+        #
+        # the function name lookup index, mapping function names to addresses.
+        # the name index is maintained incrementally as functions are
+        # collected, removed, or renamed.
+        #
+
+        self._name2func = {}
+
+        # the function name search index (see FunctionNameIndex)
+        self._name_index = FunctionNameIndex()
+
+        #
+        # the working metadata is staged & published by the refresh worker,
+        # and by the main thread (renames). this lock serializes the two, so
+        # that neither loses the changes staged by the other
+        #
+
+        self._publish_lock = threading.RLock()
+
+        # metadata callbacks (see director for more info)
+        self._function_renamed_callbacks = []
+        self._metadata_refreshed_callbacks = []
+
+        # asynchrnous metadata collection thread
+        self._refresh_worker = None
+        self._stop_threads = False
+
+        # requests to prioritize the collection of specific functions
+        self._priority_lock = threading.Lock()
+        self._priority_requests = []
+
+    def terminate(self):
+        """
+        Cleanup & terminate the metadata object.
+        """
+        self.abort_refresh(join=True)
+        self._backend.unhook_renames()
+
+    #--------------------------------------------------------------------------
+    # Properties
+    #--------------------------------------------------------------------------
+
+    @property
+    def snapshot(self):
+        """
+        The current (published) metadata snapshot.
+
+        Readers that make several related queries (eg, get_nodes() followed
+        by get_node_by_index()) should hold on to a single snapshot, so that
+        their queries are served by the same version of the metadata.
+        """
+        return self._snapshot
+
+    @property
+    def version(self):
+        """
+        The version of the current metadata snapshot.
+        """
+        return self._snapshot.version
+
+    @property
+    def functions(self):
+        """
+        The database defined functions in the current snapshot.
+        """
+        return self._snapshot.functions
+
+    @property
+    def nodes(self):
+        """
+        The database defined nodes (basic blocks) in the current snapshot.
+        """
+        return self._snapshot.nodes
+
+    @property
+    def instructions(self):
+        """
+        The database defined instructions in the current snapshot.
+        """
+        return self._snapshot.instructions
+
+    @property
+    def refreshing(self):
+        """
+        Return True if a metadata refresh is currently running.
+        """
+        worker = self._refresh_worker
+        return bool(worker and worker.is_alive())
+
+    #--------------------------------------------------------------------------
+    # Providers
+    #--------------------------------------------------------------------------
+    #
+    #    These are served by the current metadata snapshot. See the
+    #    MetadataSnapshot providers for more information.
+    #
+
+    def get_instructions_slice(self, start_address, end_address):
+        """
+        Get the instructions in the given range of addresses.
+        """
+        return self._snapshot.get_instructions_slice(start_address, end_address)
+
+    def get_node(self, address):
+        """
+        Get the node (basic block) metadata for a given address.
+        """
+        return self._snapshot.get_node(address)
+
+    def get_nodes(self, addresses):
+        """
+        Get the node (basic block) indexes for a sorted list of addresses.
+        """
+        return self._snapshot.get_nodes(addresses)
+
+    def get_node_by_index(self, node_index):
+        """
+        Get the node metadata for a given node index (as from get_nodes).
+        """
+        return self._snapshot.get_node_by_index(node_index)
+
+    def get_function(self, address):
+        """
+        Get the function metadata for a given address.
+        """
+        return self._snapshot.get_function(address)
+
+    def get_closest_function(self, address):
+        """
+        Get the function metadata for the function closest to the give address.
+        """
+        return self._snapshot.get_closest_function(address)
+
+    def get_function_num(self, address):
+        """
+        Get the function number for a given address.
+        """
+        return self._snapshot.get_function_num(address)
+
+    def get_function_by_num(self, function_num):
+        """
+        Get the function metadata for a given function number.
+        """
+        return self._snapshot.get_function_by_num(function_num)
+
+    def flatten_blocks(self, basic_blocks):
+        """
+        Flatten a list of basic blocks (address, size) to instruction addresses.
+        """
+        return self._snapshot.flatten_blocks(basic_blocks)
+
+    def is_big(self):
+        """
+        Return an size classification of the database / metadata.
+        """
+        return self._snapshot.is_big()
+
+    def get_function_by_name(self, function_name):
+        """
+        Get the function metadata for a given function name.
+        """
+        function_address = self._name2func.get(function_name, None)
+        return self._snapshot.functions.get(function_address, None)
+
+    def search_functions(self, substring, case_sensitive=False):
+        """
+        Get the addresses of the functions whose names contain the substring.
+
+        NOTE: the name index may run slightly ahead of the current snapshot
+        while metadata is being refreshed.
+        """
+        return self._name_index.search(substring, case_sensitive)
+
+    #--------------------------------------------------------------------------
+    # Export
+    #--------------------------------------------------------------------------
+
+    def export(self, filepath):
+        """
+        Export the collected metadata to a (columnar) metadata file.
+
+        An exported metadata file can be loaded with a FileMetadataBackend,
+        allowing the metadata to be used headless (eg, outside of IDA).
+        """
+        snapshot = self._snapshot
+
+        #
+        # function edges are collected in the background at the end of a
+        # refresh, so some functions may not have them on hand yet (eg, if
+        # the refresh was aborted). those are fetched for the export in bulk
+        #
+
+        uncollected = [f for f in snapshot.functions.itervalues() if f.edges is None]
+        edges = self._backend.execute_read(collect_function_edges, uncollected, self._backend)
+        for function_metadata in snapshot.functions.itervalues():
+            if function_metadata.edges is not None:
+                edges[function_metadata.address] = function_metadata.edges
+
+        export_metadata(snapshot, filepath, edges)
+
     #--------------------------------------------------------------------------
     # Refresh
     #--------------------------------------------------------------------------
@@ -293,37 +1132,44 @@ class DatabaseMetadata(object):
         assert self._refresh_worker == None, 'Refresh already running'
         result_queue = Queue.Queue()
 
+        #
+        # backends that hold the whole database in bulk (eg, a metadata file)
+        # serve it as columns, which the complete refresh is built from in a
+        # single pass (see _load_columns)
+        #
+
+        columns = None
+        if function_addresses is None:
+            columns = self._backend.get_columns()
+
         #
         # if no (function) addresses were specified by the caller, we proceed
         # with a complete metadata refresh.
         #
 
-        if function_addresses is None:
+        if function_addresses is None and columns is None:
 
             # retrieve a full function address list from the underlying database
-            function_addresses = list(idautils.Functions())
+            function_addresses = self._backend.get_function_addresses()
 
             #
             # immediately drop function entries that are no longer present in the
             # function address list we just pulled from the database
             #
 
-            removed_functions = self.functions.viewkeys() - set(function_addresses)
+            removed_functions = self._functions.viewkeys() - set(function_addresses)
             for function_address in removed_functions:
 
                 # the function to delete
-                function_metadata = self.functions[function_address]
-
-                # delete all node metadata owned by this function from the db list
-                for node in function_metadata.nodes.itervalues():
-                    del self.nodes[node.address]
+                function_metadata = self._functions[function_address]
 
-                # now delete the function metadata from the db list
-                del self.functions[function_address]
+                #
+                # delete the function metadata from the working metadata. the
+                # deletion will be published with the refreshed metadata
+                #
 
-            # schedule a deferred lookup list refresh if we deleted any functions
-            if removed_functions:
-                self._stale_lookup = True
+                self._stage_function(function_address, None)
+                self._unindex_function_name(function_metadata)
 
         #
         # reset the async abort/stop flag that can be used used to cancel the
@@ -338,7 +1184,7 @@ class DatabaseMetadata(object):
 
         self._refresh_worker = threading.Thread(
             target=self._async_refresh,
-            args=(result_queue, function_addresses, progress_callback,)
+            args=(result_queue, function_addresses, columns, progress_callback,)
         )
         self._refresh_worker.start()
 
@@ -387,25 +1233,66 @@ class DatabaseMetadata(object):
         if join:
             worker.join()
 
-    def _async_refresh(self, result_queue, function_addresses, progress_callback):
+    def prioritize(self, addresses=None):
+        """
+        Prioritize metadata collection of the functions containing addresses.
+
+        This is used to collect the functions touched by some coverage data
+        ahead of the rest of the database, so that the coverage can be
+        (partially) mapped and painted while the remaining metadata is
+        collected in the background.
+
+        Returns a future (Queue) that will carry True once the metadata for
+        every prioritized function has been collected, or False if the
+        refresh was aborted. If no addresses are given, the future will
+        simply complete with the running refresh.
+        """
+        future = Queue.Queue()
+
+        # resolve the given addresses to the functions that contain them
+        if addresses is None:
+            function_addresses = None
+        else:
+            function_addresses = self._backend.get_function_owners(addresses)
+
+        #
+        # queue the request for the refresh worker to pick up between chunks.
+        # if there is no refresh running, there is nothing to wait on
+        #
+
+        with self._priority_lock:
+            if self.refreshing:
+                self._priority_requests.append((function_addresses, future))
+            else:
+                future.put(True)
+
+        # return the channel that will carry the prioritized result
+        return future
+
+    def _async_refresh(self, result_queue, function_addresses, columns, progress_callback):
         """
         Internal asynchronous metadata collection worker.
         """
 
         # pause our rename listening hooks, for speed
-        self._rename_hooks.unhook()
+        self._backend.unhook_renames()
+
+        # load the metadata straight from the columns served by the backend
+        if columns is not None:
+            completed = self._load_columns(columns)
 
         # collect metadata
-        completed = self._async_collect_metadata(
-            function_addresses,
-            progress_callback
-        )
+        else:
+            completed = self._async_collect_metadata(
+                function_addresses,
+                progress_callback
+            )
 
-        # refresh the lookup lists
-        self._refresh_lookup()
+        # publish the refreshed metadata for readers
+        self._publish()
 
         # resume our rename listening hooks
-        self._rename_hooks.hook()
+        self._backend.hook_renames(self._name_changed)
 
         # send the refresh result (good/bad) incase anyone is still listening
         if completed:
@@ -414,87 +1301,394 @@ class DatabaseMetadata(object):
         else:
             result_queue.put(False)
 
-        # clean up our thread's reference as it is basically done/dead
-        self._refresh_worker = None
+        # complete any outstanding priority requests
+
+        with self._priority_lock:
+            for _, future in self._priority_requests:
+                future.put(completed)
+            self._priority_requests = []
+
+        # notify any listeners that a refresh has run to completion
+        if completed:
+            self._notify_metadata_refreshed()
+
+        #
+        # with the refreshed metadata in the hands of its users, collect the
+        # function edges in the background. the edges loaded from columns
+        # are already on hand
+        #
+
+        if completed and columns is None:
+            self._async_collect_edges()
+
+        #
+        # complete any priority requests that came in while the edges were
+        # being collected, and clean up our thread's reference as it is
+        # basically done/dead
+        #
+
+        with self._priority_lock:
+            for _, future in self._priority_requests:
+                future.put(completed)
+            self._priority_requests = []
+            self._refresh_worker = None
 
         # thread exit...
         return
 
-    def _refresh_lookup(self):
+    def _publish(self):
+        """
+        Publish the working metadata as a new metadata snapshot.
+
+        This will only publish a snapshot if the working metadata has changed.
+        """
+
+        with self._publish_lock:
+
+            # if the published snapshot is fresh, there's nothing to do
+            if not self._pending_functions:
+                return False
+
+            # pair the published version of each changed function with its latest
+            changes = {}
+            for function_address, old_metadata in self._pending_functions.iteritems():
+                changes[function_address] = (old_metadata, self._functions.get(function_address, None))
+            self._pending_functions = {}
+
+            #
+            # the snapshot is derived off to the side from the last snapshot
+            # and the changes made since, so that the refresh can continue to
+            # make changes to the working metadata after it is published.
+            #
+            # the snapshot is then swapped in with a single (atomic) assignment,
+            # so readers will always see either the old or new version in full.
+            #
+
+            self._snapshot = self._snapshot.derive(self._snapshot.version + 1, changes)
+
+        # publish success
+        return True
+
+    #--------------------------------------------------------------------------
+    # Metadata Collection
+    #--------------------------------------------------------------------------
+
+    def _async_collect_metadata(self, function_addresses, progress_callback):
+        """
+        Asynchronously collect metadata from the underlying database.
+        """
+        CHUNK_SIZE = 150
+        collected = set()
+        remaining = iter(function_addresses)
+
+        # the functions this refresh is expected to collect
+        known_functions = set(function_addresses)
+
+        # loop through every defined function (address) in the database
+        while True:
+
+            #
+            # functions requested through prioritize() are collected ahead of
+            # the rest of the database. otherwise, we simply walk through the
+            # function addresses in the order given to us.
+            #
+
+            addresses_chunk = self._next_priority_chunk(
+                known_functions,
+                collected,
+                CHUNK_SIZE
+            )
+
+            while len(addresses_chunk) < CHUNK_SIZE:
+                address = next(remaining, None)
+                if address is None:
+                    break
+                if address in collected:
+                    continue
+                addresses_chunk.append(address)
+
+            # nothing left to collect, we're done
+            if not addresses_chunk:
+                break
+
+            # synchronize and read (collect) function metadata from the
+            # database in controlled chunks (faster in chunks than one by one)
+            fresh_metadata = self._backend.execute_read(
+                collect_function_metadata,
+                addresses_chunk,
+                self._backend
+            )
+
+            # update the database metadata with the collected metadata
+            delta = self._update_functions(fresh_metadata)
+            collected.update(addresses_chunk)
+
+            # TODO: delta callback
+
+            #
+            # if this chunk satisfied any priority requests, make the partial
+            # metadata usable for mapping and let the requesters know. once
+            # the prioritized functions are ready, the remaining collection
+            # continues quietly in the background.
+            #
+
+            if self._complete_priority_requests(collected):
+                progress_callback = None
+
+            # report progress to an external subscriber
+            if progress_callback:
+                progress_callback(len(collected), len(function_addresses))
+
+            # if an abort was requested, bail (leaving usable metadata behind)
+            if self._stop_threads:
+                return False
+
+            # sleep some so we don't choke the main IDA thread
+            time.sleep(.0015)
+
+        # completed normally
+        return True
+
+    def _async_collect_edges(self):
+        """
+        Asynchronously collect the edges of the working functions in bulk.
+
+        Once the edges of every function are collected, they are packed
+        for the published snapshot (see MetadataSnapshot.get_edges).
+        """
+        CHUNK_SIZE = 150
+
+        while True:
+
+            #
+            # the functions without edges. functions may be replaced while
+            # we collect (eg, renamed) so we loop until all are collected
+            #
+
+            uncollected = sorted(
+                address for address, function_metadata in self._functions.items()
+                if function_metadata.edges is None
+            )
+
+            if not uncollected:
+                break
+
+            for i in xrange(0, len(uncollected), CHUNK_SIZE):
+                functions = [
+                    function_metadata for function_metadata in
+                    itertools.imap(self._functions.get, uncollected[i:i+CHUNK_SIZE])
+                    if function_metadata is not None
+                ]
+
+                # synchronize and read (collect) the edges from the database
+                edges = self._backend.execute_read(
+                    collect_function_edges,
+                    functions,
+                    self._backend
+                )
+
+                for function_metadata in functions:
+                    function_metadata._edges = edges[function_metadata.address]
+
+                # if an abort was requested, bail (leaving usable metadata behind)
+                if self._stop_threads:
+                    return False
+
+                # sleep some so we don't choke the main IDA thread
+                time.sleep(.0015)
+
+        # pack the collected edges of the published snapshot for its readers
+        self._snapshot.get_edges()
+
+        logger.debug("Collected edges for %u functions" % len(self._functions))
+        return True
+
+    def _load_columns(self, columns):
         """
-        Refresh the fast lookup address lists.
+        Load the complete database metadata from the given MetadataColumns.
 
-        This will only refresh the lists if they are believed to be stale.
+        The columns describe the whole database, so the metadata is built
+        from them directly, rather than being collected and merged into the
+        working metadata function by function.
         """
+        instructions = columns.instructions
+
+        # bucket the nodes by their owning function, building each along the way
+        function_nodes = [[] for _ in columns.function_addresses]
+        node_instruction_starts = []
+        node_instruction_ends = []
+        nodes = {}
+
+        for node_start, node_end, node_id, owner in itertools.izip(
+            columns.node_starts,
+            columns.node_ends,
+            columns.node_ids,
+            columns.node_owners
+        ):
+
+            #
+            # the nodes share the database instruction list, so the bounds
+            # of their instructions are also their snapshot instruction bounds
+            #
+
+            node_metadata = NodeMetadata(node_start, node_end, node_id, instructions)
+            node_instruction_starts.append(node_metadata._index_start)
+            node_instruction_ends.append(node_metadata._index_end)
+
+            function_nodes[owner].append(node_metadata)
+            nodes[node_start] = node_metadata
 
         #
-        # fast lookup lists are simply sorted address lists of functions, nodes
-        # or possibly other (future) metadata.
+        # a node shared by several functions is stored under one of them. the
+        # other functions sharing it get node metadata of their own, as when
+        # the metadata is collected function by function
         #
-        # we create sorted lists of just these metadata addresses so that we
-        # can use them for fast, fuzzy address lookup (eg, bisect) later on.
+
+        for index, owner, node_id in itertools.izip(
+            columns.shared_nodes,
+            columns.shared_owners,
+            columns.shared_ids
+        ):
+            function_nodes[owner].append(
+                NodeMetadata(columns.node_starts[index], columns.node_ends[index], node_id, instructions)
+            )
+
         #
-        #  c.f:
-        #   - get_node(ea)
-        #   - get_function(ea)
+        # bucket the edges by the function they belong to. as nodes are sorted
+        # by address, the node index of an edge is found by bisection
         #
 
-        # if the lookup lists are fresh, there's nothing to do
-        if not self._stale_lookup:
-            return False
+        node_starts = list(columns.node_starts)
+        node_indexes = dict(itertools.izip(node_starts, itertools.count()))
+        function_edges = [[] for _ in columns.function_addresses]
+
+        for edge_src, edge_dst, owner in itertools.izip(
+            columns.edge_sources,
+            columns.edge_destinations,
+            columns.edge_owners
+        ):
+            source = bisect.bisect_right(node_starts, edge_src) - 1
+            function_edges[owner].append((edge_src, edge_dst, source, node_indexes[edge_dst]))
+
+        # build the functions from their nodes & edges
+        functions = {}
+        sources = array.array("I")
+        destinations = array.array("I")
+        bounds = {}
+
+        for address, name, owned_nodes, owned_edges in itertools.izip(
+            columns.function_addresses,
+            columns.function_names,
+            function_nodes,
+            function_edges
+        ):
+            function_metadata = FunctionMetadata(address, self._backend, name, owned_nodes)
+            function_metadata._edges = [edge[:2] for edge in owned_edges]
+            functions[address] = function_metadata
+
+            # pack the edges of the function for the snapshot (see get_edges)
+            start = len(sources)
+            sources.extend(edge[2] for edge in owned_edges)
+            destinations.extend(edge[3] for edge in owned_edges)
+            bounds[address] = (start, len(sources))
+
+        # the lookup lists are taken straight from the (sorted) columns
+        function_addresses = list(columns.function_addresses)
+        lookups = (
+            node_starts,
+            list(columns.node_ends),
+            node_instruction_starts,
+            node_instruction_ends,
+            function_addresses,
+            dict(itertools.izip(function_addresses, itertools.count())),
+            sum(f.instruction_count for f in functions.itervalues())
+        )
 
-        # update the lookup lists
-        self._last_node = []
-        self._name2func = { f.name: f.address for f in self.functions.itervalues() }
-        self._node_addresses = sorted(self.nodes.keys())
-        self._function_addresses = sorted(self.functions.keys())
+        with self._publish_lock:
 
-        # lookup lists are no longer stale, reset the stale flag as such
-        self._stale_lookup = False
+            # the loaded metadata replaces the working metadata in full
+            for function_metadata in self._functions.itervalues():
+                self._unindex_function_name(function_metadata)
+            for function_metadata in functions.itervalues():
+                self._index_function_name(function_metadata)
 
-        # refresh success
-        return True
+            self._functions = functions
+            self._pending_functions = {}
 
-    #--------------------------------------------------------------------------
-    # Metadata Collection
-    #--------------------------------------------------------------------------
+            # publish the loaded metadata as a new snapshot
+            self._snapshot = MetadataSnapshot(
+                self._snapshot.version + 1,
+                dict(functions),
+                dict(nodes),
+                instructions,
+                lookups,
+                (sources, destinations, bounds)
+            )
 
-    def _async_collect_metadata(self, function_addresses, progress_callback):
+        logger.debug("Loaded metadata for %u functions" % len(functions))
+        return True
+
+    def _next_priority_chunk(self, known_functions, collected, chunk_size):
         """
-        Asynchronously collect metadata from the underlying database.
+        Select the next chunk of prioritized function addresses to collect.
         """
-        CHUNK_SIZE = 150
-        completed = 0
+        addresses_chunk = []
 
-        # loop through every defined function (address) in the database
-        for addresses_chunk in chunks(function_addresses, CHUNK_SIZE):
+        with self._priority_lock:
+            for function_addresses, _ in self._priority_requests:
 
-            # synchronize and read (collect) function metadata from the
-            # database in controlled chunks (faster in chunks than one by one)
-            fresh_metadata = collect_function_metadata(addresses_chunk)
+                # a request for the complete refresh, nothing to prioritize
+                if function_addresses is None:
+                    continue
 
-            # update the database metadata with the collected metadata
-            delta = self._update_functions(fresh_metadata)
+                # drop functions that are collected, or outside this refresh
+                function_addresses &= known_functions
+                function_addresses -= collected
 
-            # TODO: delta callback
+                # take what we can from this request
+                for address in sorted(function_addresses):
+                    if len(addresses_chunk) == chunk_size:
+                        return addresses_chunk
+                    if not address in addresses_chunk:
+                        addresses_chunk.append(address)
 
-            # report progress to an external subscriber
-            if progress_callback:
-                completed += len(addresses_chunk)
-                progress_callback(completed, len(function_addresses))
+        return addresses_chunk
 
-            # if an abort was requested, bail immediately
-            if self._stop_threads:
+    def _complete_priority_requests(self, collected):
+        """
+        Complete priority requests whose functions have all been collected.
+
+        Returns True if any requests were completed.
+        """
+        with self._priority_lock:
+
+            # split the requests into those that are satisfied, and not
+            completed, pending = [], []
+            for request in self._priority_requests:
+                function_addresses, future = request
+                if function_addresses is None or function_addresses - collected:
+                    pending.append(request)
+                else:
+                    completed.append(future)
+
+            # nothing was satisfied by the last chunk, nothing to do
+            if not completed:
                 return False
 
-            # sleep some so we don't choke the main IDA thread
-            time.sleep(.0015)
+            self._priority_requests = pending
 
-        # dedupe and sort the instructions
-        self.instructions = list(set(self.instructions))
-        self.instructions.sort()
+        #
+        # the working metadata is only published periodically, so we must do
+        # so now such that the partial metadata is usable for flattening and
+        # mapping by the requesters
+        #
+
+        self._publish()
+
+        # the prioritized metadata is ready, notify the requesters
+        for future in completed:
+            future.put(True)
 
-        # completed normally
         return True
 
     def _update_functions(self, fresh_metadata):
@@ -514,7 +1708,7 @@ class DatabaseMetadata(object):
         for function_address, new_metadata in fresh_metadata.iteritems():
 
             # extract the 'old' metadata from the database metadata
-            old_metadata = self.functions.get(function_address, None)
+            old_metadata = self._functions.get(function_address, None)
 
             #
             # if the fresh metadata for this function is identical to the
@@ -534,60 +1728,74 @@ class DatabaseMetadata(object):
             delta[function_address] = new_metadata
 
         #
-        # save the current node & function count before we merge in the delta
-        # updates. this will enable us to very quickly tell if anything has
-        # been added (versus updated)
+        # now we can update the working metadata with only the new data that
+        # we know to have changed (the delta). the nodes and instructions of
+        # the replaced functions are swapped out when the working metadata is
+        # next published as a snapshot (see MetadataSnapshot.derive)
         #
 
-        node_count     = len(self.nodes)
-        function_count = len(self.functions)
+        with self._publish_lock:
+            for function_address, function_metadata in delta.iteritems():
+                old_metadata = self._functions.get(function_address, None)
+                if old_metadata:
+                    self._unindex_function_name(old_metadata)
 
-        #
-        # now we can update the database-wide metadata maps with only the new
-        # data that we know to have changed (the delta)
-        #
+                self._stage_function(function_address, function_metadata)
+                self._index_function_name(function_metadata)
 
-        # update the functions metadata map
-        self.functions.update(delta)
+        # return the delta for other interested consumers to use
+        return delta
 
-        # update the node & instruction metadata maps
-        for function_metadata in delta.itervalues():
-            self.nodes.update(function_metadata.nodes)
-            for node_metadata in function_metadata.nodes.itervalues():
-                self.instructions.extend(node_metadata.instructions)
+    def _stage_function(self, function_address, function_metadata):
+        """
+        Stage a change to a function in the working metadata, for publishing.
 
-        #
-        # if the function or node count has changed, we will know that
-        # something must have been added, therefore our lookup lists will
-        # need to be rebuilt/sorted. schedule a deferred refresh
-        #
+        A function_metadata of None removes the function.
+        """
 
-        if (node_count != len(self.nodes)) or (function_count != len(self.functions)):
-            self._stale_lookup = True
+        # remember the published version of the function, the first time it changes
+        if not function_address in self._pending_functions:
+            self._pending_functions[function_address] = self._functions.get(function_address, None)
 
-        # return the delta for other interested consumers to use
-        return delta
+        if function_metadata:
+            self._functions[function_address] = function_metadata
+        else:
+            self._functions.pop(function_address, None)
+
+    def _index_function_name(self, function_metadata):
+        """
+        Add the given function's name to the function name indexes.
+        """
+        self._name2func[function_metadata.name] = function_metadata.address
+        self._name_index.add(function_metadata.address, function_metadata.name)
+
+    def _unindex_function_name(self, function_metadata):
+        """
+        Remove the given function's name from the function name indexes.
+        """
+        if self._name2func.get(function_metadata.name, None) == function_metadata.address:
+            del self._name2func[function_metadata.name]
+        self._name_index.remove(function_metadata.address)
 
     #--------------------------------------------------------------------------
     # Signal Handlers
     #--------------------------------------------------------------------------
 
-    @mainthread
     def _name_changed(self, address, new_name, local_name):
         """
-        Handler for rename event in IDA.
+        Handler for rename event in the database.
         """
 
         # we should never care about local renames (eg, loc_40804b), ignore
         if local_name or new_name.startswith("loc_"):
-            return 0
+            return
 
         # get the function that this address falls within
         function = self.get_function(address)
 
         # if the address does not fall within a function (might happen?), ignore
         if not function:
-            return 0
+            return
 
         #
         # ensure the renamed address matches the function start before
@@ -600,15 +1808,32 @@ class DatabaseMetadata(object):
         if address == function.address:
             logger.debug("Name changing @ 0x%X" % address)
             logger.debug("  Old name: %s" % function.name)
-            function.name = idaapi.get_short_name(address)
-            logger.debug("  New name: %s" % function.name)
+
+            #
+            # the function metadata is shared by published snapshots, which
+            # must never change. rename a copy of the function, and publish it
+            # as a new snapshot instead.
+            #
+            # the working version of the function is renamed, as it may be
+            # newer than the published one (eg, mid-refresh)
+            #
+
+            new_name = self._backend.get_function_name(address)
+
+            with self._publish_lock:
+                function = self._functions.get(address, function)
+                renamed = function.rename(new_name)
+
+                self._unindex_function_name(function)
+                self._stage_function(address, renamed)
+                self._index_function_name(renamed)
+                self._publish()
+
+            logger.debug("  New name: %s" % renamed.name)
 
         # notify any listeners that a function rename occurred
         self._notify_function_renamed()
 
-        # necessary for IDP/IDB_Hooks
-        return 0
-
     #--------------------------------------------------------------------------
     # Callbacks
     #--------------------------------------------------------------------------
@@ -625,6 +1850,18 @@ class DatabaseMetadata(object):
         """
         notify_callback(self._function_renamed_callbacks)
 
+    def metadata_refreshed(self, callback):
+        """
+        Subscribe a callback for completed metadata refresh events.
+        """
+        register_callback(self._metadata_refreshed_callbacks, callback)
+
+    def _notify_metadata_refreshed(self):
+        """
+        Notify listeners of a completed metadata refresh event.
+        """
+        notify_callback(self._metadata_refreshed_callbacks)
+
 #------------------------------------------------------------------------------
 # Function Level Metadata
 #------------------------------------------------------------------------------
@@ -634,7 +1871,10 @@ class FunctionMetadata(object):
     Fast access function level metadata cache.
     """
 
-    def __init__(self, address):
+    def __init__(self, address, backend, name=None, nodes=None):
+
+        # the backend to collect metadata from
+        self._backend = backend
 
         # function metadata
         self.address = address
@@ -642,17 +1882,25 @@ class FunctionMetadata(object):
 
         # node metadata
         self.nodes = {}
-        self.edges = []
+
+        # edge metadata, collected in bulk (see the edges property)
+        self._edges = None
 
         # fixed/baked/computed metrics
         self.size = 0
         self.node_count = 0
-        self.edge_count = 0
         self.instruction_count = 0
-        self.cyclomatic_complexity = 0
+
+        # structural fingerprint of the function (see _finalize)
+        self.fingerprint = 0
 
         # collect metdata from the underlying database
-        self._build_metadata()
+        if nodes is None:
+            self._build_metadata()
+
+        # or adopt the given node metadata (eg, as loaded from a metadata file)
+        else:
+            self._adopt_metadata(name, nodes)
 
     #--------------------------------------------------------------------------
     # Properties
@@ -665,6 +1913,37 @@ class FunctionMetadata(object):
         """
         return set([ea for node in self.nodes.itervalues() for ea in node.instructions])
 
+    @property
+    def edges(self):
+        """
+        The intra-function edges (src, dst) in this function.
+
+        Edge collection is relatively expensive, and is only needed by a few
+        consumers (eg, cyclomatic complexity). Rather than collecting them
+        with the rest of the function, the edges of every function are
+        collected in bulk at the end of a metadata refresh (see
+        collect_function_edges). They are None until then.
+        """
+        return self._edges
+
+    @property
+    def edge_count(self):
+        """
+        The number of intra-function edges in this function (or None).
+        """
+        if self._edges is None:
+            return None
+        return len(self._edges)
+
+    @property
+    def cyclomatic_complexity(self):
+        """
+        The cyclomatic complexity of this function (or None).
+        """
+        if self._edges is None:
+            return None
+        return len(self._edges) - self.node_count + 2
+
     #--------------------------------------------------------------------------
     # Metadata Population
     #--------------------------------------------------------------------------
@@ -677,11 +1956,34 @@ class FunctionMetadata(object):
         self._refresh_nodes()
         self._finalize()
 
+    def rename(self, name):
+        """
+        Return a renamed copy of this function metadata.
+
+        The copy shares its nodes (and edges) with this function, as they are
+        unchanged by a rename. The shared nodes still refer to this function
+        as their parent, which is why MetadataSnapshot.get_function() looks
+        functions up by address.
+        """
+        function_metadata = copy.copy(self)
+        function_metadata.name = name
+        return function_metadata
+
+    def _adopt_metadata(self, name, nodes):
+        """
+        Populate the function metadata from the given name and node metadata.
+        """
+        self.name = name
+        for node_metadata in nodes:
+            node_metadata.function = self
+            self.nodes[node_metadata.address] = node_metadata
+        self._finalize()
+
     def _refresh_name(self):
         """
         Refresh the function name against the open database.
         """
-        self.name = idaapi.get_short_name(self.address)
+        self.name = self._backend.get_function_name(self.address)
 
     def _refresh_nodes(self):
         """
@@ -692,55 +1994,24 @@ class FunctionMetadata(object):
         # dispose of stale information
         function_metadata.nodes = {}
 
-        # get function & flowchart object from database
-        function  = idaapi.get_func(self.address)
-        flowchart = idaapi.qflow_chart_t("", function, idaapi.BADADDR, idaapi.BADADDR, 0)
-
         #
-        # now we will walk the flowchart for this function, collecting
-        # information on each of its nodes (basic blocks) and populating
-        # the function & node metadata objects.
+        # enumerate the instructions of the whole function in bulk. this
+        # (sorted) sequence is shared by the nodes of the function, which
+        # only slice their instructions out of it when they are requested
         #
 
-        for node_id in xrange(flowchart.size()):
-            node = flowchart[node_id]
-
-            # NOTE/COMPAT:
-            if using_ida7api:
-                node_start = node.start_ea
-                node_end   = node.end_ea
-            else:
-                node_start = node.startEA
-                node_end   = node.endEA
-
-            #
-            # the node size as this flowchart sees it is 'zero'. This means
-            # that another flowchart / function owns this node so we can just
-            # ignore it.
-            #
-
-            if node_start == node_end:
-                continue
+        instructions = tuple(self._backend.get_function_instructions(self.address))
 
-            #
-            # if the current node_start address does not fall within the
-            # original / entry 'function chunk', we want to ignore it.
-            #
-            # this check is used as an attempt to ignore the try/catch/SEH
-            # exception handling blocks that IDA 7 parses and displays in
-            # the graph view (and therefore, the flowcahrt).
-            #
-            # practically speaking, 99% of the time people aren't going to be
-            # interested in the coverage information on their exception
-            # handlers. I am skeptical that dynamic instrumentation tools
-            # would be able to collect coverage in these handlers anway...
-            #
+        #
+        # now we will walk the nodes of this function as reported by the
+        # backend, collecting information on each of its nodes (basic blocks)
+        # and populating the function & node metadata objects.
+        #
 
-            if idaapi.get_func_chunknum(function, node_start):
-                continue
+        for node_start, node_end, node_id in self._backend.get_function_nodes(self.address):
 
             # create a new metadata object for this node
-            node_metadata = NodeMetadata(node_start, node_end, node_id)
+            node_metadata = NodeMetadata(node_start, node_end, node_id, instructions)
 
             #
             # establish a relationship between this node (basic block) and
@@ -750,50 +2021,71 @@ class FunctionMetadata(object):
             node_metadata.function = function_metadata
             function_metadata.nodes[node_start] = node_metadata
 
-            #
-            # enumerate the edges produced by this node with a destination
-            # that falls within this function.
-            #
-
-            edge_src = node_metadata.instructions[-1]
-
-            # NOTE/COMPAT: we do a single api check *outside* the loop for perf
-            if using_ida7api:
-                for edge_dst in idautils.CodeRefsFrom(edge_src, True):
-                    edge_function = idaapi.get_func(edge_dst)
-                    if edge_function and edge_function.start_ea == function.start_ea: # NOTE: start_ea vs startEA
-                        function_metadata.edges.append((edge_src, edge_dst))
-            else:
-                for edge_dst in idautils.CodeRefsFrom(edge_src, True):
-                    edge_function = idaapi.get_func(edge_dst)
-                    if edge_function and edge_function.startEA == function.startEA:   # NOTE: startEA vs start_ea
-                        function_metadata.edges.append((edge_src, edge_dst))
-
     def _finalize(self):
         """
         Finalize function metadata for use.
         """
         self.size = sum(node.size for node in self.nodes.itervalues())
         self.node_count = len(self.nodes)
-        self.edge_count = len(self.edges)
         self.instruction_count = sum(node.instruction_count for node in self.nodes.itervalues())
-        self.cyclomatic_complexity = self.edge_count - self.node_count + 2
+
+        #
+        # compute a cheap structural fingerprint of the function from the
+        # layout of its nodes. two functions with differing fingerprints are
+        # guaranteed to differ, allowing equality checks (eg, during refresh)
+        # to bail early without comparing the function nodes one by one.
+        #
+        # NOTE: edges are collected separately, so they are not included here
+        #
+
+        self.fingerprint = hash(tuple(sorted(
+            (node.address, node.size, node.instruction_count) for node in self.nodes.itervalues()
+        )))
 
     #--------------------------------------------------------------------------
     # Operator Overloads
     #--------------------------------------------------------------------------
 
+    def same_layout(self, other):
+        """
+        Return True if the nodes of the given function are laid out as ours.
+        """
+
+        # renamed functions share the nodes of the function they were copied from
+        if self.nodes is other.nodes:
+            return True
+
+        # fast path, functions with differing fingerprints cannot be equal
+        if self.fingerprint != other.fingerprint:
+            return False
+
+        #
+        # the fingerprints match, which is almost certainly because the
+        # layouts are the same. but hashes can collide, so do a deep
+        # comparison of the nodes to confirm it
+        #
+
+        if self.nodes.viewkeys() != other.nodes.viewkeys():
+            return False
+
+        other_nodes = other.nodes
+        for node_address, node_metadata in self.nodes.iteritems():
+            other_node = other_nodes[node_address]
+            if node_metadata.size != other_node.size:
+                return False
+            if node_metadata.instruction_count != other_node.instruction_count:
+                return False
+
+        return True
+
     def __eq__(self, other):
         """
         Compute function equality (==)
         """
         result = True
         result &= self.name == other.name
-        result &= self.size == other.size
         result &= self.address == other.address
-        result &= self.node_count == other.node_count
-        result &= self.instruction_count == other.instruction_count
-        result &= self.nodes.viewkeys() == other.nodes.viewkeys()
+        result &= self.same_layout(other)
         return result
 
 #------------------------------------------------------------------------------
@@ -805,7 +2097,7 @@ class NodeMetadata(object):
     Fast access node level metadata cache.
     """
 
-    def __init__(self, start_ea, end_ea, node_id=idaapi.BADADDR):
+    def __init__(self, start_ea, end_ea, node_id, function_instructions):
 
         # node metadata
         self.size = end_ea - start_ea
@@ -818,14 +2110,33 @@ class NodeMetadata(object):
         # parent function_metadata
         self.function = None
 
-        # instruction addresses
-        self.instructions = []
+        # the (sorted) instruction addresses of the parent function
+        self._function_instructions = function_instructions
+
+        # the bounds of this node's instructions in the function instructions
+        self._index_start = 0
+        self._index_end = 0
 
         #----------------------------------------------------------------------
 
         # collect metdata from the underlying database
         self._build_metadata()
 
+    #--------------------------------------------------------------------------
+    # Properties
+    #--------------------------------------------------------------------------
+
+    @property
+    def instructions(self):
+        """
+        The instruction addresses in this node.
+
+        Most nodes will never receive coverage, so the instruction addresses
+        of a node are only materialized (sliced from the instructions of its
+        function) when they are requested.
+        """
+        return self._function_instructions[self._index_start:self._index_end]
+
     #--------------------------------------------------------------------------
     # Metadata Population
     #--------------------------------------------------------------------------
@@ -834,21 +2145,14 @@ class NodeMetadata(object):
         """
         Collect node metadata from the underlying database.
         """
-        current_address = self.address
-        node_end = self.address + self.size
+        instructions = self._function_instructions
 
-        #
-        # loop through the node's entire range and count its instructions
-        #   NOTE: we are assuming that every defined 'head' is an instruction
-        #
-
-        while current_address < node_end:
-            instruction_size = idaapi.get_item_end(current_address) - current_address
-            self.instructions.append(current_address)
-            current_address += instruction_size
+        # locate the instructions of this node within the function instructions
+        self._index_start = bisect.bisect_left(instructions, self.address)
+        self._index_end   = bisect.bisect_left(instructions, self.address + self.size, self._index_start)
 
         # save the number of instructions in this block
-        self.instruction_count = len(self.instructions)
+        self.instruction_count = self._index_end - self._index_start
 
     #--------------------------------------------------------------------------
     # Operator Overloads
@@ -890,6 +2194,180 @@ class NodeMetadata(object):
         result &= self.id == other.id
         return result
 
+#------------------------------------------------------------------------------
+# Function Name Search
+#------------------------------------------------------------------------------
+
+class FunctionNameIndex(object):
+    """
+    A trigram index for fast substring searches of function names.
+
+    Every (lowercased) function name is broken into its trigrams, eg
+    'memcpy' --> 'mem', 'emc', 'mcp', 'cpy'. Each trigram maps to a posting
+    list of the names that contain it. Any name that contains a search
+    string must appear in the posting list of every trigram in that string.
+
+    A search intersects the smallest posting lists of the query trigrams to
+    produce a small set of candidate names, which are then verified with a
+    plain substring test. Queries too short to have trigrams fall back to
+    testing every name.
+    """
+
+    # compact the index when this fraction of its entries are removed (dead)
+    COMPACT_RATIO = 0.5
+
+    # stop intersecting posting lists once there are this few candidates
+    CANDIDATE_LIMIT = 256
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        #
+        # indexed names are assigned an id (their index into these lists).
+        # removing a name simply clears its entry, leaving a 'dead' id in
+        # the posting lists until the next compaction
+        #
+
+        self._addresses = []
+        self._names = []
+        self._lowered = []
+        self._ids = {}
+        self._dead = 0
+
+        # trigram --> array of name ids
+        self._postings = {}
+
+        # the last search, to refine as the user continues to type
+        self._last_search = None
+
+    #--------------------------------------------------------------------------
+    # Public
+    #--------------------------------------------------------------------------
+
+    def add(self, address, name):
+        """
+        Add (or replace) the name of the function at the given address.
+        """
+        with self._lock:
+            self._remove(address)
+            self._add(address, name)
+
+    def remove(self, address):
+        """
+        Remove the name of the function at the given address.
+        """
+        with self._lock:
+            self._remove(address)
+
+    def search(self, substring, case_sensitive=False):
+        """
+        Get the addresses of the functions whose names contain the substring.
+        """
+        needle = substring if case_sensitive else substring.lower()
+
+        with self._lock:
+            names = self._names if case_sensitive else self._lowered
+
+            #
+            # if the user is extending the last query (eg, typing), every name
+            # matching this query must also have matched the last one. so we
+            # only need to re-check the names that matched the last search
+            #
+
+            last = self._last_search
+            if last and last[1] == case_sensitive and last[0] in needle:
+                candidates = last[2]
+            else:
+                candidates = self._get_candidates(needle.lower())
+
+            # verify the candidate names actually contain the substring
+            if candidates is None:
+                matches = [i for i, name in enumerate(names) if name is not None and needle in name]
+            else:
+                matches = [i for i in candidates if names[i] is not None and needle in names[i]]
+
+            self._last_search = (needle, case_sensitive, matches)
+            return set(self._addresses[i] for i in matches)
+
+    #--------------------------------------------------------------------------
+    # Internal
+    #--------------------------------------------------------------------------
+
+    def _add(self, address, name):
+        """
+        Add a function name to the index.
+        """
+        name_id = len(self._names)
+        lowered = name.lower()
+
+        self._addresses.append(address)
+        self._names.append(name)
+        self._lowered.append(lowered)
+        self._ids[address] = name_id
+
+        for trigram in set(lowered[i:i+3] for i in xrange(len(lowered) - 2)):
+            posting = self._postings.get(trigram, None)
+            if posting is None:
+                posting = self._postings[trigram] = array.array("I")
+            posting.append(name_id)
+
+        # the index has changed, past search results can no longer be refined
+        self._last_search = None
+
+    def _remove(self, address):
+        """
+        Remove a function name from the index.
+        """
+        name_id = self._ids.pop(address, None)
+        if name_id is None:
+            return
+
+        # mark the name as removed (dead)
+        self._names[name_id] = None
+        self._lowered[name_id] = None
+        self._dead += 1
+        self._last_search = None
+
+        # rebuild the index if it is carrying too many dead names
+        if self._dead > len(self._names) * self.COMPACT_RATIO:
+            self._compact()
+
+    def _compact(self):
+        """
+        Rebuild the index, dropping any removed (dead) names.
+        """
+        live = [(a, n) for a, n in itertools.izip(self._addresses, self._names) if n is not None]
+
+        self._addresses = []
+        self._names = []
+        self._lowered = []
+        self._ids = {}
+        self._dead = 0
+        self._postings = {}
+
+        for address, name in live:
+            self._add(address, name)
+
+    def _get_candidates(self, needle):
+        """
+        Get the ids of the names that may contain the given (lowercase) needle.
+
+        Returns None if the needle is too short to narrow the search.
+        """
+        trigrams = set(needle[i:i+3] for i in xrange(len(needle) - 2))
+        if not trigrams:
+            return None
+
+        # intersect the posting lists, starting with the smallest (rarest)
+        postings = sorted((self._postings.get(t, ()) for t in trigrams), key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            if len(candidates) <= self.CANDIDATE_LIMIT:
+                break
+            candidates.intersection_update(posting)
+
+        return sorted(candidates)
+
 #------------------------------------------------------------------------------
 # Metadata Helpers
 #------------------------------------------------------------------------------
@@ -944,7 +2422,7 @@ class MetadataDelta(object):
         #
 
         # compute the node delta
-        self._compute_node_delta(new_metadata.nodes, old_metadata.nodes)
+        self._compute_node_delta(new_metadata.functions, old_metadata.functions)
 
         # compute the function delta
         self._compute_function_delta(new_metadata.functions, old_metadata.functions)
@@ -952,43 +2430,76 @@ class MetadataDelta(object):
         # done
         return
 
-    def _compute_node_delta(self, new_nodes, old_nodes):
+    def _compute_node_delta(self, new_functions, old_functions):
         """
-        Compute the delta between two dictionaries of node metadata.
+        Compute the delta between the nodes of two dictionaries of function metadata.
         """
 
-        # loop through *all* the node addresses in both metadata objects
-        all_node_addresses = new_nodes.viewkeys() | old_nodes.viewkeys()
-        for node_address in all_node_addresses:
-
-            # probe for this node in the metadata sets
-            new_node_metadata = new_nodes.get(node_address, None)
-            old_node_metadata = old_nodes.get(node_address, None)
-
-            # the node does NOT exist in the new metadata, so it was deleted
-            if not new_node_metadata:
-                self.nodes_removed.add(node_address)
-                self._dirty_functions |= set(old_node_metadata.functions.viewkeys())
-                continue
+        # loop through *all* the function addresses in both metadata objects
+        all_function_addresses = new_functions.viewkeys() | old_functions.viewkeys()
+        for function_address in all_function_addresses:
 
-            # the node does NOT exist in the old metadata, so it was added
-            if not old_node_metadata:
-                self.nodes_added.add(node_address)
-                self._dirty_functions |= set(new_node_metadata.functions.viewkeys())
-                continue
+            # probe for this function in the metadata sets
+            new_func_metadata = new_functions.get(function_address, None)
+            old_func_metadata = old_functions.get(function_address, None)
 
             #
-            # ~ the node exists in *both* metadata sets ~
+            # if the layout of the function nodes is unchanged, so are the nodes
+            # of the function, and there is no need to compare them one by one
             #
 
-            # if the nodes are identical, there's no delta (change)
-            if new_node_metadata == old_node_metadata:
-                continue
+            if new_func_metadata and old_func_metadata:
+                if new_func_metadata is old_func_metadata:
+                    continue
+                if new_func_metadata.same_layout(old_func_metadata):
+                    continue
+
+            new_nodes = new_func_metadata.nodes if new_func_metadata else {}
+            old_nodes = old_func_metadata.nodes if old_func_metadata else {}
+
+            # loop through *all* the node addresses of both function versions
+            all_node_addresses = new_nodes.viewkeys() | old_nodes.viewkeys()
+            for node_address in all_node_addresses:
+
+                # probe for this node in the metadata sets
+                new_node_metadata = new_nodes.get(node_address, None)
+                old_node_metadata = old_nodes.get(node_address, None)
+
+                # the node does NOT exist in the new function, so it was deleted
+                if not new_node_metadata:
+                    self.nodes_removed.add(node_address)
+                    self._dirty_functions.add(old_node_metadata.function.address)
+                    continue
+
+                # the node does NOT exist in the old function, so it was added
+                if not old_node_metadata:
+                    self.nodes_added.add(node_address)
+                    self._dirty_functions.add(new_node_metadata.function.address)
+                    continue
+
+                #
+                # ~ the node exists in *both* function versions ~
+                #
+
+                # if the nodes are identical, there's no delta (change)
+                if new_node_metadata == old_node_metadata:
+                    continue
+
+                # the nodes do not match, that's a difference!
+                self.nodes_modified.add(node_address)
+                self._dirty_functions.add(new_node_metadata.function.address)
+                self._dirty_functions.add(old_node_metadata.function.address)
+
+        #
+        # a node that moved between two functions was removed from one and
+        # added to the other. as far as the node delta goes, it was modified
+        #
 
-            # the nodes do not match, that's a difference!
-            self.nodes_modified.add(node_address)
-            self._dirty_functions |= set(new_node_metadata.functions.viewkeys())
-            self._dirty_functions |= set(old_node_metadata.functions.viewkeys())
+        moved_nodes = self.nodes_added & self.nodes_removed
+        if moved_nodes:
+            self.nodes_added   -= moved_nodes
+            self.nodes_removed -= moved_nodes
+            self.nodes_modified |= moved_nodes
 
     def _compute_function_delta(self, new_functions, old_functions):
         """
@@ -1076,27 +2587,75 @@ class MetadataDelta(object):
 # Async Metadata Helpers
 #--------------------------------------------------------------------------
 
-@execute_sync(idaapi.MFF_READ)
-def collect_function_metadata(function_addresses):
+def _splice_sorted(values, removed, added):
     """
-    Collect function metadata for a list of addresses.
+    Return a copy of a sorted list, with the given values removed and added.
+
+    The unchanged runs of the sorted list are copied between the (sorted)
+    changes, so only the changes themselves are visited one by one.
     """
-    return { ea: FunctionMetadata(ea) for ea in function_addresses }
+    output = []
+    added = set(added)
+
+    position = 0
+    for value in sorted(added.union(removed)):
+        index = bisect.bisect_left(values, value, position)
+        output.extend(values[position:index])
+
+        # skip the old entry for this value, if it had one
+        if index < len(values) and values[index] == value:
+            index += 1
+        position = index
 
-@idafast
-def metadata_progress(completed, total):
+        if value in added:
+            output.append(value)
+
+    output.extend(values[position:])
+    return output
+
+def _same_edges(old_metadata, new_metadata):
     """
-    Handler for metadata collection callback, updates progress dialog.
+    Return True if two versions of a function have the same nodes & edges.
     """
-    idaapi.replace_wait_box("Collected metadata for %u/%u Functions" % (completed, total))
+    if not (old_metadata and new_metadata):
+        return False
+    return old_metadata.edges is new_metadata.edges and \
+        old_metadata.nodes.viewkeys() == new_metadata.nodes.viewkeys()
 
-#--------------------------------------------------------------------------
-# Event Hooks
-#--------------------------------------------------------------------------
+def collect_function_metadata(function_addresses, backend):
+    """
+    Collect function metadata for a list of addresses.
+    """
+    return { ea: FunctionMetadata(ea, backend) for ea in function_addresses }
 
-if using_ida7api:
-    class RenameHooks(idaapi.IDB_Hooks):
-        pass
-else:
-    class RenameHooks(idaapi.IDP_Hooks):
-        pass
+def collect_function_edges(functions, backend):
+    """
+    Collect the intra-function edges of the given function metadata in bulk.
+
+    Rather than querying the backend once per function, the edges leaving
+    every node of the given functions are fetched with a single query.
+
+    Returns a map of function address --> list of (src, dst) edges.
+    """
+    edges = { function_metadata.address: [] for function_metadata in functions }
+
+    # an edge leaves the last instruction of its source node
+    owners = {}
+    for function_metadata in functions:
+        for node_metadata in function_metadata.nodes.itervalues():
+            if node_metadata.instruction_count:
+                owners[node_metadata.instructions[-1]] = function_metadata
+
+    #
+    # keep the edges with a destination that falls within the function of
+    # its source. a destination is owned by a function if it starts one of
+    # the nodes we have already collected for it, which saves us from
+    # querying the database for its owning function
+    #
+
+    for edge_src, edge_dst in backend.get_edges(sorted(owners)):
+        function_metadata = owners[edge_src]
+        if edge_dst in function_metadata.nodes:
+            edges[function_metadata.address].append((edge_src, edge_dst))
+
+    return edges
@@ -8,7 +8,8 @@ import idaapi
 from lighthouse.util import *
 from .coverage_combobox import CoverageComboBox
 from lighthouse.composer import ComposingShell
-from lighthouse.metadata import FunctionMetadata, metadata_progress
+from lighthouse.metadata import FunctionMetadata
+from lighthouse.backends import metadata_progress
 from lighthouse.coverage import FunctionCoverage
 
 logger = logging.getLogger("Lighthouse.UI.Overview")
@@ -22,10 +23,12 @@ COV_PERCENT  = 0
 FUNC_NAME    = 1
 FUNC_ADDR    = 2
 BLOCKS_HIT   = 3
-INST_HIT     = 4
-FUNC_SIZE    = 5
-COMPLEXITY   = 6
-FINAL_COLUMN = 7
+EDGES_HIT    = 4
+INST_HIT     = 5
+FUNC_SIZE    = 6
+COMPLEXITY   = 7
+FRONTIER     = 8
+FINAL_COLUMN = 9
 
 # column -> field name mapping
 COLUMN_TO_FIELD = \
@@ -34,9 +37,11 @@ COLUMN_TO_FIELD = \
     FUNC_NAME:    "name",
     FUNC_ADDR:    "address",
     BLOCKS_HIT:   "nodes_executed",
+    EDGES_HIT:    "edges_executed",
     INST_HIT:     "instructions_executed",
     FUNC_SIZE:    "size",
-    COMPLEXITY:   "cyclomatic_complexity"
+    COMPLEXITY:   "cyclomatic_complexity",
+    FRONTIER:     "frontier"
 }
 
 # column headers of the table
@@ -46,8 +51,10 @@ SAMPLE_CONTENTS = \
     " sub_140001B20 ",
     " 0x140001b20 ",
     " 100 / 100 ",
+    " 100 / 100 ",
     " 1000 / 1000 ",
     " 10000000 ",
+    " 1000000 ",
     " 1000000 "
 ]
 
@@ -564,9 +571,11 @@ class CoverageModel(QtCore.QAbstractTableModel):
             FUNC_NAME:    "Function Name",
             FUNC_ADDR:    "Address",
             BLOCKS_HIT:   "Blocks Hit",
+            EDGES_HIT:    "Edges Hit",
             INST_HIT:     "Instructions Hit",
             FUNC_SIZE:    "Function Size",
             COMPLEXITY:   "Complexity",
+            FRONTIER:     "Frontier",
             FINAL_COLUMN: ""            # NOTE: stretch section, left blank for now
         }
 
@@ -705,6 +714,13 @@ class CoverageModel(QtCore.QAbstractTableModel):
                 return "%3u / %-3u" % (function_coverage.nodes_executed,
                                        function_metadata.node_count)
 
+            # Edges Hit (edges are collected after the rest of the metadata)
+            elif column == EDGES_HIT:
+                if function_metadata.edge_count is None or function_coverage.edges_executed is None:
+                    return "-"
+                return "%3u / %-3u" % (function_coverage.edges_executed,
+                                       function_metadata.edge_count)
+
             # Instructions Hit
             elif column == INST_HIT:
                 return "%4u / %-4u" % (function_coverage.instructions_executed,
@@ -716,8 +732,16 @@ class CoverageModel(QtCore.QAbstractTableModel):
 
             # Cyclomatic Complexity
             elif column == COMPLEXITY:
+                if function_metadata.cyclomatic_complexity is None:
+                    return "-"
                 return "%u" % function_metadata.cyclomatic_complexity
 
+            # Frontier (the uncovered code reachable past the function coverage)
+            elif column == FRONTIER:
+                if function_coverage.frontier is None:
+                    return "-"
+                return "%u" % function_coverage.frontier
+
         # cell background color request
         elif role == QtCore.Qt.BackgroundRole:
             function_address  = self.row2func[index.row()]
@@ -779,7 +803,7 @@ class CoverageModel(QtCore.QAbstractTableModel):
             )
 
         # sort the table entries by a function coverage attribute
-        elif column in [COV_PERCENT, BLOCKS_HIT, INST_HIT]:
+        elif column in [COV_PERCENT, BLOCKS_HIT, EDGES_HIT, INST_HIT, FRONTIER]:
             sorted_functions = sorted(
                 self._visible_coverage.itervalues(),
                 key=attrgetter(sort_field),
@@ -918,17 +942,22 @@ class CoverageModel(QtCore.QAbstractTableModel):
         metadata = self._director.metadata
         coverage = self._director.coverage
 
+        # the table may display (and sort) any function, finalize them in bulk
+        coverage.finalize_all()
+
         #
         # if the search string is all lowercase, then we are going to perform
         # a case insensitive search/filter.
         #
-        # that means we we want to 'normalize' all the function names by
-        # making them lowercase before searching for our needle (search str)
+        # rather than testing every function name for the search string, the
+        # metadata name index narrows the listing to the matching functions
         #
 
-        normalize = lambda x: x
-        if not (set(self._search_string) & set(string.ascii_uppercase)):
-            normalize = lambda x: string.lower(x)
+        if self._search_string:
+            case_sensitive = bool(set(self._search_string) & set(string.ascii_uppercase))
+            function_addresses = metadata.search_functions(self._search_string, case_sensitive)
+        else:
+            function_addresses = metadata.functions.viewkeys()
 
         #
         # it's time to rebuild the list of coverage items to make visible in
@@ -936,19 +965,19 @@ class CoverageModel(QtCore.QAbstractTableModel):
         # that do not meet the criteria as specified by the user.
         #
 
-        # loop through *all* the functions as defined in the active metadata
-        for function_address in metadata.functions.iterkeys():
+        # loop through the functions (matching the search) in the active metadata
+        for function_address in function_addresses:
 
             #------------------------------------------------------------------
             # Filters - START
             #------------------------------------------------------------------
 
-            # OPTION: ignore items with 0% coverage items
-            if self._hide_zero and not function_address in coverage.functions:
+            # ignore matches that have not yet been published in the metadata
+            if not function_address in metadata.functions:
                 continue
 
-            # OPTIONS: ignore items that do not match the search string
-            if not self._search_string in normalize(metadata.functions[function_address].name):
+            # OPTION: ignore items with 0% coverage items
+            if self._hide_zero and not function_address in coverage.functions:
                 continue
 
             #------------------------------------------------------------------
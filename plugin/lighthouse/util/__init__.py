@@ -1,6 +1,19 @@
-from .ida import *
-from .misc import *
+from .python import *
 from .debug import *
-from .log import lmsg, logging_started, start_logging
-from .shims import using_ida7api, using_pyqt5, QtCore, QtGui, QtWidgets, DockableShim
+from .bitmap import *
 
+#
+# the remaining utilities are bound to IDA and Qt. they are unavailable when
+# lighthouse is used headless (eg, metadata loaded from a file, outside IDA),
+# where the synchronization helpers are replaced by headless stand-ins
+#
+
+try:
+    import idaapi
+except ImportError:
+    from .headless import *
+else:
+    from .ida import *
+    from .misc import *
+    from .log import lmsg, logging_started, start_logging
+    from .shims import using_ida7api, using_pyqt5, QtCore, QtGui, QtWidgets, DockableShim
@@ -0,0 +1,427 @@
+import re
+import array
+import bisect
+import itertools
+
+from .python import build_bitmap, bitmap_ordinals, popcount
+
+#------------------------------------------------------------------------------
+# Compressed Bitmaps
+#------------------------------------------------------------------------------
+#
+#    A compressed bitmap is a set of (32bit) ordinals, stored in the style of
+#    a 'Roaring' bitmap. The ordinal space is split into chunks of 2^16
+#    ordinals, and the members of each chunk are stored in a 'container'
+#    that is selected based on what is smallest for the members it holds:
+#
+#      - array:  a sorted array of the (16bit) members, for sparse chunks
+#      - run:    a sorted array of (start, last) member runs, for clustered
+#                chunks
+#      - bitmap: a (long) bitmap of the members, for dense, scattered chunks
+#
+#    Coverage tends to be highly clustered (eg, whole basic blocks executed
+#    at a time) so the majority of chunks compress to a handful of runs. Empty
+#    chunks are not stored at all.
+#
+#    Set operations (|, &, ^, -) are computed chunk by chunk. Chunks present
+#    in only one of the operands are shared with the result as is, so a
+#    compressed bitmap and its containers must never be modified in place.
+#
+#    Compressing a container costs time proportional to its members, while
+#    operating on (long) bitmaps does not. The results of set operations are
+#    therefore left as bitmap containers, and only compressed (see compress)
+#    once the set is going to be kept around. Intermediate results, such as
+#    those of a composition, are never compressed at all.
+#
+
+CONTAINER_BITS = 16
+CONTAINER_SIZE = 1 << CONTAINER_BITS
+CONTAINER_MASK = CONTAINER_SIZE - 1
+
+# container kinds
+ARRAY_CONTAINER  = 0
+RUN_CONTAINER    = 1
+BITMAP_CONTAINER = 2
+
+# the size (in bytes) of a bitmap container, the most any container may cost
+BITMAP_CONTAINER_SIZE = CONTAINER_SIZE / 8
+
+# matches the runs of set bits in a (reversed) bitmap string
+RUN_PATTERN = re.compile("1+")
+
+class CompressedBitmap(object):
+    """
+    A compressed, immutable set of ordinals.
+    """
+
+    __slots__ = ("_containers",)
+
+    def __init__(self, containers=None):
+        self._containers = containers or {}
+
+    @classmethod
+    def from_ordinals(cls, ordinals):
+        """
+        Build a compressed bitmap of the given ordinals.
+        """
+        containers = {}
+
+        ordinals = sorted(ordinals)
+        for key, members in itertools.groupby(ordinals, lambda x: x >> CONTAINER_BITS):
+            container = _container_from_members([x & CONTAINER_MASK for x in members])
+            if container:
+                containers[key] = container
+
+        return cls(containers)
+
+    @classmethod
+    def from_bitmap(cls, bitmap):
+        """
+        Build a compressed bitmap of the given (long) bitmap.
+        """
+        containers = {}
+
+        bits = bin(bitmap)[:1:-1]
+        for start in xrange(0, len(bits), CONTAINER_SIZE):
+            chunk = bits[start:start+CONTAINER_SIZE]
+            if not "1" in chunk:
+                continue
+            containers[start >> CONTAINER_BITS] = _container_from_bits(chunk)
+
+        return cls(containers)
+
+    def to_bitmap(self):
+        """
+        Return the (long) bitmap of this set.
+        """
+        chunks = []
+        position = 0
+
+        # build the bit string of the set, from lowest to highest ordinal
+        for key in sorted(self._containers):
+            start = key << CONTAINER_BITS
+            chunk = _container_bits(self._containers[key])
+            chunks.append("0" * (start - position))
+            chunks.append(chunk)
+            position = start + len(chunk)
+
+        if not chunks:
+            return 0
+
+        # the integer conversion expects the highest bit first
+        return long("".join(chunks)[::-1], 2)
+
+    def compress(self, keys=None):
+        """
+        Return this set, with each of its containers in its smallest form.
+
+        If keys are given, only the containers of those (chunk) keys are
+        compressed, and the rest are shared with the result as is.
+        """
+        if keys is None:
+            keys = self._containers.viewkeys()
+
+        containers = dict(self._containers)
+        for key in keys:
+            container = containers.get(key, None)
+            if container and container[0] == BITMAP_CONTAINER:
+                containers[key] = _container_from_bits(bin(container[1])[:1:-1])
+
+        return CompressedBitmap(containers)
+
+    def union(self, other):
+        """
+        Return the (compressed) union of this set and another.
+
+        This is the equivalent of (self | other).compress() for a set that
+        is updated a little at a time, as only the containers touched by the
+        other set are compressed.
+        """
+        return (self | other).compress(other._containers.viewkeys())
+
+    def difference(self, other):
+        """
+        Return the (compressed) difference of this set and another.
+
+        See union() for more information.
+        """
+        return (self - other).compress(other._containers.viewkeys())
+
+    def runs(self):
+        """
+        Yield the (start, stop) ranges of consecutive ordinals in this set.
+        """
+        for key in sorted(self._containers):
+            base = key << CONTAINER_BITS
+            for start, stop in _container_runs(self._containers[key]):
+                yield (base + start, base + stop)
+
+    @property
+    def size(self):
+        """
+        The approximate size (in bytes) of the set data.
+        """
+        return sum(_container_size(container) for container in self._containers.itervalues())
+
+    #--------------------------------------------------------------------------
+    # Operator Overloads
+    #--------------------------------------------------------------------------
+
+    def __or__(self, other):
+        containers = dict(self._containers)
+        for key, container in other._containers.iteritems():
+            if key in containers:
+                container = _container_op(containers[key], container, long.__or__)
+            containers[key] = container
+        return CompressedBitmap(containers)
+
+    def __and__(self, other):
+        containers = {}
+        for key in self._containers.viewkeys() & other._containers.viewkeys():
+            container = _container_op(self._containers[key], other._containers[key], long.__and__)
+            if container:
+                containers[key] = container
+        return CompressedBitmap(containers)
+
+    def __xor__(self, other):
+        containers = dict(self._containers)
+        for key, container in other._containers.iteritems():
+            if key in containers:
+                container = _container_op(containers[key], container, long.__xor__)
+                if not container:
+                    del containers[key]
+                    continue
+            containers[key] = container
+        return CompressedBitmap(containers)
+
+    def __sub__(self, other):
+        containers = dict(self._containers)
+        for key, container in other._containers.iteritems():
+            if not key in containers:
+                continue
+            container = _container_op(containers[key], container, _difference)
+            if container:
+                containers[key] = container
+            else:
+                del containers[key]
+        return CompressedBitmap(containers)
+
+    def __iter__(self):
+        for key in sorted(self._containers):
+            base = key << CONTAINER_BITS
+            for member in _container_members(self._containers[key]):
+                yield base | member
+
+    def __len__(self):
+        return sum(container[2] for container in self._containers.itervalues())
+
+    def __nonzero__(self):
+        return bool(self._containers)
+
+    def __contains__(self, ordinal):
+        container = self._containers.get(ordinal >> CONTAINER_BITS, None)
+        if not container:
+            return False
+        return _container_contains(container, ordinal & CONTAINER_MASK)
+
+#------------------------------------------------------------------------------
+# Containers
+#------------------------------------------------------------------------------
+#
+#    A container is a tuple of (kind, data, cardinality), where data is:
+#
+#      - array:  an array('H') of the sorted members
+#      - run:    an array('H') of the interleaved (start, last) member runs
+#      - bitmap: a (long) bitmap of the members
+#
+#    Operations between two array containers are performed directly over
+#    their members. All other operations are performed over the bitmaps of
+#    the containers, which python computes natively (and a container is at
+#    most 8KB of bitmap) producing a bitmap container.
+#
+
+def _container_from_members(members):
+    """
+    Build a container of the given sorted (16bit) members.
+    """
+    count = len(members)
+    if not count:
+        return None
+
+    # count the runs of consecutive members
+    runs = 1 + sum(1 for a, b in itertools.izip(members, itertools.islice(members, 1, None)) if b != a + 1)
+
+    # an array container is the smallest option
+    if 2 * count <= min(4 * runs, BITMAP_CONTAINER_SIZE):
+        return (ARRAY_CONTAINER, array.array("H", members), count)
+
+    return _container_from_bits(bin(build_bitmap(members))[:1:-1])
+
+def _container_from_bits(bits):
+    """
+    Build a container of the given (reversed, lowest bit first) bit string.
+    """
+    count = bits.count("1")
+    if not count:
+        return None
+
+    # count the runs of set bits
+    runs = bits.count("01") + (bits[0] == "1")
+
+    array_size = 2 * count
+    run_size = 4 * runs
+
+    # an array container is the smallest option
+    if array_size <= min(run_size, BITMAP_CONTAINER_SIZE):
+        return (ARRAY_CONTAINER, array.array("H", _bits_members(bits)), count)
+
+    # a run container is the smallest option
+    if run_size <= BITMAP_CONTAINER_SIZE:
+        data = array.array("H")
+        for match in RUN_PATTERN.finditer(bits):
+            data.append(match.start())
+            data.append(match.end() - 1)
+        return (RUN_CONTAINER, data, count)
+
+    # a bitmap container is the smallest option
+    return (BITMAP_CONTAINER, long(bits[::-1], 2), count)
+
+def _container_bits(container):
+    """
+    Return the (reversed, lowest bit first) bit string of the given container.
+    """
+    kind, data, _ = container
+
+    if kind == BITMAP_CONTAINER:
+        return bin(data)[:1:-1]
+
+    if kind == ARRAY_CONTAINER:
+        return bin(build_bitmap(data))[:1:-1]
+
+    chunks = []
+    position = 0
+    for i in xrange(0, len(data), 2):
+        start, last = data[i], data[i+1]
+        chunks.append("0" * (start - position))
+        chunks.append("1" * (last - start + 1))
+        position = last + 1
+
+    return "".join(chunks)
+
+def _container_bitmap(container):
+    """
+    Return the (long) bitmap of the given container.
+    """
+    kind, data, _ = container
+
+    if kind == BITMAP_CONTAINER:
+        return data
+
+    if kind == ARRAY_CONTAINER:
+        return build_bitmap(data)
+
+    return long(_container_bits(container)[::-1], 2)
+
+def _container_op(a, b, operator):
+    """
+    Perform the given bitwise set operation between two containers.
+    """
+    if a[0] == ARRAY_CONTAINER and b[0] == ARRAY_CONTAINER:
+        members = _ARRAY_OPS[operator](set(a[1]), set(b[1]))
+        return _container_from_members(sorted(members))
+
+    bitmap = operator(long(_container_bitmap(a)), long(_container_bitmap(b)))
+    if not bitmap:
+        return None
+
+    return (BITMAP_CONTAINER, bitmap, popcount(bitmap))
+
+def _container_members(container):
+    """
+    Yield the (16bit) members of the given container, in order.
+    """
+    kind, data, _ = container
+
+    if kind == ARRAY_CONTAINER:
+        return iter(data)
+
+    if kind == BITMAP_CONTAINER:
+        return bitmap_ordinals(data)
+
+    return itertools.chain.from_iterable(
+        xrange(data[i], data[i+1] + 1) for i in xrange(0, len(data), 2)
+    )
+
+def _container_runs(container):
+    """
+    Yield the (start, stop) ranges of consecutive members in the given container.
+    """
+    kind, data, _ = container
+
+    if kind == RUN_CONTAINER:
+        return ((data[i], data[i+1] + 1) for i in xrange(0, len(data), 2))
+
+    if kind == BITMAP_CONTAINER:
+        bits = bin(data)[:1:-1]
+    else:
+        bits = _container_bits(container)
+
+    return (match.span() for match in RUN_PATTERN.finditer(bits))
+
+def _container_contains(container, member):
+    """
+    Return True if the given (16bit) member is in the given container.
+    """
+    kind, data, _ = container
+
+    if kind == BITMAP_CONTAINER:
+        return bool((data >> member) & 1)
+
+    if kind == ARRAY_CONTAINER:
+        index = bisect.bisect_left(data, member)
+        return index < len(data) and data[index] == member
+
+    #
+    # the runs are stored as interleaved (start, last) pairs. landing at an
+    # odd index means the member falls after the start of a run, and before
+    # its last member. landing at an even index, the member can only be the
+    # last member of the preceding run
+    #
+
+    index = bisect.bisect_right(data, member)
+    if index & 1:
+        return True
+    return index > 0 and data[index-1] == member
+
+def _container_size(container):
+    """
+    Return the approximate size (in bytes) of the given container's data.
+    """
+    kind, data, _ = container
+    if kind == BITMAP_CONTAINER:
+        return BITMAP_CONTAINER_SIZE
+    return data.itemsize * len(data)
+
+def _bits_members(bits):
+    """
+    Yield the members set in the given (reversed) bit string.
+    """
+    member = bits.find("1")
+    while member != -1:
+        yield member
+        member = bits.find("1", member + 1)
+
+def _difference(a, b):
+    """
+    The bitwise set difference of two bitmaps.
+    """
+    return a & ~b
+
+# the set operations equivalent to each bitwise operation
+_ARRAY_OPS = \
+{
+    long.__or__:  set.__or__,
+    long.__and__: set.__and__,
+    long.__xor__: set.__xor__,
+    _difference:  set.__sub__,
+}
@@ -0,0 +1,53 @@
+import logging
+
+logger = logging.getLogger("Lighthouse.Util.Headless")
+
+#------------------------------------------------------------------------------
+# Headless Stand-ins
+#------------------------------------------------------------------------------
+#
+#    When lighthouse is used outside of IDA (eg, mapping coverage against
+#    metadata loaded from a file), there is no IDA mainthread to marshal
+#    work onto, or UI event loop to keep alive while waiting on a worker.
+#
+#    These are the headless equivalents of the synchronization helpers in
+#    ida.py, such that the director and coverage can run unmodified.
+#
+
+def lmsg(message):
+    """
+    Print a message to the console, prefixed with [Lighthouse]
+    """
+    print "[Lighthouse] %s" % message
+
+def idafast(f):
+    """
+    Decorator for marking a function as fast / UI event (runs in place).
+    """
+    return f
+
+def mainthread(f):
+    """
+    A debug decorator to assert main thread execution (a no-op).
+    """
+    return f
+
+def execute_sync(sync_flags=None):
+    """
+    Synchronization decorator capable of providing return values (in place).
+    """
+    def real_decorator(function):
+        return function
+    return real_decorator
+
+def await_future(future):
+    """
+    Block until the given future (Queue) carries a result.
+    """
+    return future.get()
+
+def await_lock(lock):
+    """
+    Block until the given lock has been acquired.
+    """
+    lock.acquire()
@@ -3,6 +3,7 @@ import Queue
 import logging
 import binascii
 import functools
+import itertools
 
 import idaapi
 from .shims import using_ida7api, using_pyqt5, QtCore, QtGui, QtWidgets
@@ -78,52 +79,62 @@ def map_line2node(cfunc, metadata, line2citem):
     # prior to this function, a line2citem map was built to tell us which
     # citems reside on any given line of text in the decompilation output.
     #
-    # now, we walk through this line2citem map one 'line_number' at a time in
-    # an effort to resolve the set of graph nodes associated with its citems.
+    # we first collect the code address of every citem referenced by the
+    # map, so that they can be resolved to graph nodes in a single batched
+    # lookup against the database metadata.
     #
 
+    line2address = {}
     for line_number, citem_indexes in line2citem.iteritems():
-        nodes = set()
-
-        #
-        # we are at the level of a single line (line_number). we now consume
-        # its set of citems (citem_indexes) and attempt to identify the explict
-        # graph nodes they claim to be sourced from (by their reported EA)
-        #
+        addresses = line2address[line_number] = []
 
         for index in citem_indexes:
 
             # get the code address of the given citem
             try:
                 item = treeitems[index]
-                address = item.ea
+                addresses.append(item.ea)
 
             # apparently this is a thing on IDA 6.95
             except IndexError as e:
                 continue
 
-            # find the graph node (eg, basic block) that generated this citem
-            node = metadata.get_node(address)
+    #
+    # find the graph node (eg, basic block) that generated each citem. the
+    # node indexes are only meaningful to the snapshot that produced them,
+    # so both lookups must be made against the same metadata snapshot
+    #
 
-            # address not mapped to a node... weird. continue to the next citem
-            if not node:
-                #logger.warning("Failed to map node to basic block")
-                continue
+    snapshot = metadata.snapshot
+    all_addresses = sorted(set(itertools.chain.from_iterable(line2address.itervalues())))
+    node_indexes = snapshot.get_nodes(all_addresses)
 
-            #
-            # we made it this far, so we must have found a node that contains
-            # this citem. save the computed node_id to the list of of known
-            # nodes we have associated with this line of text
-            #
+    #
+    # an address not mapped to a node is reported with a negative node
+    # index (BADNODE), so we simply leave it out of the address2node map
+    #
+
+    address2node = {}
+    for address, node_index in itertools.izip(all_addresses, node_indexes):
+        if node_index < 0:
+            #logger.warning("Failed to map node to basic block")
+            continue
+        address2node[address] = snapshot.get_node_by_index(node_index).address
+
+    #
+    # now, we walk through the collected addresses one 'line_number' at a
+    # time in an effort to resolve the set of graph nodes associated with
+    # its citems.
+    #
 
-            nodes.add(node.address)
+    for line_number, addresses in line2address.iteritems():
 
         #
-        # finally, save the completed list of node ids as identified for this
+        # save the completed list of node ids as identified for this
         # line of decompilation text to the line2node map that we are building
         #
 
-        line2node[line_number] = nodes
+        line2node[line_number] = set(address2node[address] for address in addresses if address in address2node)
 
     # all done, return the computed map
     return line2node
@@ -10,7 +10,8 @@ from lighthouse.palette import LighthousePalette
 from lighthouse.painting import CoveragePainter
 from lighthouse.director import CoverageDirector
 from lighthouse.coverage import DatabaseCoverage
-from lighthouse.metadata import DatabaseMetadata, metadata_progress
+from lighthouse.metadata import DatabaseMetadata
+from lighthouse.backends.ida import metadata_progress
 
 # start the global logger *once*
 if not logging_started():
@@ -392,7 +393,7 @@ class Lighthouse(idaapi.plugin_t):
         # database metadata while the user will be busy selecting coverage files.
         #
 
-        future = self.director.refresh_metadata(progress_callback=metadata_progress)
+        self.director.refresh_metadata(progress_callback=metadata_progress)
 
         #
         # we will now prompt the user with an interactive file dialog so they
@@ -403,7 +404,7 @@ class Lighthouse(idaapi.plugin_t):
 
         # if no valid coveragee files were selected (and loaded), bail
         if not loaded_files:
-            self.director.metadata.abort_refresh()
+            self._abort_metadata_refresh()
             return
 
         # prompt the user to name the new coverage aggregate
@@ -420,13 +421,14 @@ class Lighthouse(idaapi.plugin_t):
             return
 
         #
-        # to continue any further, we need the database metadata. hopefully
-        # it has finished with its asynchronous collection, otherwise we will
-        # block until it completes. the user will be shown a progress dialog.
+        # to continue any further, we need the database metadata for the
+        # functions touched by the loaded coverage. we ask for these to be
+        # collected first, and block until they are ready. the rest of the
+        # database metadata will continue to be collected in the background.
         #
 
         idaapi.show_wait_box("Building database metadata...")
-        await_future(future)
+        await_future(self._prioritize_metadata(loaded_files))
 
         # aggregate all the selected files into one new coverage set
         new_coverage = self._aggregate_batch(loaded_files)
@@ -497,7 +499,7 @@ class Lighthouse(idaapi.plugin_t):
         # database metadata while the user will be busy selecting coverage files.
         #
 
-        future = self.director.refresh_metadata(progress_callback=metadata_progress)
+        self.director.refresh_metadata(progress_callback=metadata_progress)
 
         #
         # we will now prompt the user with an interactive file dialog so they
@@ -508,17 +510,18 @@ class Lighthouse(idaapi.plugin_t):
 
         # if no valid coveragee files were selected (and loaded), bail
         if not loaded_files:
-            self.director.metadata.abort_refresh()
+            self._abort_metadata_refresh()
             return
 
         #
-        # to continue any further, we need the database metadata. hopefully
-        # it has finished with its asynchronous collection, otherwise we will
-        # block until it completes. the user will be shown a progress dialog.
+        # to continue any further, we need the database metadata for the
+        # functions touched by the loaded coverage. we ask for these to be
+        # collected first, and block until they are ready. the rest of the
+        # database metadata will continue to be collected in the background.
         #
 
         idaapi.show_wait_box("Building database metadata...")
-        await_future(future)
+        await_future(self._prioritize_metadata(loaded_files))
 
         #
         # stop the director's aggregate from updating. this is in the interest
@@ -700,6 +703,45 @@ class Lighthouse(idaapi.plugin_t):
         """
         return DrcovData(filename)
 
+    def _prioritize_metadata(self, loaded_files):
+        """
+        Prioritize metadata collection for the functions touched by coverage.
+
+        Returns a future (Queue) that will carry the completion message.
+        """
+        addresses = set()
+
+        # the module & base address of this IDB (well, the root binary)
+        root_filename = idaapi.get_root_filename()
+        base = idaapi.get_imagebase()
+
+        # collect the (rebased) block addresses of all the loaded coverage
+        for data in loaded_files:
+            try:
+                coverage_blocks = data.get_blocks_by_module(root_filename)
+            except ValueError:
+                continue
+            addresses.update(address for address, _ in rebase_blocks(base, coverage_blocks))
+
+        # prioritize the collection of functions containing these addresses
+        return self.director.metadata.prioritize(addresses)
+
+    def _abort_metadata_refresh(self):
+        """
+        Abort the metadata refresh, unless loaded coverage depends on it.
+        """
+
+        #
+        # if coverage was already loaded (and mapped early), the metadata
+        # refresh may still be completing in the background. we leave it
+        # running so that the loaded coverage can be fully mapped.
+        #
+
+        if self.director.coverage_names:
+            return
+
+        self.director.metadata.abort_refresh()
+
     def _normalize_coverage(self, coverage_data, metadata):
         """
         Normalize loaded DrCov data to the database metadata.
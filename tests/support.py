@@ -0,0 +1,193 @@
+import os
+import sys
+import random
+
+#
+# the tests exercise lighthouse headless, outside of IDA. the lighthouse
+# package lives under plugin/ rather than the repository root
+#
+
+PLUGIN_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "plugin"))
+if PLUGIN_PATH not in sys.path:
+    sys.path.insert(0, PLUGIN_PATH)
+
+from lighthouse.backends import MetadataBackend
+
+#------------------------------------------------------------------------------
+# Synthetic Database
+#------------------------------------------------------------------------------
+
+class SyntheticBackend(MetadataBackend):
+    """
+    A metadata backend serving a randomly generated (but seeded) database.
+
+    Each function is a run of contiguous nodes, with a fall through edge
+    between consecutive nodes and a few random (eg, loop) edges. Functions
+    can be added, changed, removed, or renamed between metadata refreshes,
+    and can share nodes (eg, function chunks) with each other.
+    """
+
+    def __init__(self, function_count=40, seed=0):
+        super(SyntheticBackend, self).__init__()
+        self._random = random.Random(seed)
+
+        # function address --> (name, nodes, instructions, edges)
+        self._functions = {}
+
+        for i in xrange(function_count):
+            self.define_function(self.function_slot(i))
+
+    def function_slot(self, index):
+        """
+        Return the address of the given function slot.
+        """
+        return 0x401000 + index * 0x1000
+
+    #--------------------------------------------------------------------------
+    # Database Changes
+    #--------------------------------------------------------------------------
+
+    def define_function(self, address, name=None):
+        """
+        (Re)define a function with a new, random layout at the given address.
+        """
+        nodes, instructions, edges = [], [], []
+
+        current_address = address
+        node_count = self._random.randint(1, 8)
+        for node_id in xrange(node_count):
+            node_start = current_address
+            for _ in xrange(self._random.randint(1, 6)):
+                instructions.append(current_address)
+                current_address += self._random.randint(1, 7)
+            nodes.append((node_start, current_address, node_id))
+
+        # a fall through edge between consecutive nodes, and a few others
+        node_starts = [node[0] for node in nodes]
+        last_instructions = [
+            max(ea for ea in instructions if start <= ea < end)
+            for start, end, _ in nodes
+        ]
+        for i, edge_src in enumerate(last_instructions):
+            if i + 1 < node_count:
+                edges.append((edge_src, node_starts[i+1]))
+            if self._random.random() < 0.3:
+                edges.append((edge_src, self._random.choice(node_starts)))
+
+        name = name or "sub_%X" % address
+        self._functions[address] = (name, nodes, instructions, sorted(set(edges)))
+
+    def share_node(self, function_address, node_address):
+        """
+        Add the node at the given address to another function, as a chunk.
+
+        The node joins the function with an id of its own, entered by an
+        edge from the function's first node.
+        """
+        name, nodes, instructions, edges = self._functions[function_address]
+        node_start, node_end, _ = next(
+            node
+            for function in self._functions.itervalues()
+            for node in function[1] if node[0] == node_address
+        )
+        node_instructions = [
+            ea for ea in self.instructions() if node_start <= ea < node_end
+        ]
+        edge_src = max(ea for ea in instructions if nodes[0][0] <= ea < nodes[0][1])
+
+        self._functions[function_address] = (
+            name,
+            nodes + [(node_start, node_end, len(nodes))],
+            sorted(instructions + node_instructions),
+            sorted(set(edges + [(edge_src, node_start)]))
+        )
+
+    def undefine_function(self, address):
+        """
+        Remove the function at the given address.
+        """
+        del self._functions[address]
+
+    def rename_function(self, address, name):
+        """
+        Rename the function at the given address, notifying any listener.
+        """
+        _, nodes, instructions, edges = self._functions[address]
+        self._functions[address] = (name, nodes, instructions, edges)
+        if self._rename_callback:
+            self._rename_callback(address, name, False)
+
+    #--------------------------------------------------------------------------
+    # Test Data
+    #--------------------------------------------------------------------------
+
+    def instructions(self):
+        """
+        Return every instruction address in the database.
+        """
+        return sorted(set(
+            ea for function in self._functions.itervalues() for ea in function[2]
+        ))
+
+    def sample_coverage(self, fraction, seed):
+        """
+        Return a random sample of the instruction addresses (eg, coverage).
+        """
+        instructions = self.instructions()
+        sample = random.Random(seed).sample(instructions, int(len(instructions) * fraction))
+        return sorted(sample)
+
+    #--------------------------------------------------------------------------
+    # Providers
+    #--------------------------------------------------------------------------
+
+    def get_function_addresses(self):
+        return sorted(self._functions)
+
+    def get_function_owners(self, addresses):
+        owners = set()
+        for address in addresses:
+            for function_address, function in self._functions.iteritems():
+                if any(start <= address < end for start, end, _ in function[1]):
+                    owners.add(function_address)
+        return owners
+
+    def get_function_name(self, function_address):
+        return self._functions[function_address][0]
+
+    def get_function_nodes(self, function_address):
+        return list(self._functions[function_address][1])
+
+    def get_function_instructions(self, function_address):
+        return list(self._functions[function_address][2])
+
+    def get_edges(self, addresses):
+        addresses = set(addresses)
+        return [
+            edge
+            for function in self._functions.itervalues()
+            for edge in function[3] if edge[0] in addresses
+        ]
+
+#------------------------------------------------------------------------------
+# Helpers
+#------------------------------------------------------------------------------
+
+def refresh_metadata(metadata, function_addresses=None):
+    """
+    Refresh the given metadata, and wait for the refresh to complete.
+    """
+    result = metadata.refresh(function_addresses).get()
+    wait_for_refresh(metadata)
+    return result
+
+def wait_for_refresh(metadata):
+    """
+    Wait for a metadata refresh to finish in the background.
+
+    The refresh result is posted before the edges are collected, so the
+    refresh worker may still be running when the result is received.
+    """
+    worker = metadata._refresh_worker
+    if worker:
+        worker.join()
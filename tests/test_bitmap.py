@@ -0,0 +1,120 @@
+import random
+import unittest
+
+import support
+from lighthouse.util.bitmap import CompressedBitmap, CONTAINER_SIZE, \
+    ARRAY_CONTAINER, RUN_CONTAINER, BITMAP_CONTAINER
+
+class BitmapTest(unittest.TestCase):
+    """
+    Compressed bitmaps behave as sets of ordinals.
+    """
+
+    def setUp(self):
+        self.random = random.Random(0)
+
+    def random_set(self):
+        """
+        Return a random set of ordinals, mixing runs, sparse, and dense chunks.
+        """
+        ordinals = set()
+
+        for _ in xrange(self.random.randint(0, 6)):
+            base = self.random.randint(0, 4 * CONTAINER_SIZE)
+            kind = self.random.random()
+
+            # a clustered run of ordinals (eg, basic blocks)
+            if kind < 0.4:
+                ordinals.update(xrange(base, base + self.random.randint(1, 5000)))
+
+            # scattered ordinals, dense enough to be kept as a bitmap
+            elif kind < 0.7:
+                ordinals.update(self.random.sample(xrange(base, base + CONTAINER_SIZE), 3000))
+
+            # a few scattered ordinals
+            else:
+                ordinals.update(self.random.sample(xrange(base, base + CONTAINER_SIZE), 40))
+
+        return ordinals
+
+    def random_bitmap(self, ordinals):
+        """
+        Return a compressed bitmap of the given ordinals, compressed or not.
+        """
+        bitmap = CompressedBitmap.from_ordinals(ordinals)
+        return bitmap.compress() if self.random.random() < 0.5 else bitmap
+
+    def assertSameSet(self, bitmap, ordinals):
+        """
+        Assert the given bitmap holds exactly the given ordinals.
+        """
+        self.assertEqual(list(bitmap), sorted(ordinals))
+        self.assertEqual(len(bitmap), len(ordinals))
+        self.assertEqual(bool(bitmap), bool(ordinals))
+
+    def test_containers(self):
+        sparse = CompressedBitmap.from_ordinals([1, 7, 100])
+        clustered = CompressedBitmap.from_ordinals(xrange(100, 10000))
+        dense = CompressedBitmap.from_ordinals(xrange(0, CONTAINER_SIZE, 3))
+
+        # each chunk is stored in the container that is smallest for it
+        self.assertEqual(sparse._containers[0][0], ARRAY_CONTAINER)
+        self.assertEqual(clustered._containers[0][0], RUN_CONTAINER)
+        self.assertEqual(dense._containers[0][0], BITMAP_CONTAINER)
+
+        for bitmap in (sparse, clustered, dense):
+            self.assertSameSet(bitmap.compress(), set(bitmap))
+            self.assertEqual(CompressedBitmap.from_bitmap(bitmap.to_bitmap())._containers, bitmap._containers)
+
+    def test_algebra(self):
+        for _ in xrange(20):
+            a, b = self.random_set(), self.random_set()
+            bitmap_a, bitmap_b = self.random_bitmap(a), self.random_bitmap(b)
+
+            self.assertSameSet(bitmap_a | bitmap_b, a | b)
+            self.assertSameSet(bitmap_a & bitmap_b, a & b)
+            self.assertSameSet(bitmap_a ^ bitmap_b, a ^ b)
+            self.assertSameSet(bitmap_a - bitmap_b, a - b)
+
+            # the compressed forms of the results hold the same sets
+            self.assertSameSet(bitmap_a.union(bitmap_b), a | b)
+            self.assertSameSet(bitmap_a.difference(bitmap_b), a - b)
+            self.assertSameSet((bitmap_a ^ bitmap_b).compress(), a ^ b)
+
+            # the operands are left untouched
+            self.assertSameSet(bitmap_a, a)
+            self.assertSameSet(bitmap_b, b)
+
+    def test_membership(self):
+        ordinals = self.random_set() | set([0, CONTAINER_SIZE - 1, CONTAINER_SIZE])
+        bitmap = self.random_bitmap(ordinals)
+
+        for ordinal in self.random.sample(xrange(5 * CONTAINER_SIZE), 2000):
+            self.assertEqual(ordinal in bitmap, ordinal in ordinals)
+        for ordinal in ordinals:
+            self.assertTrue(ordinal in bitmap)
+
+    def test_runs(self):
+        for _ in xrange(20):
+            ordinals = self.random_set()
+            bitmap = self.random_bitmap(ordinals)
+
+            members = [x for start, stop in bitmap.runs() for x in xrange(start, stop)]
+            self.assertEqual(members, sorted(ordinals))
+
+    def test_bitmap_conversion(self):
+        for _ in xrange(20):
+            ordinals = self.random_set()
+            bitmap = self.random_bitmap(ordinals)
+
+            # build the (long) bitmap of the ordinals, highest bit first
+            bits = ["0"] * (max(ordinals) + 1 if ordinals else 1)
+            for ordinal in ordinals:
+                bits[ordinal] = "1"
+            long_bitmap = long("".join(reversed(bits)), 2)
+
+            self.assertEqual(bitmap.to_bitmap(), long_bitmap)
+            self.assertSameSet(CompressedBitmap.from_bitmap(long_bitmap), ordinals)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,199 @@
+import unittest
+
+import support
+from lighthouse.coverage import DatabaseCoverage
+from lighthouse.director import CoverageDirector, FRONTIER
+from lighthouse.composer.parser import CompositionParser
+
+class DirectorTestCase(unittest.TestCase):
+    """
+    Base test case, holding a director over a synthetic database.
+    """
+
+    def setUp(self):
+        self.backend = support.SyntheticBackend(function_count=60, seed=1)
+        self.director = CoverageDirector(None, self.backend)
+
+        # collect the metadata as the plugin does, before loading coverage
+        self.director.refresh_metadata().get()
+        support.wait_for_refresh(self.director.metadata)
+
+    def tearDown(self):
+        self.director.terminate()
+
+    def load_coverage(self, name, fraction, seed):
+        """
+        Load a random sample of the database instructions as coverage.
+        """
+        addresses = self.backend.sample_coverage(fraction, seed)
+        self.director.create_coverage(name, addresses)
+        return set(addresses)
+
+    def compose(self, text):
+        """
+        Evaluate the given composition against the loaded coverage.
+        """
+        shorthand = [self.director.get_shorthand(name) for name in self.director.coverage_names]
+        _, ast = CompositionParser().parse(text, shorthand)
+        self.director.add_composition(text, ast)
+        return self.director.get_coverage(text)
+
+class HeadlessDirectorTest(DirectorTestCase):
+    """
+    Coverage is mapped, composed, and reported without IDA or Qt.
+    """
+
+    def test_map_coverage(self):
+        addresses = self.load_coverage("a.log", 0.3, seed=1)
+        coverage = self.director.get_coverage("a.log")
+
+        instruction_count = len(self.backend.instructions())
+        self.assertEqual(set(coverage.data), addresses)
+        self.assertAlmostEqual(coverage.instruction_percent, float(len(addresses)) / instruction_count)
+
+        # each covered instruction is mapped to the function containing it
+        executed = sum(f.instructions_executed for f in coverage.functions.itervalues())
+        self.assertEqual(executed, len(addresses))
+        for function_coverage in coverage.functions.itervalues():
+            self.assertTrue(0 < function_coverage.instruction_percent <= 1.0)
+
+    def test_compose_coverage(self):
+        a = self.load_coverage("a.log", 0.3, seed=1)
+        b = self.load_coverage("b.log", 0.3, seed=2)
+
+        self.assertEqual(set(self.compose("A | B").data), a | b)
+        self.assertEqual(set(self.compose("A & B").data), a & b)
+        self.assertEqual(set(self.compose("A - B").data), a - b)
+
+    def test_report_coverage(self):
+        self.load_coverage("a.log", 0.5, seed=1)
+        coverage_string = self.director.get_coverage_string("a.log")
+        self.assertTrue(coverage_string.startswith("A - "))
+        self.assertTrue(coverage_string.endswith(" - a.log"))
+
+class AggregateTest(DirectorTestCase):
+    """
+    The aggregate is maintained incrementally as coverage is loaded.
+    """
+
+    def assertMapped(self, coverage, addresses):
+        """
+        Assert the given coverage is fully mapped to the given addresses.
+        """
+        metadata = self.director.metadata
+        nodes = set(metadata.get_node(address).address for address in addresses)
+        functions = set(metadata.get_function(address).address for address in addresses)
+
+        self.assertEqual(set(coverage.data), addresses)
+        self.assertEqual(set(coverage.nodes), nodes)
+        self.assertEqual(set(coverage.functions), functions)
+
+        executed = sum(f.instructions_executed for f in coverage.functions.itervalues())
+        self.assertEqual(executed, len(addresses))
+
+    def test_add_coverage(self):
+        a = self.load_coverage("a.log", 0.2, seed=1)
+        self.assertMapped(self.director.aggregate, a)
+
+        b = self.load_coverage("b.log", 0.2, seed=2)
+        self.assertMapped(self.director.aggregate, a | b)
+
+        # the aggregate shares the snapshot of the coverage merged into it
+        self.assertIs(self.director.aggregate.snapshot, self.director.metadata.snapshot)
+
+    def assertSameMapping(self, coverage, coverage_sets):
+        """
+        Assert the given coverage matches a fresh mapping of the given sets.
+        """
+        fresh = DatabaseCoverage([ea for addresses in coverage_sets for ea in addresses], None)
+        fresh.update_metadata(self.director.metadata)
+        fresh.refresh()
+
+        self.assertEqual(coverage.data, fresh.data)
+        self.assertEqual(coverage.coverage_hash, fresh.coverage_hash)
+        self.assertAlmostEqual(coverage.instruction_percent, fresh.instruction_percent)
+
+        self.assertEqual(set(coverage.nodes), set(fresh.nodes))
+        for address, node_coverage in fresh.nodes.iteritems():
+            self.assertEqual(coverage.nodes[address].hits, node_coverage.hits)
+
+        self.assertEqual(set(coverage.functions), set(fresh.functions))
+        for address, function_coverage in fresh.functions.iteritems():
+            self.assertEqual(coverage.functions[address].hits, function_coverage.hits)
+            self.assertEqual(coverage.functions[address].node_percent, function_coverage.node_percent)
+            self.assertEqual(coverage.functions[address].instruction_percent, function_coverage.instruction_percent)
+
+        self.assertEqual(coverage.frontier(), fresh.frontier())
+        return fresh
+
+    def assertRarity(self, coverage_sets):
+        """
+        Assert the director's rarity counts the sets hitting each address.
+        """
+        for address in set.union(*coverage_sets):
+            count = sum(address in addresses for addresses in coverage_sets)
+            self.assertEqual(self.director.rarity.count(address), count)
+
+    def assertFrontier(self, fresh):
+        """
+        Assert the director's frontier set matches that of the given mapping.
+        """
+        self.director.select_coverage(FRONTIER)
+        frontier = DatabaseCoverage(fresh.frontier_coverage(), None)
+        self.assertTrue(frontier.data)
+        self.assertEqual(self.director.coverage.data, frontier.data)
+
+    def test_delete_coverage(self):
+        a = self.load_coverage("a.log", 0.05, seed=1)
+        b = self.load_coverage("b.log", 0.05, seed=2)
+        c = self.load_coverage("c.log", 0.05, seed=3)
+        aggregate = self.director.aggregate
+
+        # the nodes & functions not covered by the set to be deleted
+        metadata = self.director.metadata
+        b_nodes = set(metadata.get_node(address).address for address in b)
+        b_functions = set(metadata.get_function(address).address for address in b)
+        untouched_nodes = {
+            address: node_coverage for address, node_coverage
+            in aggregate.nodes.iteritems() if address not in b_nodes
+        }
+        untouched_functions = {
+            address: function_coverage for address, function_coverage
+            in aggregate.functions.iteritems() if address not in b_functions
+        }
+
+        self.director.delete_coverage("b.log")
+        self.assertIs(self.director.aggregate, aggregate)
+        fresh = self.assertSameMapping(aggregate, [a, c])
+        self.assertRarity([a, c])
+        self.assertFrontier(fresh)
+
+        # only the nodes & functions covered by the deleted set are re-mapped
+        for address, node_coverage in untouched_nodes.iteritems():
+            self.assertIs(aggregate.nodes[address], node_coverage)
+        for address, function_coverage in untouched_functions.iteritems():
+            self.assertIs(aggregate.functions[address], function_coverage)
+
+    def test_update_coverage(self):
+        a = self.load_coverage("a.log", 0.1, seed=1)
+        self.load_coverage("b.log", 0.1, seed=2)
+        c = self.load_coverage("c.log", 0.1, seed=3)
+
+        b = set(self.backend.sample_coverage(0.1, seed=4))
+        self.director.update_coverage("b.log", sorted(b))
+        fresh = self.assertSameMapping(self.director.aggregate, [a, b, c])
+        self.assertRarity([a, b, c])
+        self.assertFrontier(fresh)
+
+    def test_batch_load(self):
+        self.director.suspend_aggregation()
+        coverage_sets = [
+            self.load_coverage("%u.log" % seed, 0.1, seed) for seed in xrange(5)
+        ]
+        self.director.resume_aggregation()
+
+        self.assertSameMapping(self.director.aggregate, coverage_sets)
+        self.assertRarity(coverage_sets)
+
+if __name__ == "__main__":
+    unittest.main()
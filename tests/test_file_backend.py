@@ -0,0 +1,104 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import support
+from lighthouse.metadata import DatabaseMetadata
+from lighthouse.backends import FileMetadataBackend
+
+class FileBackendTest(unittest.TestCase):
+    """
+    Exported metadata is loaded back exactly as it was collected.
+    """
+
+    def setUp(self):
+        self.backend = support.SyntheticBackend(function_count=40, seed=3)
+        self.directory = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.directory, "metadata.lhmd")
+        self.metadata = None
+        self.loaded = None
+
+    def tearDown(self):
+        for metadata in (self.metadata, self.loaded):
+            if metadata:
+                metadata.terminate()
+        shutil.rmtree(self.directory)
+
+    def roundtrip(self):
+        """
+        Collect, export, and load back the metadata of the database.
+        """
+        self.metadata = DatabaseMetadata(self.backend)
+        support.refresh_metadata(self.metadata)
+        self.metadata.export(self.filepath)
+
+        self.loaded = DatabaseMetadata(FileMetadataBackend(self.filepath))
+        support.refresh_metadata(self.loaded)
+        return self.metadata.snapshot, self.loaded.snapshot
+
+    def assertSameMetadata(self, snapshot, loaded):
+        """
+        Assert the loaded metadata matches the collected metadata.
+        """
+        self.assertEqual(loaded.instructions, snapshot.instructions)
+        self.assertEqual(loaded._build_lookups(), snapshot._build_lookups())
+
+        self.assertEqual(loaded.functions.viewkeys(), snapshot.functions.viewkeys())
+        for address, function_metadata in snapshot.functions.iteritems():
+            loaded_function = loaded.functions[address]
+            self.assertTrue(loaded_function == function_metadata)
+            self.assertEqual(loaded_function.edges, function_metadata.edges)
+            self.assertEqual(loaded_function.instruction_count, function_metadata.instruction_count)
+
+            for node_address, node_metadata in function_metadata.nodes.iteritems():
+                loaded_node = loaded_function.nodes[node_address]
+                self.assertEqual(loaded_node.id, node_metadata.id)
+                self.assertEqual(list(loaded_node.instructions), list(node_metadata.instructions))
+                self.assertIs(loaded_node.function, loaded_function)
+
+        # each node is found under the same function as it was collected
+        self.assertEqual(loaded.nodes.viewkeys(), snapshot.nodes.viewkeys())
+        for address, node_metadata in snapshot.nodes.iteritems():
+            self.assertEqual(loaded.nodes[address].function.address, node_metadata.function.address)
+
+        self.assertEqual(loaded.get_edges(), snapshot.get_edges())
+
+    def test_roundtrip(self):
+        snapshot, loaded = self.roundtrip()
+        self.assertSameMetadata(snapshot, loaded)
+
+    def test_shared_nodes(self):
+        slot = self.backend.function_slot
+
+        # share the first node of a few functions with others
+        shared = [(slot(2), slot(5)), (slot(9), slot(5)), (slot(30), slot(31))]
+        for function_address, node_address in shared:
+            self.backend.share_node(function_address, node_address)
+
+        snapshot, loaded = self.roundtrip()
+        self.assertSameMetadata(snapshot, loaded)
+
+        # the file backend serves the shared nodes as the database did
+        file_backend = FileMetadataBackend(self.filepath)
+        for function_address, node_address in shared:
+            self.assertEqual(
+                sorted(file_backend.get_function_nodes(function_address)),
+                sorted(self.backend.get_function_nodes(function_address))
+            )
+            self.assertEqual(
+                file_backend.get_function_instructions(function_address),
+                self.backend.get_function_instructions(function_address)
+            )
+            self.assertEqual(
+                file_backend.get_function_owners([node_address]),
+                self.backend.get_function_owners([node_address])
+            )
+
+    def test_invalid_file(self):
+        with open(self.filepath, "wb") as f:
+            f.write("LHMD")
+        self.assertRaises(ValueError, FileMetadataBackend, self.filepath)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+import random
+import unittest
+
+import support
+from lighthouse.metadata import DatabaseMetadata, MetadataDelta
+
+class MetadataTestCase(unittest.TestCase):
+    """
+    Base test case, holding metadata collected from a synthetic database.
+    """
+
+    def setUp(self):
+        self.backend = support.SyntheticBackend(function_count=50, seed=2)
+        self.metadata = DatabaseMetadata(self.backend)
+        support.refresh_metadata(self.metadata)
+
+    def tearDown(self):
+        self.metadata.terminate()
+
+class RefreshTest(MetadataTestCase):
+    """
+    Incrementally refreshed metadata matches a fresh collection.
+    """
+
+    def assertSameMetadata(self, metadata):
+        """
+        Assert the given metadata matches a fresh collection of the database.
+        """
+        fresh = DatabaseMetadata(self.backend)
+        support.refresh_metadata(fresh)
+
+        snapshot, fresh_snapshot = metadata.snapshot, fresh.snapshot
+        self.assertEqual(snapshot.instructions, fresh_snapshot.instructions)
+
+        # the (derived) lookups of the snapshot match those built from scratch
+        lookups = (
+            snapshot._node_addresses,
+            snapshot._node_ends,
+            snapshot._node_instruction_starts,
+            snapshot._node_instruction_ends,
+            snapshot._function_addresses,
+            snapshot._function_ordinals,
+            snapshot.instruction_count
+        )
+        self.assertEqual(lookups, fresh_snapshot._build_lookups())
+
+        self.assertEqual(snapshot.functions.viewkeys(), fresh_snapshot.functions.viewkeys())
+        for address, function_metadata in fresh_snapshot.functions.iteritems():
+            self.assertTrue(snapshot.functions[address] == function_metadata)
+            self.assertEqual(snapshot.functions[address].edges, function_metadata.edges)
+
+        self.assertEqual(snapshot.nodes.viewkeys(), fresh_snapshot.nodes.viewkeys())
+        self.assertEqual(snapshot.get_edges(), fresh_snapshot.get_edges())
+        fresh.terminate()
+
+    def change_database(self, seed, remove=True):
+        """
+        Make scattered changes to the database.
+        """
+        rng = random.Random(seed)
+        slots = rng.sample(xrange(80), 30)
+
+        for index in slots[:10]:
+            self.backend.define_function(self.backend.function_slot(index))
+        for index in slots[10:20]:
+            address = self.backend.function_slot(index)
+            if remove and address in self.backend.get_function_addresses():
+                self.backend.undefine_function(address)
+        for index in slots[20:]:
+            address = self.backend.function_slot(index)
+            if address in self.backend.get_function_addresses():
+                self.backend.rename_function(address, "renamed_%u" % index)
+
+    def test_full_refresh(self):
+        for seed in xrange(5):
+            self.change_database(seed)
+            support.refresh_metadata(self.metadata)
+            self.assertSameMetadata(self.metadata)
+
+    def test_partial_refresh(self):
+        for seed in xrange(5):
+            self.change_database(seed, remove=False)
+
+            # refresh only the functions of the database, by address
+            function_addresses = self.backend.get_function_addresses()
+            support.refresh_metadata(self.metadata, function_addresses)
+            self.assertSameMetadata(self.metadata)
+
+class RenameTest(MetadataTestCase):
+    """
+    Renames are published as new snapshots, sharing the unchanged metadata.
+    """
+
+    def test_rename(self):
+        address = self.backend.function_slot(7)
+        parent = self.metadata.snapshot
+
+        self.backend.rename_function(address, "renamed_function")
+        snapshot = self.metadata.snapshot
+
+        # the rename is published as a new snapshot
+        self.assertEqual(snapshot.version, parent.version + 1)
+        self.assertEqual(snapshot.functions[address].name, "renamed_function")
+        self.assertEqual(parent.functions[address].name, "sub_%X" % address)
+
+        # the renamed function is found by any address within it
+        node_address = max(snapshot.functions[address].nodes)
+        self.assertIs(snapshot.get_function(node_address), snapshot.functions[address])
+        self.assertEqual(self.metadata.get_function_by_name("renamed_function").address, address)
+
+        # the node & instruction metadata is shared with the parent snapshot
+        self.assertIs(snapshot.nodes, parent.nodes)
+        self.assertIs(snapshot.instructions, parent.instructions)
+        self.assertIs(snapshot.get_edges(), parent.get_edges())
+
+    def test_rename_then_refresh(self):
+        address = self.backend.function_slot(3)
+        self.backend.rename_function(address, "first_name")
+        self.backend.rename_function(address, "second_name")
+
+        # a refresh of the database keeps the latest name
+        support.refresh_metadata(self.metadata)
+        self.assertEqual(self.metadata.functions[address].name, "second_name")
+        self.assertEqual(len(self.metadata.functions), 50)
+
+class DeltaTest(MetadataTestCase):
+    """
+    Changes to the function layouts are detected, even if fingerprints collide.
+    """
+
+    def test_fingerprint_collision(self):
+        address = self.backend.function_slot(5)
+        old_metadata = self.metadata
+
+        # collect the metadata again, after the function has been redefined
+        self.backend.define_function(address)
+        new_metadata = DatabaseMetadata(self.backend)
+        support.refresh_metadata(new_metadata)
+
+        old_function = old_metadata.functions[address]
+        new_function = new_metadata.functions[address]
+        self.assertFalse(new_function == old_function)
+
+        # force the fingerprints of the two versions of the function to collide
+        new_function.fingerprint = old_function.fingerprint
+        self.assertFalse(new_function.same_layout(old_function))
+        self.assertFalse(new_function == old_function)
+
+        delta = MetadataDelta(new_metadata, old_metadata)
+        self.assertEqual(delta.functions_modified, set([address]))
+        self.assertTrue(delta.nodes_added | delta.nodes_removed | delta.nodes_modified)
+        new_metadata.terminate()
+
+    def test_same_layout(self):
+        address = self.backend.function_slot(5)
+        new_metadata = DatabaseMetadata(self.backend)
+        support.refresh_metadata(new_metadata)
+
+        # separately collected, but equal functions
+        new_function = new_metadata.functions[address]
+        self.assertIsNot(new_function, self.metadata.functions[address])
+        self.assertTrue(new_function == self.metadata.functions[address])
+
+        delta = MetadataDelta(new_metadata, self.metadata)
+        self.assertFalse(delta.functions_modified | delta.nodes_modified)
+        new_metadata.terminate()
+
+if __name__ == "__main__":
+    unittest.main()